@@ -0,0 +1,102 @@
+"""
+Dict-of-dicts BM25 (search_engine.bm25) vs. the NumPy ArrayIndex engine and
+MaxScore top-k retrieval on synthetic corpora of growing size.
+
+    python -m benchmarks.bench_bm25 --sizes 70,1000,10000,100000,1000000
+"""
+import argparse
+import json
+import time
+
+from search_engine.array_index import ArrayIndex
+from search_engine.bm25 import bm25_score
+from search_engine.preprocess import preprocess
+from search_engine.topk import TopKStats, maxscore_top_k
+
+from .synthetic import synthetic_payload, synthetic_queries
+
+def _time_queries(fn, queries, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for q in queries:
+            fn(q)
+        best = min(best, time.perf_counter() - start)
+    return best / len(queries)
+
+def run(n_docs: int, n_queries: int, terms_per_doc: int, top_k: int, repeat: int) -> dict:
+    t0 = time.perf_counter()
+    payload = synthetic_payload(n_docs, terms_per_doc=terms_per_doc, with_docs=False)
+    gen_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    arrays = ArrayIndex.from_payload(payload)
+    build_s = time.perf_counter() - t0
+
+    queries = [preprocess(q) for q in synthetic_queries(list(payload["index"]), n_queries, seed=n_docs)]
+    index, doc_lengths, idf = payload["index"], payload["doc_lengths"], payload["idf"]
+
+    def dict_path(terms):
+        scores = bm25_score(terms, index=index, doc_lengths=doc_lengths, idf=idf)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+    def array_path(terms):
+        return arrays.top_k(terms, top_k)
+
+    def maxscore_path(terms):
+        return maxscore_top_k(arrays, terms, top_k)
+
+    for terms in queries[:50]:
+        expected = dict_path(terms)
+        if expected != array_path(terms) or expected != maxscore_path(terms):
+            raise AssertionError(f"results differ for {terms}")
+
+    pruning = TopKStats()
+    for terms in queries:
+        maxscore_top_k(arrays, terms, top_k, stats=pruning)
+
+    dict_s = _time_queries(dict_path, queries, repeat)
+    array_s = _time_queries(array_path, queries, repeat)
+    maxscore_s = _time_queries(maxscore_path, queries, repeat)
+    return {
+        "n_docs": n_docs,
+        "postings": int(len(arrays.doc_nums)),
+        "generate_s": round(gen_s, 3),
+        "array_build_s": round(build_s, 3),
+        "dict_ms_per_query": round(dict_s * 1000, 4),
+        "numpy_ms_per_query": round(array_s * 1000, 4),
+        "speedup": round(dict_s / array_s, 2) if array_s else None,
+        "maxscore_ms_per_query": round(maxscore_s * 1000, 4),
+        "maxscore_postings_evaluated": pruning.postings_evaluated,
+        "maxscore_postings_skipped": pruning.postings_skipped,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="70,1000,10000,100000,1000000", help="Comma-separated corpus sizes")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--terms-per-doc", type=int, default=16)
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    rows = []
+    print(f"{'docs':>9} {'postings':>10} {'dict ms/q':>10} {'numpy ms/q':>11} {'speedup':>8} "
+          f"{'maxscore ms/q':>14} {'skipped':>8}")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        row = run(size, args.queries, args.terms_per_doc, args.top, args.repeat)
+        rows.append(row)
+        scanned = row["maxscore_postings_evaluated"] + row["maxscore_postings_skipped"]
+        skipped = row["maxscore_postings_skipped"] / scanned if scanned else 0.0
+        print(f"{row['n_docs']:>9} {row['postings']:>10} {row['dict_ms_per_query']:>10} "
+              f"{row['numpy_ms_per_query']:>11} {row['speedup']:>7}x "
+              f"{row['maxscore_ms_per_query']:>14} {skipped:>8.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "bm25", "results": rows}, f, indent=2)
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Index build scaling with 1..N worker processes on synthetic publications:
+build_inverted_index vs. build_inverted_index_parallel, and build_indexes vs.
+build_indexes_parallel (what `search_engine.indexer --workers N` runs). Every
+parallel build is checked against the serial one: the same saved postings
+for the former, byte-identical index.bin / index.fields for the latter.
+
+    python -m benchmarks.bench_build --docs 50000 --workers 1,2,4,8
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from search_engine.binindex import fields_path_for, write_binary_index
+from search_engine.indexer import (
+    build_documents,
+    build_indexes,
+    build_indexes_parallel,
+    build_inverted_index,
+    build_inverted_index_parallel,
+)
+
+from .synthetic import synthetic_publications
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _serialized(index, doc_lengths) -> str:
+    return json.dumps({"index": index, "doc_lengths": doc_lengths}, ensure_ascii=False)
+
+def _written(docs, built, path: str) -> bytes:
+    """The binary index files written from build_indexes output."""
+    index, doc_lengths, fields = built
+    write_binary_index(path, docs, index, doc_lengths, fields)
+    return Path(path).read_bytes() + Path(fields_path_for(path)).read_bytes()
+
+def _scale(name, serial, parallel, same, worker_counts, repeat):
+    serial_s, expected = _best_of(serial, repeat)
+    print(f"\n{name}")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+    print(f"{'serial':>8} {serial_s:>9.2f} {1.0:>7.2f}x")
+    rows = []
+    for workers in worker_counts:
+        seconds, result = _best_of(lambda: parallel(workers), repeat)
+        if not same(result, expected):
+            raise AssertionError(f"{name} with {workers} workers differs from the serial build")
+        rows.append({"workers": workers, "seconds": round(seconds, 3), "speedup": round(serial_s / seconds, 2)})
+        print(f"{workers:>8} {seconds:>9.2f} {serial_s / seconds:>7.2f}x")
+    return serial_s, rows
+
+def main():
+    cpus = os.cpu_count() or 1
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=50000)
+    ap.add_argument("--workers", default=",".join(str(w) for w in sorted({1, 2, 4, cpus}) if w <= max(cpus, 4)),
+                    help="Comma-separated worker counts")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    docs = build_documents(synthetic_publications(args.docs, seed=7))
+    worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+    print(f"Documents: {len(docs)}, CPUs: {cpus}")
+
+    serial_s, rows = _scale(
+        "build_inverted_index_parallel",
+        lambda: _serialized(*build_inverted_index(docs)),
+        lambda workers: _serialized(*build_inverted_index_parallel(docs, workers)),
+        lambda got, expected: got == expected,
+        worker_counts,
+        args.repeat,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        expected_files = {}
+
+        def same_files(built, expected):
+            if "serial" not in expected_files:
+                expected_files["serial"] = _written(docs, expected, os.path.join(tmp, "serial.bin"))
+            return _written(docs, built, os.path.join(tmp, "parallel.bin")) == expected_files["serial"]
+
+        indexes_serial_s, indexes_rows = _scale(
+            "build_indexes_parallel",
+            lambda: build_indexes(docs),
+            lambda workers: build_indexes_parallel(docs, workers),
+            same_files,
+            worker_counts,
+            args.repeat,
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "benchmark": "build",
+                "docs": len(docs),
+                "cpus": cpus,
+                "serial_s": round(serial_s, 3),
+                "results": rows,
+                "indexes_serial_s": round(indexes_serial_s, 3),
+                "indexes_results": indexes_rows,
+            }, f, indent=2)
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
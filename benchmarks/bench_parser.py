@@ -0,0 +1,78 @@
+"""
+Parser throughput on saved HTML fixtures: the three separate parser calls the
+crawler used to make per page (three BeautifulSoup trees) vs. analyze_page
+(one tree).
+
+    python -m benchmarks.bench_parser
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from search_engine.parser import (
+    analyze_page,
+    extract_links,
+    parse_list_page_for_publications,
+    parse_publication_page,
+)
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+BASE_URL = "https://pureportal.coventry.ac.uk"
+
+def load_fixtures():
+    pages = []
+    for path in sorted(FIXTURES_DIR.glob("*.html")):
+        is_pub = path.stem.startswith("publication")
+        url = f"{BASE_URL}/en/{'publications' if is_pub else 'organisations'}/{path.stem}/"
+        pages.append((url, path.read_text(encoding="utf-8"), is_pub))
+    return pages
+
+def separate_parses(url, html, is_pub):
+    return {
+        "links": extract_links(url, html),
+        "list_publications": parse_list_page_for_publications(url, html),
+        "publication": parse_publication_page(url, html) if is_pub else None,
+    }
+
+def single_parse(url, html, is_pub):
+    return analyze_page(url, html, parse_publication=is_pub)
+
+def pages_per_second(fn, pages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url, html, is_pub in pages:
+            fn(url, html, is_pub)
+    return rounds * len(pages) / (time.perf_counter() - start)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    pages = load_fixtures()
+    for url, html, is_pub in pages:
+        if separate_parses(url, html, is_pub) != single_parse(url, html, is_pub):
+            raise AssertionError(f"parse results differ for {url}")
+
+    before = pages_per_second(separate_parses, pages, args.rounds)
+    after = pages_per_second(single_parse, pages, args.rounds)
+    result = {
+        "benchmark": "parser",
+        "fixtures": len(pages),
+        "pages_per_sec_before": round(before, 1),
+        "pages_per_sec_after": round(after, 1),
+        "speedup": round(after / before, 2),
+    }
+    print(f"Fixtures: {len(pages)}")
+    print(f"Separate parses: {before:8.1f} pages/sec")
+    print(f"analyze_page:    {after:8.1f} pages/sec ({result['speedup']}x)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
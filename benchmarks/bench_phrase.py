@@ -0,0 +1,113 @@
+"""
+Positional index cost: binary index size with and without positions, and
+query latency for bag-of-words, proximity-reranked and "quoted phrase"
+queries on synthetic publications. Phrases are two-word spans taken from
+the abstracts, so every phrase query has at least one match.
+
+    python -m benchmarks.bench_phrase --docs 20000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from search_engine.binindex import BinaryIndex, fields_path_for, write_binary_index
+from search_engine.indexer import build_documents, build_indexes
+from search_engine.positions import build_positions, parse_phrases, phrase_matches
+from search_engine.preprocess import preprocess
+from search_engine.search import search
+
+from .synthetic import synthetic_publications
+
+def _latencies_ms(fn, queries, repeat):
+    out = []
+    for q in queries:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(q)
+            best = min(best, time.perf_counter() - start)
+        out.append(best * 1000)
+    return out
+
+def _summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+    }
+
+def _index_bytes(path):
+    return os.path.getsize(path) + os.path.getsize(fields_path_for(path))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    docs = build_documents(synthetic_publications(args.docs, seed=11))
+    index, doc_lengths, fields = build_indexes(docs)
+    start = time.perf_counter()
+    positions = build_positions(docs)
+    positions_s = time.perf_counter() - start
+
+    rng = random.Random(5)
+    doc_list = list(docs.values())
+    phrases = []
+    while len(phrases) < args.queries:
+        terms = preprocess(rng.choice(doc_list)["abstract"])
+        i = rng.randrange(len(terms) - 1)
+        phrases.append(f"{terms[i]} {terms[i + 1]}")
+
+    with tempfile.TemporaryDirectory(prefix="bench-phrase-") as tmp:
+        plain_path = os.path.join(tmp, "plain.bin")
+        pos_path = os.path.join(tmp, "positions.bin")
+        write_binary_index(plain_path, docs, index, doc_lengths, fields)
+        write_binary_index(pos_path, docs, index, doc_lengths, fields, positions)
+        plain_bytes, pos_bytes = _index_bytes(plain_path), _index_bytes(pos_path)
+
+        plain, positional = BinaryIndex(plain_path), BinaryIndex(pos_path)
+        try:
+            for q in phrases[:20]:
+                matched = {r["id"] for r in search(f'"{q}"', positional, top_k=1000)}
+                expected = phrase_matches(positional["positions"], parse_phrases(f'"{q}"')[0])
+                if not matched or len(matched) != min(len(expected), 1000):
+                    raise AssertionError(f"phrase results differ for {q!r}")
+            rows = {
+                "bag_of_words": _summary(_latencies_ms(lambda q: search(q, plain), phrases, args.repeat)),
+                "proximity": _summary(_latencies_ms(lambda q: search(q, positional), phrases, args.repeat)),
+                "phrase": _summary(_latencies_ms(lambda q: search(f'"{q}"', positional), phrases, args.repeat)),
+            }
+        finally:
+            plain.close()
+            positional.close()
+
+    overhead = (pos_bytes - plain_bytes) / plain_bytes
+    print(f"Documents: {len(docs)}, terms: {len(index)}, positions built in {positions_s:.2f}s")
+    print(f"Index size: {plain_bytes / 1e6:.1f} MB without positions, {pos_bytes / 1e6:.1f} MB with "
+          f"(+{overhead:.0%})")
+    print(f"{'query':>14} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, row in rows.items():
+        print(f"{name:>14} {row['mean_ms']:>9.3f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "benchmark": "phrase",
+                "docs": len(docs),
+                "index_bytes": plain_bytes,
+                "index_bytes_with_positions": pos_bytes,
+                "overhead": round(overhead, 4),
+                "results": rows,
+            }, f, indent=2)
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
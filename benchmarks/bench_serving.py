@@ -0,0 +1,125 @@
+"""
+Load test of the web app: requests/sec and latency percentiles with N
+concurrent clients, served over ASGI by uvicorn (async views on a bounded
+thread pool) and over WSGI by the threaded runserver (sync views). Each
+server runs in its own process against the index in data/; the clients
+cycle through a fixed query list.
+
+    python -m benchmarks.bench_serving --concurrency 16 --requests 2000
+    python -m benchmarks.bench_serving --servers uvicorn --path "/api/search?q={q}"
+
+--wsgi-cmd swaps in another WSGI server, e.g.
+"gunicorn -w 1 --threads 8 -b 127.0.0.1:{port} main.wsgi:application".
+"""
+import argparse
+import json
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+QUERIES = [
+    "machine learning", "neural network", "data", "optimisation model", "author:brusey",
+    "year:2021 learning", "\"machine learning\"", "energy systems", "deep learning images", "simulation",
+]
+
+SERVERS = {
+    "uvicorn": "{python} -m uvicorn main.asgi:application --host 127.0.0.1 --port {port} --log-level warning",
+    "wsgi": "{python} manage.py runserver 127.0.0.1:{port} --noreload",
+}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _start(cmd: str, port: int) -> subprocess.Popen:
+    args = shlex.split(cmd.format(python=shlex.quote(sys.executable), port=port))
+    proc = subprocess.Popen(args, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {cmd}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return proc
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server did not start: {cmd}")
+
+def _fetch(url: str):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def run_load(port: int, path: str, requests: int, concurrency: int, warmup: int = 50):
+    urls = [
+        f"http://127.0.0.1:{port}" + path.format(q=urllib.parse.quote_plus(QUERIES[i % len(QUERIES)]))
+        for i in range(requests)
+    ]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_fetch, urls[:warmup]))
+        start = time.perf_counter()
+        timings = list(pool.map(_fetch, urls))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(t * 1000 for t, _ in timings)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, ok in timings if not ok),
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "p50_ms": round(_percentile(latencies, 0.50), 2),
+        "p95_ms": round(_percentile(latencies, 0.95), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--servers", default="uvicorn,wsgi", help="Comma-separated: uvicorn, wsgi")
+    ap.add_argument("--wsgi-cmd", default=SERVERS["wsgi"], help="WSGI server command ({python}, {port})")
+    ap.add_argument("--path", default="/search/?q={q}", help="Request path; {q} is replaced by a query")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--port", type=int, default=0, help="First server port (0 = any free port)")
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    commands = dict(SERVERS, wsgi=args.wsgi_cmd)
+    results = {}
+    for i, name in enumerate(s.strip() for s in args.servers.split(",") if s.strip()):
+        port = args.port + i if args.port else _free_port()
+        proc = _start(commands[name], port)
+        try:
+            results[name] = run_load(port, args.path, args.requests, args.concurrency)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+        r = results[name]
+        print(f"{name:8s} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms  "
+              f"p99 {r['p99_ms']:7.2f} ms  errors {r['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"path": args.path, "concurrency": args.concurrency, "servers": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
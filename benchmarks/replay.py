@@ -0,0 +1,331 @@
+"""
+Replay recorded search requests against an index, to check the performance
+and the rankings of a new index before deploying it.
+
+Recorded requests are read from any mix of
+  - query logs written by search_engine.instrument (data/query_log.jsonl)
+    or benchmarks.synthetic: JSON lines with "query" (or "q"), optional
+    "stem" and "ts"
+  - JSON lines with a recorded "path", e.g. {"path": "/search/?q=data&stem=1"}
+  - Django runserver logs: [17/Oct/2025 10:00:00] "GET /search/?q=data&stem=1 HTTP/1.1" 200 5123
+Only /search/ and /api/search requests with a query are replayed.
+
+The requests are driven through search_engine.search.search in-process, or
+through the Django app with the test client (--target django), by
+--concurrency threads. By default they are sent as fast as possible; --rate
+paces them at a fixed number of requests/sec and --speed replays the
+recorded timestamps (2 = twice as fast). When paced, latency is measured
+from the scheduled send time, so a backlog shows up in the tail.
+
+With --compare-index the same requests are replayed against a second index,
+and the top results of every distinct query are compared between the two.
+
+    python -m benchmarks.replay data/query_log.jsonl --index data/index.bin
+    python -m benchmarks.replay runserver.log --target django --concurrency 8 --rate 50
+    python -m benchmarks.replay data/query_log.jsonl --index data/index.bin --compare-index /tmp/new/index.bin
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from search_engine.config import default_index_path
+from search_engine.result_cache import ResultCache
+from search_engine.search import search
+from search_engine.storage import index_watch_paths, load_index
+
+REPLAYED_PATHS = ("/search/", "/api/search")
+SKIPPED_KINDS = ("browse", "batch", "suggest")
+# As in main/settings.py and core/views.py.
+DEFAULT_ENGINE = "maxscore"
+DEFAULT_TOP = 15
+
+_ACCESS_RE = re.compile(r'^\[(?P<time>[^\]]+)\]\s+"(?:GET|HEAD) (?P<path>\S+) HTTP/[\d.]+"\s+(?P<status>\d{3})')
+
+@dataclass
+class Recorded:
+    query: str
+    stem: bool = False
+    ts: Optional[float] = None
+
+def _truthy(value) -> bool:
+    return value is True or str(value).lower() in ("1", "true", "yes", "on")
+
+def _from_path(path: str, ts: Optional[float]) -> Optional[Recorded]:
+    url = urllib.parse.urlsplit(path)
+    if url.path.rstrip("/") not in (p.rstrip("/") for p in REPLAYED_PATHS):
+        return None
+    params = urllib.parse.parse_qs(url.query)
+    query = (params.get("q") or [""])[0].strip()
+    if not query:
+        return None
+    return Recorded(query, _truthy((params.get("stem") or [""])[0]), ts)
+
+def _from_json(record: Dict) -> Optional[Recorded]:
+    ts = record.get("ts")
+    ts = float(ts) if isinstance(ts, (int, float)) else None
+    if "path" in record:
+        return _from_path(str(record["path"]), ts)
+    if record.get("kind") in SKIPPED_KINDS:
+        return None
+    query = str(record.get("q") or record.get("query") or "").strip()
+    if not query:
+        return None
+    return Recorded(query, _truthy(record.get("stem", False)), ts)
+
+def _from_access_log(line: str) -> Optional[Recorded]:
+    m = _ACCESS_RE.match(line)
+    if m is None or not m.group("status").startswith("2"):
+        return None
+    try:
+        ts = datetime.strptime(m.group("time"), "%d/%b/%Y %H:%M:%S").timestamp()
+    except ValueError:
+        ts = None
+    return _from_path(m.group("path"), ts)
+
+def read_requests(paths: Iterable[str]) -> Iterator[Recorded]:
+    """Recorded search requests from query logs and access logs; other lines are skipped."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("{"):
+                    try:
+                        recorded = _from_json(json.loads(line))
+                    except ValueError:
+                        continue
+                else:
+                    recorded = _from_access_log(line)
+                if recorded is not None:
+                    yield recorded
+
+def schedule(requests: List[Recorded], rate: float = 0.0, speed: float = 0.0) -> Optional[List[float]]:
+    """Send offsets in seconds: recorded timing / speed, or 1 / rate apart; None to send at once."""
+    if speed > 0 and requests and all(r.ts is not None for r in requests):
+        first = min(r.ts for r in requests)
+        return [(r.ts - first) / speed for r in requests]
+    if rate > 0:
+        return [i / rate for i in range(len(requests))]
+    return None
+
+def _percentile(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class InProcessTarget:
+    """search_engine.search.search on a loaded index, optionally with a result cache as in the web app."""
+
+    def __init__(self, index_path: str, engine: str, top_k: int, cache: bool = False):
+        self.payload = load_index(index_path)
+        self.engine = engine
+        self.top_k = top_k
+        self.cache = ResultCache() if cache else None
+
+    def __call__(self, r: Recorded) -> bool:
+        search(r.query, self.payload, top_k=self.top_k, use_stemming=r.stem, engine=self.engine, cache=self.cache)
+        return True
+
+    def close(self) -> None:
+        close = getattr(self.payload, "close", None)
+        if close is not None:
+            close()
+
+class DjangoTarget:
+    """The web app's /search/ view (or /api/search with api=True) through the Django test client."""
+
+    def __init__(self, index_path: Optional[str], api: bool = False):
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "main.settings")
+        import django
+        from django.conf import settings
+
+        django.setup()
+        from core import views
+        from search_engine.index_cache import IndexHolder
+
+        if "127.0.0.1" not in settings.ALLOWED_HOSTS and "*" not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "127.0.0.1"]
+        if index_path is not None:
+            views.INDEX = IndexHolder(index_path, loader=load_index, watch_paths=index_watch_paths(index_path))
+        # Generations restart with a new holder: drop results cached for the previous index.
+        views.RESULTS.clear()
+        views.preload()
+        self.path = "/api/search" if api else "/search/"
+        self._local = threading.local()
+
+    def __call__(self, r: Recorded) -> bool:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            from django.test import Client
+
+            client = self._local.client = Client(HTTP_HOST="127.0.0.1")
+        params = {"q": r.query}
+        if r.stem:
+            params["stem"] = "1"
+        return client.get(self.path, params).status_code == 200
+
+    def close(self) -> None:
+        pass
+
+def replay(target, requests: List[Recorded], concurrency: int = 1, offsets: Optional[List[float]] = None) -> Dict:
+    """Drive target with requests from `concurrency` threads; throughput and latency percentiles (ms)."""
+    start = time.perf_counter() + 0.05
+
+    def send(i: int) -> Tuple[float, bool]:
+        if offsets is None:
+            t0 = time.perf_counter()
+        else:
+            t0 = start + offsets[i]
+            delay = t0 - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            ok = target(requests[i])
+        except Exception:
+            ok = False
+        return time.perf_counter() - t0, ok
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        timings = list(pool.map(send, range(len(requests))))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(t * 1000 for t, _ in timings)
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(requests),
+        "errors": sum(1 for _, ok in timings if not ok),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(requests) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+def _ranked_ids(payload, r: Recorded, engine: str, top_k: int) -> List:
+    return [hit["id"] for hit in search(r.query, payload, top_k=top_k, use_stemming=r.stem, engine=engine)]
+
+def diff_results(requests: Iterable[Recorded], before, after, engine: str, top_k: int, show: int = 10) -> Dict:
+    """
+    Compare the top k of every distinct (query, stem) between two loaded
+    indexes: how many are identical, reordered or changed, the mean overlap
+    of the result sets, and the `show` queries whose results changed most.
+    """
+    distinct = list({(r.query, r.stem): r for r in requests}.values())
+    identical = reordered = top1_changed = 0
+    overlaps = []
+    changes = []
+    for r in distinct:
+        a, b = _ranked_ids(before, r, engine, top_k), _ranked_ids(after, r, engine, top_k)
+        if a == b:
+            identical += 1
+            overlaps.append(1.0)
+            continue
+        common = set(a) & set(b)
+        overlap = len(common) / max(len(a), len(b))
+        overlaps.append(overlap)
+        if len(common) == len(a) == len(b):
+            reordered += 1
+        if a[:1] != b[:1]:
+            top1_changed += 1
+        changes.append({
+            "query": r.query,
+            "stem": r.stem,
+            "overlap": round(overlap, 3),
+            "removed": [d for d in a if d not in common],
+            "added": [d for d in b if d not in common],
+        })
+    changes.sort(key=lambda c: c["overlap"])
+    return {
+        "queries": len(distinct),
+        "identical": identical,
+        "reordered": reordered,
+        "changed": len(distinct) - identical - reordered,
+        "top1_changed": top1_changed,
+        "mean_overlap": round(statistics.fmean(overlaps), 4) if overlaps else None,
+        "most_changed": changes[:show],
+    }
+
+def _target(args, index_path: Optional[str]):
+    if args.target == "django":
+        return DjangoTarget(index_path, api=args.api)
+    return InProcessTarget(index_path or default_index_path(), args.engine, args.top, cache=args.cache)
+
+def _print_load(label: str, row: Dict) -> None:
+    if not row.get("requests"):
+        print(f"{label}: no requests")
+        return
+    print(f"{label}: {row['requests']} requests in {row['seconds']:.2f}s, {row['rps']:.1f} req/s, "
+          f"p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms, p99 {row['p99_ms']:.2f} ms, "
+          f"max {row['max_ms']:.2f} ms, errors {row['errors']}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded search requests")
+    ap.add_argument("logs", nargs="+", help="Query logs (JSONL) and/or runserver access logs")
+    ap.add_argument("--index", default=None, help="Index to replay against (default: the app's index)")
+    ap.add_argument("--compare-index", default=None, help="Second index: replay against it too and diff results")
+    ap.add_argument("--target", choices=("search", "django"), default="search",
+                    help="search: search_engine.search.search in-process; django: the app via the test client")
+    ap.add_argument("--api", action="store_true", help="With --target django, request /api/search instead of /search/")
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--rate", type=float, default=0.0, help="Requests/sec (0 = as fast as possible)")
+    ap.add_argument("--speed", type=float, default=0.0, help="Replay recorded timing, sped up by this factor")
+    ap.add_argument("--limit", type=int, default=0, help="Replay at most this many requests")
+    ap.add_argument("--engine", default=DEFAULT_ENGINE, help="Engine for --target search and for result diffs")
+    ap.add_argument("--top", type=int, default=DEFAULT_TOP)
+    ap.add_argument("--cache", action="store_true", help="With --target search, use a result cache as the app does")
+    ap.add_argument("--show", type=int, default=10, help="Most changed queries to list")
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    args = ap.parse_args()
+
+    requests = list(read_requests(args.logs))
+    if args.limit:
+        requests = requests[:args.limit]
+    if not requests:
+        ap.error("no search requests found in " + ", ".join(args.logs))
+    offsets = schedule(requests, args.rate, args.speed)
+    print(f"Requests: {len(requests)} ({len({(r.query, r.stem) for r in requests})} distinct), "
+          f"concurrency {args.concurrency}, "
+          + (f"speed {args.speed}x" if args.speed > 0 and offsets else f"rate {args.rate or 'unlimited'}"))
+
+    before_path = args.index or default_index_path()
+    result: Dict = {"logs": args.logs, "target": args.target, "concurrency": args.concurrency,
+                    "rate": args.rate, "speed": args.speed, "replays": {}}
+    for path in [before_path] + ([args.compare_index] if args.compare_index else []):
+        target = _target(args, path)
+        try:
+            row = result["replays"][path] = replay(target, requests, args.concurrency, offsets)
+        finally:
+            target.close()
+        _print_load(path, row)
+
+    if args.compare_index:
+        before, after = load_index(before_path), load_index(args.compare_index)
+        try:
+            diff = result["diff"] = diff_results(requests, before, after, args.engine, args.top, args.show)
+        finally:
+            for payload in (before, after):
+                close = getattr(payload, "close", None)
+                if close is not None:
+                    close()
+        print(f"Top {args.top} of {diff['queries']} distinct queries: {diff['identical']} identical, "
+              f"{diff['reordered']} reordered, {diff['changed']} changed, top result changed for "
+              f"{diff['top1_changed']}, mean overlap {diff['mean_overlap']}")
+        for change in diff["most_changed"]:
+            print(f"  {change['overlap']:.2f}  {change['query']}{' (stem)' if change['stem'] else ''}: "
+                  f"-{len(change['removed'])} +{len(change['added'])}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
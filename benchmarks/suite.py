@@ -0,0 +1,308 @@
+"""
+Benchmark suite: one reproducible run over every hot path, saved as JSON so
+that two runs (e.g. before and after a change to bm25.py, indexer.py or
+parser.py) can be compared.
+
+  build     index build time, peak RSS and index size for corpora shaped like
+            data/publications.jsonl (benchmarks.synthetic.scaled_publications),
+            in-memory and streaming; each build runs in a fresh process so
+            its peak RSS is its own
+  search    queries/sec and p50/p95/p99 latency of search_engine.search.search
+            over a synthetic query log, per engine, result cache off
+  parser    analyze_page pages/sec on benchmarks/fixtures
+  classify  predict_proba docs/sec of the trained model, batched and one at
+            a time
+
+    python -m benchmarks.suite --sizes 1000,100000 --output before.json
+    python -m benchmarks.suite --sizes 1000,100000 --output after.json --compare before.json
+    python -m benchmarks.suite --sizes 1000000 --only build,search --work-dir /var/tmp/bench
+
+Corpora and query logs are seeded, so the same --seed gives the same inputs;
+with --work-dir they are kept and reused between runs.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from search_engine.binindex import BinaryIndex, fields_path_for, write_binary_index
+from search_engine.indexer import build_documents, build_indexes
+from search_engine.parser import analyze_page
+from search_engine.search import search
+from search_engine.storage import iter_jsonl, write_jsonl
+from search_engine.stream_indexer import build_index_streaming, peak_rss_mb
+
+from .bench_parser import load_fixtures
+from .synthetic import corpus_profile, scaled_publications, synthetic_query_log
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+SECTIONS = ("build", "search", "parser", "classify")
+BUILD_MODES = ("memory", "stream")
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+
+def _in_fresh_process(fn, *args):
+    # spawn, not fork: a forked child would inherit the parent's peak RSS.
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+def _index_bytes(path: str) -> int:
+    return os.path.getsize(path) + os.path.getsize(fields_path_for(path))
+
+def _build(mode: str, corpus: str, index_path: str, memory_mb: float) -> dict:
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "stream":
+        stats = build_index_streaming(iter_jsonl(corpus), index_path, memory_mb)
+        docs, terms = stats.docs, stats.terms
+    else:
+        docs_by_id = build_documents(iter_jsonl(corpus))
+        index, doc_lengths, fields = build_indexes(docs_by_id)
+        write_binary_index(index_path, docs_by_id, index, doc_lengths, fields)
+        docs, terms = len(docs_by_id), len(index)
+    seconds = time.perf_counter() - start
+    return {
+        "docs": docs,
+        "terms": terms,
+        "seconds": round(seconds, 3),
+        "docs_per_sec": round(docs / seconds, 1) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+        "index_mb": round(_index_bytes(index_path) / 1e6, 2),
+    }
+
+def _corpus(work_dir: Path, size: int, seed: int, profile: dict) -> Path:
+    path = work_dir / f"publications-{size}-seed{seed}.jsonl"
+    if not path.exists():
+        partial = path.with_suffix(".part")
+        write_jsonl(str(partial), scaled_publications(size, profile, seed=seed))
+        partial.replace(path)
+    return path
+
+def _query_log(work_dir: Path, corpus: Path, size: int, n_queries: int, seed: int) -> list:
+    path = work_dir / f"queries-{size}-seed{seed}-{n_queries}.jsonl"
+    if not path.exists():
+        write_jsonl(str(path), synthetic_query_log(iter_jsonl(str(corpus)), n_queries, seed=seed))
+    return [r["query"] for r in iter_jsonl(str(path))]
+
+def run_search(index_path: str, queries: list, engine: str, top_k: int, warmup: int) -> dict:
+    index = BinaryIndex(index_path)
+    try:
+        for q in queries[:warmup]:
+            search(q, index, top_k=top_k, engine=engine)
+        latencies = []
+        hits = 0
+        start = time.perf_counter()
+        for q in queries:
+            t0 = time.perf_counter()
+            hits += bool(search(q, index, top_k=top_k, engine=engine))
+            latencies.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - start
+    finally:
+        index.close()
+    ordered = sorted(latencies)
+    return {
+        "queries": len(queries),
+        "with_results": hits,
+        "qps": round(len(queries) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(_percentile(ordered, 0.50), 3),
+        "p95_ms": round(_percentile(ordered, 0.95), 3),
+        "p99_ms": round(_percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+def run_parser(rounds: int) -> dict:
+    pages = load_fixtures()
+    for url, html, is_pub in pages:
+        analyze_page(url, html, parse_publication=is_pub)
+    per_page = {}
+    start = time.perf_counter()
+    for url, html, is_pub in pages:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            analyze_page(url, html, parse_publication=is_pub)
+        per_page[Path(url.rstrip("/")).name] = round((time.perf_counter() - t0) * 1000 / rounds, 3)
+    elapsed = time.perf_counter() - start
+    return {
+        "fixtures": len(pages),
+        "pages_per_sec": round(rounds * len(pages) / elapsed, 1),
+        "ms_per_page": per_page,
+    }
+
+def _classify_texts(n: int) -> list:
+    dataset = BASE_DIR / "data" / "news_dataset.csv"
+    texts = []
+    if dataset.exists():
+        import csv
+        with dataset.open(encoding="utf-8", newline="") as f:
+            texts = [row["text"] for row in csv.DictReader(f) if row.get("text")]
+    if not texts:
+        texts = [p["title"] + ". " + p["abstract"] for p in scaled_publications(min(n, 2000), seed=3)]
+    return [texts[i % len(texts)] for i in range(n)]
+
+def run_classify(n_docs: int, batch_size: int, singles: int) -> dict:
+    from classifier.predict import load_model, predict_many
+
+    bundle = load_model()
+    if bundle is None:
+        return {"skipped": "no model at data/model.joblib (python -m classifier.train)"}
+    texts = _classify_texts(n_docs)
+    vectorizer, classifier = bundle["vectorizer"], bundle["classifier"]
+    predict_many(texts[:batch_size], bundle)
+
+    start = time.perf_counter()
+    matrices = [vectorizer.transform(texts[i:i + batch_size]) for i in range(0, n_docs, batch_size)]
+    transform_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for m in matrices:
+        classifier.predict_proba(m)
+    proba_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts[:singles]:
+        predict_many([text], bundle)
+    single_s = time.perf_counter() - start
+    return {
+        "docs": n_docs,
+        "batch_size": batch_size,
+        "transform_docs_per_sec": round(n_docs / transform_s, 1),
+        "predict_proba_docs_per_sec": round(n_docs / proba_s, 1),
+        "batched_docs_per_sec": round(n_docs / (transform_s + proba_s), 1),
+        "single_docs_per_sec": round(singles / single_s, 1),
+    }
+
+def _flatten(obj, prefix=""):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix, obj
+
+def compare(old: dict, new: dict) -> list:
+    """(metric, old, new, new/old) for every numeric result present in both runs."""
+    before = dict(_flatten(old.get("results", {})))
+    rows = []
+    for metric, value in _flatten(new.get("results", {})):
+        if metric in before:
+            base = before[metric]
+            rows.append((metric, base, value, round(value / base, 3) if base else None))
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,100000", help="Comma-separated corpus sizes, e.g. 1000,100000,1000000")
+    ap.add_argument("--only", default=",".join(SECTIONS), help=f"Comma-separated sections: {', '.join(SECTIONS)}")
+    ap.add_argument("--build-modes", default=",".join(BUILD_MODES), help="memory, stream")
+    ap.add_argument("--memory-mb", type=float, default=256, help="Postings buffer budget of the streaming build")
+    ap.add_argument("--engines", default="maxscore,dict,bm25f", help="Search engines to measure")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--warmup", type=int, default=50)
+    ap.add_argument("--parser-rounds", type=int, default=20)
+    ap.add_argument("--classify-docs", type=int, default=5000)
+    ap.add_argument("--classify-batch", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--work-dir", default="", help="Keep generated corpora, query logs and indexes here")
+    ap.add_argument("--output", default="", help="Write results as JSON to this path")
+    ap.add_argument("--compare", default="", help="Earlier --output JSON to compare this run against")
+    args = ap.parse_args()
+
+    sections = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        ap.error(f"unknown sections: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    modes = [m.strip() for m in args.build_modes.split(",") if m.strip()]
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    if "search" in sections and "build" not in sections:
+        modes = modes[:1] or ["memory"]
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "work_dir")}
+    results = {}
+    tmp = None
+    if args.work_dir:
+        work_dir = Path(args.work_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench-suite-")
+        work_dir = Path(tmp.name)
+    print(f"Work dir: {work_dir}")
+    try:
+        if "build" in sections or "search" in sections:
+            profile = corpus_profile(iter_jsonl(str(BASE_DIR / "data" / "publications.jsonl")))
+            for size in sizes:
+                corpus = _corpus(work_dir, size, args.seed, profile)
+                index_path = None
+                for mode in modes:
+                    path = str(work_dir / f"index-{size}-seed{args.seed}-{mode}.bin")
+                    row = _in_fresh_process(_build, mode, str(corpus), path, args.memory_mb)
+                    index_path = index_path or path
+                    if "build" in sections:
+                        results.setdefault("build", {}).setdefault(str(size), {})[mode] = row
+                        print(f"build  {size:>8} {mode:>7} {row['seconds']:>9.2f}s {row['docs_per_sec']:>10.0f} docs/s "
+                              f"peak RSS {row['peak_rss_mb']} MB  index {row['index_mb']} MB  terms {row['terms']}")
+                if "search" in sections and index_path:
+                    queries = _query_log(work_dir, corpus, size, args.queries, args.seed)
+                    for engine in engines:
+                        row = run_search(index_path, queries, engine, args.top, args.warmup)
+                        results.setdefault("search", {}).setdefault(str(size), {})[engine] = row
+                        print(f"search {size:>8} {engine:>8} {row['qps']:>9.1f} q/s  p50 {row['p50_ms']:.2f} ms  "
+                              f"p95 {row['p95_ms']:.2f} ms  p99 {row['p99_ms']:.2f} ms")
+        if "parser" in sections:
+            results["parser"] = run_parser(args.parser_rounds)
+            print(f"parser {results['parser']['pages_per_sec']:.1f} pages/s "
+                  f"over {results['parser']['fixtures']} fixtures")
+        if "classify" in sections:
+            row = results["classify"] = run_classify(args.classify_docs, args.classify_batch, min(200, args.classify_docs))
+            if "skipped" in row:
+                print(f"classify skipped: {row['skipped']}")
+            else:
+                print(f"classify predict_proba {row['predict_proba_docs_per_sec']:.0f} docs/s, "
+                      f"batched end to end {row['batched_docs_per_sec']:.0f} docs/s, "
+                      f"one at a time {row['single_docs_per_sec']:.0f} docs/s")
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    run = {"benchmark": "suite", "environment": _environment(), "config": config, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved: {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"\nCompared with {args.compare} ({old.get('environment', {}).get('commit')}):")
+        print(f"{'metric':<48} {'before':>12} {'after':>12} {'ratio':>7}")
+        for metric, before, after, ratio in compare(old, run):
+            print(f"{metric:<48} {before:>12} {after:>12} {ratio if ratio is not None else '-':>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Synthetic corpora and query logs for benchmarks.
+
+Term frequencies follow a Zipf distribution over a generated vocabulary, which
+gives the long-tailed postings lengths of a real collection without needing
+real data at 100k+ documents. scaled_publications() instead resamples the
+shape of data/publications.jsonl (field lengths, authors, years, word
+frequencies) to any size.
+
+    python -m benchmarks.synthetic --docs 100000 --output data/synthetic-100k.jsonl \
+        --queries 5000 --query-log data/synthetic-queries.jsonl
+"""
+import argparse
+import random
+import re
+from bisect import bisect_left
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from search_engine.bm25 import compute_idf
+from search_engine.config import PUBLICATIONS_JSONL
+from search_engine.storage import iter_jsonl, write_jsonl
+
+_SYLLABLES = [
+    "ka", "lo", "mi", "ne", "ru", "ta", "vo", "shi", "der", "gan", "pel", "tor",
+    "quin", "bra", "zel", "mon", "tic", "ser", "dal", "fen", "gor", "hul", "jin", "lar",
+]
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words: List[str] = []
+    seen = set()
+    while len(words) < size:
+        w = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    return words
+
+def zipf_probabilities(size: int, exponent: float = 1.07) -> np.ndarray:
+    weights = 1.0 / np.arange(1, size + 1, dtype=np.float64) ** exponent
+    return weights / weights.sum()
+
+def synthetic_payload(
+    n_docs: int,
+    vocab_size: int = 50000,
+    terms_per_doc: int = 16,
+    seed: int = 0,
+    with_docs: bool = True,
+) -> Dict:
+    """
+    Build an index payload ({"docs", "index", "doc_lengths", "idf"}) directly,
+    without tokenising text. terms_per_doc is the mean number of tokens per
+    document (lengths vary +-50%). Terms in payload["index"] are in Zipf rank
+    order, so list(payload["index"]) is a suitable vocabulary for queries.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = make_vocabulary(vocab_size, seed)
+    lengths = rng.integers(max(1, terms_per_doc // 2), terms_per_doc + terms_per_doc // 2 + 1, size=n_docs)
+    doc_of = np.repeat(np.arange(n_docs, dtype=np.int64), lengths)
+    term_of = rng.choice(vocab_size, size=len(doc_of), p=zipf_probabilities(vocab_size))
+
+    # Collapse repeated (doc, term) pairs into term frequencies, then order
+    # postings by term and, within a term, by document.
+    pair_keys, tfs = np.unique(doc_of * vocab_size + term_of, return_counts=True)
+    pair_docs = pair_keys // vocab_size
+    pair_terms = pair_keys % vocab_size
+    by_term = np.argsort(pair_terms, kind="stable")
+    pair_docs, pair_terms, tfs = pair_docs[by_term], pair_terms[by_term], tfs[by_term]
+    bounds = np.flatnonzero(np.diff(pair_terms)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(pair_terms)]))
+
+    doc_ids = [f"{i:016x}" for i in range(n_docs)]
+    index: Dict[str, Dict[str, int]] = {}
+    for lo, hi in zip(starts.tolist(), ends.tolist()):
+        term = vocab[int(pair_terms[lo])]
+        index[term] = dict(zip((doc_ids[d] for d in pair_docs[lo:hi].tolist()), tfs[lo:hi].tolist()))
+
+    doc_lengths = dict(zip(doc_ids, lengths.tolist()))
+    docs: Dict[str, Dict] = {}
+    if with_docs:
+        docs = {d: {"id": d, "title": f"Synthetic document {i}", "year": str(1995 + i % 30)} for i, d in enumerate(doc_ids)}
+    return {
+        "docs": docs,
+        "index": index,
+        "doc_lengths": doc_lengths,
+        "idf": compute_idf(index, n_docs=n_docs),
+    }
+
+def synthetic_publications(n_docs: int, seed: int = 0, vocab_size: int = 20000) -> Iterator[Dict]:
+    """Yield records shaped like data/publications.jsonl."""
+    rng = random.Random(seed)
+    vocab = make_vocabulary(vocab_size, seed)
+    cum = np.cumsum(zipf_probabilities(vocab_size)).tolist()
+    surnames = make_vocabulary(2000, seed + 1)
+
+    def words(k: int) -> str:
+        return " ".join(vocab[min(bisect_left(cum, rng.random()), vocab_size - 1)] for _ in range(k))
+
+    for i in range(n_docs):
+        people = [rng.choice(surnames) for _ in range(rng.randint(1, 5))]
+        slug = f"{i:08d}-{words(1)}"
+        yield {
+            "publication_url": f"https://pureportal.example.ac.uk/en/publications/{slug}/",
+            "title": words(rng.randint(5, 14)).capitalize(),
+            "year": str(rng.randint(1995, 2025)),
+            "authors": [f"{p.capitalize()}, {chr(65 + rng.randint(0, 25))}." for p in people],
+            "author_urls": [f"https://pureportal.example.ac.uk/en/persons/{p}/" for p in people],
+            "author_profiles": [
+                {"name": p.capitalize(), "url": f"https://pureportal.example.ac.uk/en/persons/{p}/"} for p in people
+            ],
+            "abstract": words(rng.randint(60, 220)) + ".",
+        }
+
+def synthetic_queries(vocab: List[str], n_queries: int, seed: int = 0, max_terms: int = 4) -> List[str]:
+    """
+    Queries of 1..max_terms terms. Term choice is Zipf-skewed but flatter than
+    the corpus, and a handful of queries repeat, as in real search logs.
+    """
+    rng = random.Random(seed)
+    cum = np.cumsum(zipf_probabilities(len(vocab), exponent=0.8)).tolist()
+    head: List[str] = []
+    out: List[str] = []
+    for _ in range(n_queries):
+        if head and rng.random() < 0.3:
+            out.append(rng.choice(head))
+            continue
+        q = " ".join(vocab[min(bisect_left(cum, rng.random()), len(vocab) - 1)] for _ in range(rng.randint(1, max_terms)))
+        if len(head) < 50:
+            head.append(q)
+        out.append(q)
+    return out
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]*")
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text or "")
+
+def corpus_profile(publications: Iterable[Dict]) -> Dict:
+    """
+    Shape of a publications corpus: title and abstract lengths in words,
+    authors per record, years, and word frequencies (most frequent first).
+    """
+    profile: Dict = {"title_lengths": [], "abstract_lengths": [], "author_counts": [], "years": []}
+    counts: Counter = Counter()
+    for p in publications:
+        title, abstract = _words(p.get("title", "")), _words(p.get("abstract", ""))
+        if not title:
+            continue
+        profile["title_lengths"].append(len(title))
+        profile["abstract_lengths"].append(len(abstract))
+        profile["author_counts"].append(max(1, len(p.get("authors") or [])))
+        profile["years"].append(str(p.get("year") or ""))
+        counts.update(w.lower() for w in title + abstract)
+    if not counts:
+        raise ValueError("no publications with a title to profile")
+    ranked = counts.most_common()
+    profile["words"] = [w for w, _ in ranked]
+    profile["word_counts"] = [c for _, c in ranked]
+    return profile
+
+def scaled_publications(
+    n_docs: int,
+    profile: Optional[Dict] = None,
+    seed: int = 0,
+    novel_rate: float = 0.1,
+) -> Iterator[Dict]:
+    """
+    Yield n_docs records shaped like data/publications.jsonl (or the given
+    profile). Lengths, author counts and years are resampled from the
+    profile and words drawn by its word frequencies; a novel_rate share of
+    words comes from a generated Zipf vocabulary that grows with n_docs
+    (Heaps' law), so the term count keeps growing as the corpus does.
+    Authors are drawn Zipf-skewed from a pool of n_docs / 10 people.
+    """
+    if profile is None:
+        profile = corpus_profile(iter_jsonl(PUBLICATIONS_JSONL))
+    rng = np.random.default_rng(seed)
+    known = profile["words"]
+    known_cum = np.cumsum(np.asarray(profile["word_counts"], dtype=np.float64))
+    known_cum /= known_cum[-1]
+    novel_size = min(200000, max(1000, int(40 * n_docs ** 0.6)))
+    novel = make_vocabulary(novel_size, seed + 2)
+    novel_cum = np.cumsum(zipf_probabilities(novel_size))
+    surnames = make_vocabulary(max(50, n_docs // 10), seed + 1)
+    first_names = [w.capitalize() for w in make_vocabulary(300, seed + 3)]
+    people_cum = np.cumsum(zipf_probabilities(len(surnames), exponent=0.9))
+    title_lengths = np.asarray(profile["title_lengths"])
+    abstract_lengths = np.asarray(profile["abstract_lengths"])
+    author_counts = np.asarray(profile["author_counts"])
+    years = profile["years"]
+
+    def words(k: int) -> List[str]:
+        u = rng.random(k)
+        fresh = rng.random(k) < novel_rate
+        known_idx = np.minimum(np.searchsorted(known_cum, u), len(known) - 1).tolist()
+        novel_idx = np.minimum(np.searchsorted(novel_cum, u), novel_size - 1).tolist()
+        return [novel[j] if f else known[i] for i, j, f in zip(known_idx, novel_idx, fresh.tolist())]
+
+    for i in range(n_docs):
+        pick = rng.integers(len(title_lengths))
+        title = words(int(title_lengths[pick]))
+        abstract = words(int(abstract_lengths[rng.integers(len(abstract_lengths))]))
+        n_people = int(author_counts[rng.integers(len(author_counts))])
+        people = np.minimum(np.searchsorted(people_cum, rng.random(n_people)), len(surnames) - 1).tolist()
+        profiles = []
+        for person in dict.fromkeys(people):
+            name = f"{first_names[person % len(first_names)]} {surnames[person].capitalize()}"
+            profiles.append({"name": name, "url": f"https://pureportal.example.ac.uk/en/persons/{surnames[person]}-{person}/"})
+        slug = "-".join(title[:8]).lower()
+        yield {
+            "publication_url": f"https://pureportal.example.ac.uk/en/publications/{slug}-{i:08d}/",
+            "title": " ".join(title).capitalize(),
+            "year": years[rng.integers(len(years))],
+            "authors": [p["name"] for p in profiles],
+            "author_urls": [p["url"] for p in profiles],
+            "author_profiles": profiles,
+            "abstract": " ".join(abstract) + "." if abstract else "",
+        }
+
+def synthetic_query_log(
+    publications: Iterable[Dict],
+    n_queries: int,
+    seed: int = 0,
+    rate: float = 20.0,
+    sample: int = 2000,
+) -> List[Dict]:
+    """
+    Query log records in the format search_engine.instrument writes
+    ({"ts", "kind", "query"}), drawn from the first `sample` publications:
+    mostly 1-4 words of a title or abstract, with some "quoted phrases",
+    author: and year: clauses, and repeats of popular queries. Timestamps
+    follow Poisson arrivals at `rate` queries per second.
+    """
+    rng = random.Random(seed)
+    pubs = [p for p in islice(publications, sample) if p.get("title")]
+    if not pubs:
+        raise ValueError("no publications to draw queries from")
+    head: List[str] = []
+    log: List[Dict] = []
+    ts = 1_700_000_000.0
+    for _ in range(n_queries):
+        ts += rng.expovariate(rate)
+        p = rng.choice(pubs)
+        kind = rng.random()
+        if head and kind < 0.3:
+            query = rng.choice(head)
+        else:
+            text = _words(p["abstract"] if rng.random() < 0.6 and p.get("abstract") else p["title"])
+            start = rng.randrange(len(text))
+            span = text[start:start + rng.randint(1, 4)]
+            if kind < 0.4 and len(span) > 1:
+                query = '"' + " ".join(span[:2]) + '"'
+            elif kind < 0.5 and p.get("authors"):
+                query = f'author:"{rng.choice(p["authors"])}" ' + span[0]
+            elif kind < 0.55 and p.get("year"):
+                query = f"year:{p['year']} " + " ".join(span)
+            else:
+                query = " ".join(span)
+            if len(head) < 50:
+                head.append(query)
+        log.append({"ts": round(ts, 3), "kind": "search", "query": query.lower()})
+    return log
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a publications corpus shaped like publications.jsonl")
+    ap.add_argument("--docs", type=int, default=100000)
+    ap.add_argument("--source", default=PUBLICATIONS_JSONL, help="Corpus whose shape is scaled up")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", required=True, help="Publications JSONL path")
+    ap.add_argument("--queries", type=int, default=0, help="Also generate this many logged queries")
+    ap.add_argument("--query-log", default="", help="Query log JSONL path (with --queries)")
+    ap.add_argument("--rate", type=float, default=20.0, help="Query log arrival rate, queries/sec")
+    args = ap.parse_args()
+    if args.queries and not args.query_log:
+        ap.error("--queries needs --query-log")
+
+    profile = corpus_profile(iter_jsonl(args.source))
+    write_jsonl(args.output, scaled_publications(args.docs, profile, seed=args.seed))
+    print(f"Saved: {args.output} ({args.docs} publications)")
+    if args.queries:
+        log = synthetic_query_log(iter_jsonl(args.output), args.queries, seed=args.seed, rate=args.rate)
+        write_jsonl(args.query_log, log)
+        print(f"Saved: {args.query_log} ({len(log)} queries)")
+
+if __name__ == "__main__":
+    main()
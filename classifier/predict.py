@@ -1,53 +1,170 @@
 import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from itertools import islice
 from pathlib import Path
 import joblib
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_PATH = BASE_DIR / "data" / "model.joblib"
+CHUNK_SIZE = 1000
 
 
-def load_model():
-    if not MODEL_PATH.exists():
+def load_model(path=MODEL_PATH):
+    path = Path(path)
+    if not path.exists():
         return None
-    obj = joblib.load(MODEL_PATH)
+    obj = joblib.load(path)
     if isinstance(obj, dict) and "vectorizer" in obj and "classifier" in obj:
         return obj
     return None
 
 
-def predict_cluster(text: str):
-    bundle = load_model()
+class ModelHolder:
+    """
+    Process-wide holder for the trained model bundle.
+
+    get() returns the bundle loaded on first use. The file is stat()ed at
+    most once per check_interval and reloaded when its mtime or size
+    changes (e.g. after retraining); a failed reload keeps the old bundle.
+    """
+
+    def __init__(self, path=MODEL_PATH, check_interval=1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._bundle = None
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self):
+        # Lock-free while the last check is fresh. _next_check only moves
+        # forward once the bundle is installed, so a request arriving during
+        # the first load waits on the lock instead of getting None.
+        if time.monotonic() < self._next_check:
+            return self._bundle
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return self._bundle
+            signature = self._stat()
+            if signature != self._signature:
+                try:
+                    bundle = load_model(self.path) if signature else None
+                except Exception:
+                    # Half-written file or similar: keep the model we have.
+                    bundle, signature = self._bundle, self._signature
+                self._bundle = bundle
+                self._signature = signature
+            self._next_check = time.monotonic() + self.check_interval
+            return self._bundle
+
+
+MODEL = ModelHolder()
+
+
+def predict_many(texts, bundle=None):
+    """
+    (class index, label, confidence) for each text, or None without a model.
+    The batch is vectorized with one transform and scored with one
+    predict_proba call.
+    """
+    if bundle is None:
+        bundle = MODEL.get()
     if bundle is None:
         return None
-    vectorizer = bundle["vectorizer"]
+    texts = list(texts)
+    if not texts:
+        return []
     classifier = bundle["classifier"]
-    vec = vectorizer.transform([text])
-    probs = classifier.predict_proba(vec)[0]
-    best_idx = int(probs.argmax())
-    confidence = float(probs[best_idx])
-    label = str(classifier.classes_[best_idx])
-    return best_idx, label, confidence
+    probs = classifier.predict_proba(bundle["vectorizer"].transform(texts))
+    best = probs.argmax(axis=1)
+    classes = classifier.classes_
+    return [(int(i), str(classes[i]), float(row[i])) for i, row in zip(best, probs)]
 
 
-def predict_label(text: str) -> str:
-    result = predict_cluster(text)
+def predict_cluster(text: str, bundle=None):
+    results = predict_many([text], bundle)
+    if results is None:
+        return None
+    return results[0]
+
+
+def predict_label(text: str, bundle=None) -> str:
+    result = predict_cluster(text, bundle)
     if result is None:
         return ""
     _, label, _ = result
     return label
 
 
+def read_records(path):
+    """Records of a .csv file (header row) or a JSONL file, one at a time; "-" reads JSONL from stdin."""
+    if path == "-":
+        yield from (json.loads(line) for line in sys.stdin if line.strip())
+        return
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            yield from (json.loads(line) for line in f if line.strip())
+
+
+def classify_stream(records, bundle, text_field="text", chunk_size=CHUNK_SIZE):
+    """Yield each record with "predicted" and "confidence" added, classifying chunk_size records at a time."""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        results = predict_many([str(r.get(text_field) or "") for r in chunk], bundle)
+        for record, (_, label, confidence) in zip(chunk, results):
+            yield {**record, "predicted": label, "confidence": round(confidence, 4)}
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--text", required=True)
+    ap.add_argument("--text")
+    ap.add_argument("--file", help="JSONL or CSV file to classify (- for JSONL on stdin); writes JSONL")
+    ap.add_argument("--text-field", default="text", help="Field/column holding the text")
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    ap.add_argument("--output", default="-", help="Output JSONL path (default: stdout)")
     args = ap.parse_args()
+    if not args.text and not args.file:
+        ap.error("one of --text or --file is required")
 
     model = load_model()
     if model is None:
         print("Model not found or incompatible. Train first: python -m classifier.train")
         return
 
-    result = predict_cluster(args.text)
+    if args.file:
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        count = 0
+        start = time.perf_counter()
+        try:
+            for row in classify_stream(read_records(args.file), model, args.text_field, max(1, args.chunk_size)):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - start
+        print(f"Classified {count} records in {elapsed:.2f}s", file=sys.stderr)
+        return
+
+    result = predict_cluster(args.text, model)
     if result is None:
         print("Model not found or incompatible. Train first: python -m classifier.train")
         return
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import joblib
+
+from . import predict
+from .predict import ModelHolder
+
+
+def _bundle(name):
+    # load_model only checks the keys, so plain values stand in for the fitted objects.
+    return {"vectorizer": name, "classifier": name}
+
+
+class ModelHolderTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.path = Path(self._tmp.name) / "model.joblib"
+
+    def _save(self, name):
+        joblib.dump(_bundle(name), self.path)
+        # Make sure the signature changes even on coarse mtime clocks.
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    def test_missing_model_then_created(self):
+        holder = ModelHolder(self.path, check_interval=0)
+        self.assertIsNone(holder.get())
+        self._save("first")
+        self.assertEqual(holder.get(), _bundle("first"))
+
+    def test_reloads_when_the_file_changes(self):
+        self._save("first")
+        holder = ModelHolder(self.path, check_interval=0)
+        self.assertEqual(holder.get(), _bundle("first"))
+        self._save("second")
+        self.assertEqual(holder.get(), _bundle("second"))
+
+    def test_checks_at_most_once_per_interval(self):
+        self._save("first")
+        holder = ModelHolder(self.path, check_interval=60)
+        holder.get()
+        self._save("second")
+        self.assertEqual(holder.get(), _bundle("first"))
+
+    def test_failed_reload_keeps_the_model(self):
+        self._save("first")
+        holder = ModelHolder(self.path, check_interval=0)
+        holder.get()
+        self._save("second")
+        with mock.patch.object(predict, "load_model", side_effect=EOFError):
+            self.assertEqual(holder.get(), _bundle("first"))
+        self.assertEqual(holder.get(), _bundle("second"))
+
+    def test_requests_during_the_first_load_wait_for_it(self):
+        self._save("first")
+        holder = ModelHolder(self.path, check_interval=60)
+        real_load = predict.load_model
+
+        def slow_load(path):
+            time.sleep(0.2)
+            return real_load(path)
+
+        results = []
+        with mock.patch.object(predict, "load_model", side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: results.append(holder.get())) for _ in range(4)]
+            for t in threads:
+                t.start()
+                time.sleep(0.02)
+            for t in threads:
+                t.join()
+        self.assertEqual(results, [_bundle("first")] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+// Search box suggestions: inputs with data-suggest-url get a datalist filled
+// from /suggest as the user types. Requests are debounced, and a request
+// still in flight is cancelled by the next keystroke.
+(function () {
+  var DELAY_MS = 80;
+
+  function attach(input) {
+    var list = document.getElementById(input.getAttribute("list"));
+    var url = input.dataset.suggestUrl;
+    var timer = null;
+    var pending = null;
+
+    function fill(data) {
+      var seen = {};
+      list.replaceChildren();
+      data.terms.concat(data.titles).forEach(function (s) {
+        if (seen[s.text]) {
+          return;
+        }
+        seen[s.text] = true;
+        var option = document.createElement("option");
+        option.value = s.text;
+        list.appendChild(option);
+      });
+    }
+
+    function fetchSuggestions() {
+      var q = input.value;
+      if (pending) {
+        pending.abort();
+      }
+      if (!q.trim()) {
+        list.replaceChildren();
+        return;
+      }
+      pending = new AbortController();
+      fetch(url + "?q=" + encodeURIComponent(q), { signal: pending.signal })
+        .then(function (response) { return response.ok ? response.json() : null; })
+        .then(function (data) {
+          if (data && data.query === input.value) {
+            fill(data);
+          }
+        })
+        .catch(function () {});
+    }
+
+    input.addEventListener("input", function () {
+      clearTimeout(timer);
+      timer = setTimeout(fetchSuggestions, DELAY_MS);
+    });
+  }
+
+  document.querySelectorAll("input[data-suggest-url]").forEach(attach);
+})();
@@ -1,3 +1,434 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, override_settings
+from django.urls import path
+
+from search_engine.binindex import write_binary_index
+from search_engine.config import PUBLICATIONS_JSONL
+from search_engine.index_cache import IndexHolder
+from search_engine.instrument import Instrumentation
+from search_engine.indexer import build_documents, build_indexes
+from search_engine.storage import load_index, load_jsonl
+
+from . import views
+
+
+class IndexedTestCase(SimpleTestCase):
+    """Views served from a binary index of the bundled publications."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.path = path = str(Path(cls._tmp.name) / "index.bin")
+        docs = build_documents(load_jsonl(PUBLICATIONS_JSONL))
+        write_binary_index(path, docs, *build_indexes(docs))
+        cls.holder = IndexHolder(path, loader=load_index, check_interval=0, close_replaced=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.holder.get().payload.close()
+        cls._tmp.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = mock.patch.object(views, "INDEX", self.holder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        views.RESULTS.clear()
+        self.addCleanup(views.RESULTS.clear)
+
+
+class ApiSearchBatchTests(IndexedTestCase):
+    url = "/api/search/batch"
+
+    def post(self, body):
+        data = body if isinstance(body, (bytes, str)) else json.dumps(body)
+        return self.client.post(self.url, data=data, content_type="application/json")
+
+    def assertError(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": message})
+
+    def test_answers_each_query_in_order(self):
+        response = self.post({"queries": ["neural network", "covid", "neural network"], "top": 3})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r["query"] for r in body["responses"]], ["neural network", "covid", "neural network"])
+        self.assertEqual(body["responses"][0]["results"], body["responses"][2]["results"])
+        self.assertTrue(all(len(r["results"]) <= 3 for r in body["responses"]))
+        self.assertIn("X-Index-Generation", response)
+
+    def test_body_that_is_not_an_object(self):
+        for body in (["neural network"], "neural network", 3, None):
+            with self.subTest(body=body):
+                self.assertError(self.post(body), "request body must be a JSON object")
+
+    def test_body_that_is_not_json(self):
+        for body in (b"{not json", b"\xff\xfe", "[1, 2"):
+            with self.subTest(body=body):
+                self.assertError(self.post(body), "request body must be a JSON object")
+
+    def test_queries_that_are_not_a_list_of_strings(self):
+        for queries in (None, "neural network", {"q": "covid"}, ["covid", 3], [["covid"]], [None]):
+            with self.subTest(queries=queries):
+                self.assertError(self.post({"queries": queries}), "queries must be a list of strings")
+
+    def test_too_many_queries(self):
+        response = self.post({"queries": ["covid"] * (views.API_MAX_BATCH + 1)})
+        self.assertError(response, f"at most {views.API_MAX_BATCH} queries per batch")
+
+    def test_top_that_is_not_an_integer(self):
+        for top in ("many", [3], {"n": 3}):
+            with self.subTest(top=top):
+                self.assertError(self.post({"queries": ["covid"], "top": top}), "top must be an integer")
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class SuggestTests(IndexedTestCase):
+    url = "/suggest"
+
+    def test_completes_terms_and_titles(self):
+        response = self.client.get(self.url, {"q": "neural netw", "top": 3})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["query"], "neural netw")
+        self.assertEqual(body["generation"], int(response["X-Index-Generation"]))
+        self.assertTrue(body["terms"])
+        self.assertLessEqual(len(body["terms"]), 3)
+        self.assertTrue(all(t["text"].startswith("neural netw") for t in body["terms"]))
+        weights = [t["weight"] for t in body["terms"]]
+        self.assertEqual(weights, sorted(weights, reverse=True))
+
+    def test_trailing_space_completes_titles_only(self):
+        body = self.client.get(self.url, {"q": "a "}).json()
+        self.assertEqual(body["terms"], [])
+        self.assertTrue(body["titles"])
+        self.assertTrue(all(t["text"].lower().startswith("a ") for t in body["titles"]))
+
+    def test_top_is_capped(self):
+        body = self.client.get(self.url, {"q": "a", "top": 1000}).json()
+        self.assertEqual(len(body["terms"]), views.SUGGEST_MAX_TOP)
+
+    def test_top_that_is_not_an_integer(self):
+        response = self.client.get(self.url, {"q": "neural", "top": "many"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "top must be an integer"})
+
+    def test_without_an_index(self):
+        missing = IndexHolder(str(Path(self._tmp.name) / "missing.bin"), loader=load_index, check_interval=0)
+        with mock.patch.object(views, "INDEX", missing):
+            self.assertEqual(self.client.get(self.url, {"q": "neural"}).status_code, 503)
+
+
+class SearchResultCacheTests(IndexedTestCase):
+    url = "/api/search"
+
+    def get(self, **params):
+        response = self.client.get(self.url, {"q": "neural network", **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def results(self, response):
+        return [(r["publication_url"], r["score"]) for r in response.json()["results"]]
+
+    def counts(self, *names):
+        # The counters are cumulative; clear() only drops the entries.
+        stats = views.RESULTS.stats()
+        return tuple(getattr(stats, name) - getattr(self.before, name, 0) for name in names)
+
+    def setUp(self):
+        super().setUp()
+        self.before = views.RESULTS.stats()
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        first = self.get()
+        with mock.patch("search_engine.search._search_page") as run:
+            second = self.get(q="Neural  network?")
+        run.assert_not_called()
+        self.assertEqual(self.results(second), self.results(first))
+        self.assertEqual(self.counts("hits", "misses"), (1, 1))
+        self.assertEqual(views.RESULTS.stats().entries, 1)
+
+    def test_new_index_generation_invalidates_the_cache(self):
+        first = self.get()
+        # Same content under a new mtime: the holder reloads it as the next generation.
+        stamp = time.time_ns() + 1_000_000_000
+        os.utime(self.path, ns=(stamp, stamp))
+        second = self.get()
+        self.assertEqual(int(second["X-Index-Generation"]), int(first["X-Index-Generation"]) + 1)
+        self.assertEqual(self.results(second), self.results(first))
+        self.assertEqual(self.counts("hits", "misses", "invalidations"), (0, 2, 1))
+
+    def test_engines_and_options_have_separate_entries(self):
+        variants = [{}, {"stem": "1"}, {"top": "5"}]
+        for params in variants:
+            self.get(**params)
+        with self.settings(SEARCH_ENGINE="numpy"):
+            self.get()
+        with self.settings(SEARCH_FIELD_WEIGHTS={"title": 5.0, "abstract": 1.0}):
+            self.get()
+        self.assertEqual(self.counts("hits", "misses"), (0, 5))
+        for params in variants:
+            self.get(**params)
+        with self.settings(SEARCH_ENGINE="numpy"):
+            self.get()
+        self.assertEqual(self.counts("hits", "misses"), (4, 5))
+        self.assertEqual(views.RESULTS.stats().entries, 5)
+
+
+class BrowsePaginationTests(IndexedTestCase):
+    url = "/search/"
+
+    def listing(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, response.context["listing"]
+
+    def test_pages_cover_the_index_once(self):
+        _, first = self.listing()
+        self.assertEqual(first["pages"], -(-first["total"] // views.BROWSE_PAGE_SIZE))
+        urls = []
+        for page in range(1, first["pages"] + 1):
+            _, listing = self.listing(page=page)
+            self.assertEqual(listing["page"], page)
+            urls += [r["publication_url"] for r in listing["results"]]
+        self.assertEqual(len(urls), first["total"])
+        self.assertEqual(len(set(urls)), first["total"])
+
+    def test_page_out_of_bounds_is_clamped(self):
+        _, first = self.listing()
+        for page, expected in (("0", 1), ("-3", 1), ("abc", 1), ("", 1), (str(first["pages"] + 5), first["pages"])):
+            with self.subTest(page=page):
+                self.assertEqual(self.listing(page=page)[1]["page"], expected)
+
+    def test_year_filter_keeps_to_the_year_across_pages(self):
+        response, listing = self.listing(year="2025")
+        self.assertEqual(listing["pages"], 2)
+        self.assertContains(response, 'href="?year=2025&amp;page=2"')
+        response, second = self.listing(year="2025", page=2)
+        self.assertContains(response, 'href="?year=2025&amp;page=1"')
+        results = listing["results"] + second["results"]
+        self.assertEqual(len(results), listing["total"])
+        self.assertTrue(all(str(r["year"]).startswith("2025") for r in results))
+
+    def test_unknown_year_is_an_empty_listing(self):
+        response, listing = self.listing(year="2025&page=3")
+        self.assertEqual((listing["total"], listing["results"]), (0, []))
+        self.assertNotContains(response, 'class="pager"')
+
+    def test_year_is_urlencoded_in_page_links(self):
+        _, listing = self.listing(year="2025")
+        with mock.patch.object(views, "browse_page", return_value={**listing, "years": {"2025&x": [0, 1]}}):
+            response = self.client.get(self.url, {"year": "20 25&x=1"})
+        self.assertContains(response, 'href="?year=20%2025%26x%3D1&amp;page=2"')
+        self.assertContains(response, 'href="/search/?year=2025%26x"')
+
+
+class ApiSearchTests(IndexedTestCase):
+    url = "/api/search"
+
+    def assertError(self, response, status, message):
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response.json(), {"error": message})
+
+    def test_returns_a_page_of_results(self):
+        response = self.client.get(self.url, {"q": "neural network", "top": 3})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["query"], "neural network")
+        self.assertEqual(body["generation"], int(response["X-Index-Generation"]))
+        self.assertEqual(len(body["results"]), 3)
+        self.assertTrue(body["next_cursor"])
+        following = self.client.get(self.url, {"q": "neural network", "top": 3, "cursor": body["next_cursor"]}).json()
+        first_urls = {r["publication_url"] for r in body["results"]}
+        self.assertFalse(first_urls & {r["publication_url"] for r in following["results"]})
+
+    def test_query_is_required(self):
+        for params in ({}, {"q": ""}, {"q": "   "}, {"top": 3}):
+            with self.subTest(params=params):
+                self.assertError(self.client.get(self.url, params), 400, "q is required")
+
+    def test_top_that_is_not_an_integer(self):
+        for top in ("many", "1.5", "3x"):
+            with self.subTest(top=top):
+                self.assertError(self.client.get(self.url, {"q": "covid", "top": top}), 400, "top must be an integer")
+
+    def test_top_is_clamped(self):
+        for top, expected in (("0", 1), ("-5", 1), ("", views.RESULTS_PAGE_SIZE)):
+            with self.subTest(top=top):
+                body = self.client.get(self.url, {"q": "data", "top": top}).json()
+                self.assertEqual(len(body["results"]), expected)
+        capped = self.client.get(self.url, {"q": "data", "top": 10 ** 6}).json()
+        widest = self.client.get(self.url, {"q": "data", "top": views.API_MAX_TOP}).json()
+        self.assertEqual(capped["results"], widest["results"])
+
+    def test_bad_cursor_starts_from_the_first_page(self):
+        first = self.client.get(self.url, {"q": "neural network", "top": 3}).json()
+        for cursor in ("not-a-cursor", "!!!", "W10"):
+            with self.subTest(cursor=cursor):
+                body = self.client.get(self.url, {"q": "neural network", "top": 3, "cursor": cursor}).json()
+                self.assertEqual(body["results"], first["results"])
+
+    def test_without_an_index(self):
+        missing = IndexHolder(str(Path(self._tmp.name) / "missing.bin"), loader=load_index, check_interval=0)
+        with mock.patch.object(views, "INDEX", missing):
+            self.assertError(self.client.get(self.url, {"q": "neural"}), 503, "index not found")
+
+    def test_post_is_not_allowed(self):
+        self.assertEqual(self.client.post(self.url, {"q": "neural"}).status_code, 405)
+
+
+class AsyncUrls:
+    """The URLconf core.urls routes under ASGI (ASYNC_VIEWS)."""
+
+    urlpatterns = [
+        path("", views.home_async, name="home"),
+        path("search/", views.search_async, name="search"),
+        path("classify/", views.classify_async, name="classify"),
+        path("api/search", views.api_search_async, name="api_search"),
+        path("api/search/batch", views.api_search_batch_async, name="api_search_batch"),
+        path("suggest", views.suggest_async, name="suggest"),
+        path("metrics", views.metrics_async, name="metrics"),
+    ]
+
+
+class AsyncViewTests(IndexedTestCase):
+    def sync_get(self, url, params):
+        return self.client.get(url, params)
+
+    @override_settings(ROOT_URLCONF=AsyncUrls)
+    async def test_async_views_answer_like_the_sync_views(self):
+        requests = [
+            ("/api/search", {"q": "neural network", "top": 5}),
+            ("/api/search", {"q": "machine learning", "stem": "1"}),
+            ("/api/search", {"top": 5}),
+            ("/search/", {"q": "neural network"}),
+            ("/search/", {"year": "2025", "page": "2"}),
+        ]
+        for url, params in requests:
+            with mock.patch.object(views.EXECUTOR, "submit", wraps=views.EXECUTOR.submit) as submit:
+                response = await self.async_client.get(url, params)
+            submit.assert_called_once()
+            # Computed again rather than served from the cache the async request filled.
+            views.RESULTS.clear()
+            with override_settings(ROOT_URLCONF="core.urls"):
+                expected = await sync_to_async(self.sync_get)(url, params)
+            with self.subTest(url=url, params=params):
+                self.assertEqual(response.status_code, expected.status_code)
+                if url == "/api/search":
+                    body, want = response.json(), expected.json()
+                    body.pop("took_ms", None)
+                    want.pop("took_ms", None)
+                    self.assertEqual(body, want)
+                else:
+                    self.assertEqual(response.content, expected.content)
+
+
+@override_settings(METRICS_TOKEN="s3cret")
+class MetricsTests(SimpleTestCase):
+    url = "/metrics"
+    auth = {"HTTP_AUTHORIZATION": "Bearer s3cret"}
+
+    def setUp(self):
+        patcher = mock.patch.object(views, "METRICS", Instrumentation())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, body, **headers):
+        data = body if isinstance(body, (bytes, str)) else json.dumps(body)
+        return self.client.post(self.url, data=data, content_type="application/json", **{**self.auth, **headers})
+
+    def assertError(self, response, status, message):
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response.json(), {"error": message})
+
+    def test_get_reports_counters(self):
+        response = self.client.get(self.url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["queries"], 0)
+        self.assertFalse(body["options"]["enabled"])
+        self.assertIn("hit_rate", body["result_cache"])
+        self.assertIn("index_generation", body)
+
+    def test_token_is_required(self):
+        forbidden = "a valid metrics token is required"
+        for headers in ({}, {"HTTP_AUTHORIZATION": "Bearer wrong"}, {"HTTP_AUTHORIZATION": "s3cret"}):
+            with self.subTest(headers=headers):
+                self.assertError(self.client.get(self.url, **headers), 403, forbidden)
+                self.assertError(self.client.post(self.url, data="{}", content_type="application/json", **headers),
+                                 403, forbidden)
+        # Local clients (the test client is 127.0.0.1) get no exception.
+        with override_settings(METRICS_TOKEN=""):
+            self.assertError(self.client.get(self.url, **self.auth), 403, forbidden)
+        self.assertFalse(self.metrics.enabled)
+
+    def test_post_changes_runtime_options(self):
+        response = self.post({"enabled": True, "slow_ms": 50, "profile": False, "profile_sample": 0.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["options"], {
+            "enabled": True, "slow_ms": 50.0, "profile": False, "profile_sample": 0.5,
+            "log_path": None, "profile_dir": None,
+        })
+
+    def test_post_reset_clears_the_windows(self):
+        self.metrics.configure(enabled=True)
+        with self.metrics.trace("neural", kind="search"):
+            pass
+        self.assertEqual(self.client.get(self.url, **self.auth).json()["queries"], 1)
+        self.assertEqual(self.post({"reset": True}).json()["queries"], 0)
+
+    def test_paths_are_settings_only(self):
+        for name in ("log_path", "profile_dir"):
+            with self.subTest(name=name):
+                self.assertError(self.post({name: "/tmp/x"}), 400, f"unknown instrumentation options: {name}")
+        self.assertIsNone(self.metrics.log_path)
+
+    def test_bad_values_are_rejected(self):
+        cases = [
+            ({"enabled": "false"}, "bad instrumentation option enabled: expected true or false, got 'false'"),
+            ({"profile": 1}, "bad instrumentation option profile: expected true or false, got 1"),
+            ({"slow_ms": "fast"}, "bad instrumentation option slow_ms: expected a non-negative number, got 'fast'"),
+            ({"profile_sample": 2},
+             "bad instrumentation option profile_sample: expected a number between 0 and 1, got 2"),
+            ({"reset": "yes"}, "bad instrumentation option reset: expected true or false"),
+        ]
+        for body, message in cases:
+            with self.subTest(body=body):
+                self.assertError(self.post(body), 400, message)
+        # A rejected request changes nothing, even alongside valid options.
+        self.assertError(self.post({"enabled": True, "profile": "no"}), 400,
+                         "bad instrumentation option profile: expected true or false, got 'no'")
+        self.assertFalse(self.metrics.enabled)
+
+    def test_body_that_is_not_a_json_object(self):
+        for body in (b"{not json", "[1, 2]", "3"):
+            with self.subTest(body=body):
+                self.assertError(self.post(body), 400, "request body must be a JSON object")
+
+    def test_other_methods_are_not_allowed(self):
+        self.assertEqual(self.client.delete(self.url, **self.auth).status_code, 405)
+
+    def test_log_is_written_outside_the_lock(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics = Instrumentation(enabled=True, log_path=str(Path(tmp) / "log.jsonl"))
+            real_open = open
+
+            def checked_open(*args, **kwargs):
+                self.assertFalse(metrics._lock.locked())
+                return real_open(*args, **kwargs)
+
+            with mock.patch("builtins.open", side_effect=checked_open):
+                with metrics.trace("neural"):
+                    pass
+            lines = Path(tmp, "log.jsonl").read_text().splitlines()
+        self.assertEqual(json.loads(lines[0])["query"], "neural")
@@ -1,8 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
-urlpatterns = [
-    path("", views.home, name="home"),
-    path("search/", views.search, name="search"),
-    path("classify/", views.classify, name="classify"),
-]
+# Under ASGI (main/asgi.py) the async views are routed instead: they run the
+# same views on a bounded thread pool without blocking the event loop.
+if getattr(settings, "ASYNC_VIEWS", False):
+    urlpatterns = [
+        path("", views.home_async, name="home"),
+        path("search/", views.search_async, name="search"),
+        path("classify/", views.classify_async, name="classify"),
+        path("api/search", views.api_search_async, name="api_search"),
+        path("api/search/batch", views.api_search_batch_async, name="api_search_batch"),
+        path("suggest", views.suggest_async, name="suggest"),
+        path("metrics", views.metrics_async, name="metrics"),
+    ]
+else:
+    urlpatterns = [
+        path("", views.home, name="home"),
+        path("search/", views.search, name="search"),
+        path("classify/", views.classify, name="classify"),
+        path("api/search", views.api_search, name="api_search"),
+        path("api/search/batch", views.api_search_batch, name="api_search_batch"),
+        path("suggest", views.suggest, name="suggest"),
+        path("metrics", views.metrics, name="metrics"),
+    ]
@@ -1,17 +1,111 @@
+import asyncio
+import functools
+import hmac
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
 from django.conf import settings
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
-from search_engine.search import search as run_search
-from search_engine.storage import load_json
-from classifier.predict import predict_label, load_model
+from search_engine.browse import browse_page
+from search_engine.search import search_batch, search_page
+from search_engine.suggest import suggest_for
+from search_engine.index_cache import IndexHolder
+from search_engine.instrument import Instrumentation, stage
+from search_engine.result_cache import ResultCache
+from search_engine.config import default_index_path
+from search_engine.storage import load_index as open_index, index_watch_paths
+from classifier.predict import MODEL, predict_label
 
-INDEX_PATH = settings.BASE_DIR / "data" / "index.json"
+# The path is resolved at every check, so an index.bin or segment directory
+# created after startup is picked up; replaced indexes are closed once the
+# requests using them are done.
+INDEX = IndexHolder(default_index_path, loader=open_index, watch_paths=index_watch_paths, close_replaced=True)
+RESULTS = ResultCache(
+    max_entries=getattr(settings, "SEARCH_CACHE_ENTRIES", 1024),
+    max_bytes=int(getattr(settings, "SEARCH_CACHE_MB", 16) * 1024 * 1024),
+)
+METRICS = Instrumentation(**getattr(settings, "SEARCH_INSTRUMENTATION", {}))
+# Async views run the blocking work (index and model access, scoring,
+# rendering) here, so at most VIEW_WORKERS requests use threads at once.
+EXECUTOR = ThreadPoolExecutor(max_workers=getattr(settings, "VIEW_WORKERS", 4), thread_name_prefix="views")
+
+
+BROWSE_PAGE_SIZE = 20
+RESULTS_PAGE_SIZE = 15
+API_MAX_TOP = 100
+API_MAX_BATCH = 100
+SUGGEST_TOP = 8
+SUGGEST_MAX_TOP = 20
+
+
+def _page_number(request):
+    try:
+        return max(1, int(request.GET.get("page") or 1))
+    except ValueError:
+        return 1
+
+
+def _api_top(value, default=RESULTS_PAGE_SIZE, maximum=API_MAX_TOP):
+    try:
+        top = int(value if value not in (None, "") else default)
+    except (TypeError, ValueError):
+        raise ValueError("top must be an integer")
+    return min(max(1, top), maximum)
+
+
+def _search_options():
+    return {
+        "engine": getattr(settings, "SEARCH_ENGINE", "dict"),
+        "field_weights": getattr(settings, "SEARCH_FIELD_WEIGHTS", None),
+        "fuzzy": getattr(settings, "SEARCH_FUZZY", True),
+    }
+
+
+@contextmanager
+def _index_snapshot():
+    with stage("index_load"):
+        snapshot = INDEX.acquire()
+    try:
+        yield snapshot
+    finally:
+        INDEX.release(snapshot)
+
+
+def _api_response(data, snapshot, status=200):
+    response = JsonResponse(data, status=status)
+    response["X-Index-Generation"] = str(snapshot.generation)
+    return response
 
 
 def load_index():
-    return load_json(str(INDEX_PATH))
+    return INDEX.get().payload
+
+
+def preload():
+    """
+    Load the index and the classifier model ahead of the first request, if
+    PRELOAD_ON_STARTUP is set. Called by the ASGI/WSGI entry points only, so
+    management commands (migrate, shell, check) never load them.
+    """
+    if getattr(settings, "PRELOAD_ON_STARTUP", True):
+        INDEX.get()
+        MODEL.get()
+
+
+def _in_executor(view):
+    """Async version of a sync view that runs it on EXECUTOR."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(EXECUTOR, functools.partial(view, request, *args, **kwargs))
+    return wrapper
 
 
 def home(request):
@@ -20,44 +114,215 @@ def home(request):
 
 def search(request):
     q = (request.GET.get("q") or "").strip()
+    with METRICS.trace(q, kind="search" if q else "browse"), _index_snapshot() as snapshot:
+        return _search_view(request, q, snapshot)
+
+
+def _search_view(request, q, snapshot):
     use_stemming = request.GET.get("stem") == "1"
-    payload = load_index()
+    year = (request.GET.get("year") or "").strip()
+    payload = snapshot.payload
+    cursor = (request.GET.get("cursor") or "").strip()
     results = []
+    listing = None
+    next_cursor = None
 
     if q and payload:
-        results = run_search(q, payload, top_k=15, use_stemming=use_stemming)
+        # Deeper pages continue from the cursor (last score and doc id) of the previous one.
+        page = search_page(q, payload, page_size=RESULTS_PAGE_SIZE, cursor=cursor or None,
+                           use_stemming=use_stemming, cache=RESULTS, generation=snapshot.generation,
+                           **_search_options())
+        results = page.results
+        next_cursor = page.next_cursor
     elif payload:
-        docs = list(payload.get("docs", {}).values())
-        def sort_key(d):
-            year = d.get("year") or ""
-            try:
-                y = int(year)
-            except ValueError:
-                y = 0
-            title = (d.get("title") or "").lower()
-            return (-y, title)
-        docs.sort(key=sort_key)
-        results = [{**d, "score": None} for d in docs]
+        # Browse order is stored with the index: a page is a slice of it.
+        listing = browse_page(payload, page=_page_number(request), per_page=BROWSE_PAGE_SIZE, year=year)
+        results = listing["results"]
 
     context = {
         "q": q,
         "results": results,
         "use_stemming": use_stemming,
         "has_index": bool(payload),
-        "doc_count": len(results),
+        "doc_count": listing["total"] if listing else len(results),
+        "index_generation": snapshot.generation,
+        "listing": listing,
+        "year": year,
+        "cursor": cursor,
+        "next_cursor": next_cursor,
     }
-    return render(request, "results.html", context)
+    with stage("render"):
+        response = render(request, "results.html", context)
+    response["X-Index-Generation"] = str(snapshot.generation)
+    return response
+
+
+@require_GET
+def api_search(request):
+    """GET /api/search?q=...&top=15&stem=1&cursor=... -> one page of results as JSON."""
+    q = (request.GET.get("q") or "").strip()
+    with METRICS.trace(q, kind="api"), _index_snapshot() as snapshot:
+        return _api_search(request, q, snapshot)
+
+
+def _api_search(request, q, snapshot):
+    if not q:
+        return _api_response({"error": "q is required"}, snapshot, status=400)
+    if not snapshot.payload:
+        return _api_response({"error": "index not found"}, snapshot, status=503)
+    try:
+        top = _api_top(request.GET.get("top"))
+    except ValueError as exc:
+        return _api_response({"error": str(exc)}, snapshot, status=400)
+
+    start = time.perf_counter()
+    page = search_page(q, snapshot.payload, page_size=top, cursor=request.GET.get("cursor") or None,
+                       use_stemming=request.GET.get("stem") == "1", cache=RESULTS,
+                       generation=snapshot.generation, **_search_options())
+    return _api_response({
+        "query": q,
+        "generation": snapshot.generation,
+        "results": page.results,
+        "next_cursor": page.next_cursor,
+        "took_ms": round((time.perf_counter() - start) * 1000, 3),
+    }, snapshot)
+
+
+@csrf_exempt
+@require_POST
+def api_search_batch(request):
+    """
+    POST /api/search/batch with {"queries": [...], "top": 15, "stem": false}
+    -> the first page of each query, in order, with per-query timing. The
+    queries share decoded postings and identical queries are run once.
+    """
+    with _index_snapshot() as snapshot:
+        return _api_search_batch(request, snapshot)
+
+
+def _api_search_batch(request, snapshot):
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        body = None
+    # Error messages are fixed strings: nothing from the parser reaches the client.
+    if not isinstance(body, dict):
+        return _api_response({"error": "request body must be a JSON object"}, snapshot, status=400)
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return _api_response({"error": "queries must be a list of strings"}, snapshot, status=400)
+    if len(queries) > API_MAX_BATCH:
+        return _api_response({"error": f"at most {API_MAX_BATCH} queries per batch"}, snapshot, status=400)
+    try:
+        top = _api_top(body.get("top"))
+    except ValueError as exc:
+        return _api_response({"error": str(exc)}, snapshot, status=400)
+    if not snapshot.payload:
+        return _api_response({"error": "index not found"}, snapshot, status=503)
+
+    start = time.perf_counter()
+    with METRICS.trace(f"{len(queries)} queries", kind="batch") as trace:
+        answers = search_batch([q.strip() for q in queries], snapshot.payload, page_size=top,
+                               use_stemming=bool(body.get("stem")), cache=RESULTS,
+                               generation=snapshot.generation, **_search_options())
+        if trace is not None:
+            trace.results = sum(len(a.page.results) for a in answers)
+    return _api_response({
+        "generation": snapshot.generation,
+        "responses": [
+            {
+                "query": a.query,
+                "results": a.page.results,
+                "next_cursor": a.page.next_cursor,
+                "took_ms": round(a.seconds * 1000, 3),
+            }
+            for a in answers
+        ],
+        "took_ms": round((time.perf_counter() - start) * 1000, 3),
+    }, snapshot)
+
+
+@require_GET
+def suggest(request):
+    """
+    GET /suggest?q=neural+netw&top=8 -> completions for the search box:
+    index terms completing the last word (most documents first) and titles
+    starting with q. Answered from tables stored with the index, so the cost
+    does not grow with the vocabulary or the number of documents.
+    """
+    q = request.GET.get("q") or ""
+    with METRICS.trace(q, kind="suggest"), _index_snapshot() as snapshot:
+        return _suggest(request, q, snapshot)
+
+
+def _suggest(request, q, snapshot):
+    if not snapshot.payload:
+        return _api_response({"error": "index not found"}, snapshot, status=503)
+    try:
+        top = _api_top(request.GET.get("top"), default=SUGGEST_TOP, maximum=SUGGEST_MAX_TOP)
+    except ValueError as exc:
+        return _api_response({"error": str(exc)}, snapshot, status=400)
+    with stage("suggest"):
+        completions = suggest_for(snapshot.payload).complete(q, top)
+    return _api_response({"query": q, "generation": snapshot.generation, **completions}, snapshot)
+
+
+def _metrics_token_ok(request):
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token:
+        return False
+    supplied = request.headers.get("Authorization", "")
+    return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8"))
+
+
+# Exempt from CSRF because every request must carry the token in a header,
+# which a browser never attaches to a cross-site request.
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def metrics(request):
+    """
+    GET /metrics -> instrumentation counters, rolling p50/p95/p99 per query
+    kind and per stage, and the result cache counters. POST a JSON object of
+    options (enabled, slow_ms, profile, profile_sample) to change them at
+    runtime; {"reset": true} clears the windows. log_path and profile_dir
+    are set in settings only. Requests must send "Authorization: Bearer
+    <METRICS_TOKEN>"; without a configured token the endpoint is off.
+    """
+    if not _metrics_token_ok(request):
+        return JsonResponse({"error": "a valid metrics token is required"}, status=403)
+    if request.method == "POST":
+        try:
+            options = json.loads(request.body or b"{}")
+        except ValueError:
+            options = None
+        if not isinstance(options, dict):
+            return JsonResponse({"error": "request body must be a JSON object"}, status=400)
+        reset = options.pop("reset", False)
+        if not isinstance(reset, bool):
+            return JsonResponse({"error": "bad instrumentation option reset: expected true or false"}, status=400)
+        try:
+            METRICS.configure(**options)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        if reset:
+            METRICS.reset()
+    data = METRICS.snapshot()
+    data["result_cache"] = RESULTS.stats().as_dict()
+    data["result_cache"]["hit_rate"] = round(RESULTS.stats().hit_rate, 4)
+    data["index_generation"] = INDEX.generation
+    return JsonResponse(data)
 
 
 def classify(request):
     text = ""
     label = None
-    model_ready = load_model() is not None
+    bundle = MODEL.get()
+    model_ready = bundle is not None
 
     if request.method == "POST":
         text = (request.POST.get("text") or "").strip()
         if text and model_ready:
-            label = predict_label(text)
+            label = predict_label(text, bundle)
 
     context = {
         "text": text,
@@ -65,3 +330,12 @@ def classify(request):
         "model_ready": model_ready,
     }
     return render(request, "classification.html", context)
+
+
+home_async = _in_executor(home)
+search_async = _in_executor(search)
+classify_async = _in_executor(classify)
+api_search_async = _in_executor(api_search)
+api_search_batch_async = _in_executor(api_search_batch)
+suggest_async = _in_executor(suggest)
+metrics_async = _in_executor(metrics)
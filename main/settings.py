@@ -1,4 +1,5 @@
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -106,3 +107,55 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+
+
+# Search engine
+# Scoring engine used by the search view: 'dict' and 'numpy' score every
+# matching document, 'maxscore' prunes postings that cannot reach the top k.
+
+SEARCH_ENGINE = 'maxscore'
+
+# BM25F field weights, used for field queries (author:smith, year:2021) and
+# by the 'bm25f' engine.
+
+SEARCH_FIELD_WEIGHTS = {'title': 3.0, 'abstract': 1.0, 'authors': 2.0, 'year': 1.0}
+
+# Fuzzy expansion: query terms missing from the index are also matched
+# against their nearest vocabulary terms (one edit, two for long terms).
+
+SEARCH_FUZZY = True
+
+# Search result cache (per process): LRU bounded by entries and approximate
+# size, emptied whenever a new index generation is loaded. 0 MB disables it.
+
+SEARCH_CACHE_ENTRIES = 1024
+SEARCH_CACHE_MB = 16
+
+# Query instrumentation (search_engine.instrument): per-stage timings,
+# postings scanned and result counts per query, appended as JSON lines to
+# log_path, with rolling p50/p95/p99 at /metrics. Off unless
+# SEARCH_INSTRUMENT=1; POST {"enabled": true} to /metrics turns it on at
+# runtime. With profile on, a profile_sample fraction of queries run under
+# cProfile and those slower than slow_ms are dumped to profile_dir. log_path
+# and profile_dir can only be set here. /metrics answers only requests that
+# send "Authorization: Bearer <METRICS_TOKEN>", and is off while it is empty.
+
+SEARCH_INSTRUMENTATION = {
+    'enabled': os.environ.get('SEARCH_INSTRUMENT', '') == '1',
+    'log_path': str(BASE_DIR / 'data' / 'query_log.jsonl'),
+    'slow_ms': 250.0,
+    'profile': False,
+    'profile_sample': 0.1,
+    'profile_dir': str(BASE_DIR / 'data' / 'profiles'),
+}
+METRICS_TOKEN = os.environ.get('SEARCH_METRICS_TOKEN', '')
+
+# Serving. main/asgi.py sets DJANGO_ASYNC_VIEWS=1 so that ASGI servers
+# (uvicorn main.asgi:application) route the async views, which run blocking
+# work on a pool of VIEW_WORKERS threads. PRELOAD_ON_STARTUP makes main/asgi.py
+# and main/wsgi.py load the index and classifier model when the server starts
+# instead of on the first request; management commands never load them.
+
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS', '') == '1'
+VIEW_WORKERS = 4
+PRELOAD_ON_STARTUP = True
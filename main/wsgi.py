@@ -6,3 +6,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
 
 application = get_wsgi_application()
+
+# Imported once the app registry is ready.
+from core.views import preload
+
+preload()
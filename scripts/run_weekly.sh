@@ -1,2 +1,2 @@
 #!/usr/bin/env bash
-python -m search_engine.crawler --seed "https://pureportal.coventry.ac.uk/en/organisations/ics-research-centre-for-computational-science-and-mathematical-mo/" --max-pages 300 --delay 1.2
+python -m search_engine.crawler --seed "https://pureportal.coventry.ac.uk/en/organisations/ics-research-centre-for-computational-science-and-mathematical-mo/" --max-pages 300 --delay 1.2 --concurrency 4
@@ -0,0 +1,300 @@
+import threading
+from collections import OrderedDict, abc
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .fields import per_payload
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+class ArrayIndex:
+    """
+    Postings stored as flat NumPy arrays (CSR layout: one doc-number array and
+    one tf array, sliced per term) with the BM25 length normalisation
+    k1 * (1 - b + b * dl / avgdl) precomputed per document.
+
+    Scores are accumulated into a dense array and are bit-for-bit identical to
+    bm25.bm25_score: the same float64 operations are applied in the same order.
+    """
+
+    def __init__(
+        self,
+        doc_keys: Sequence,
+        doc_lengths: np.ndarray,
+        terms: Dict[str, int],
+        offsets: np.ndarray,
+        doc_nums: np.ndarray,
+        tfs: np.ndarray,
+        idf: np.ndarray,
+        max_scores: Optional[np.ndarray] = None,
+    ):
+        self.doc_keys = doc_keys if isinstance(doc_keys, abc.Sequence) else list(doc_keys)
+        self.doc_lengths = doc_lengths
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_nums = doc_nums
+        self.tfs = tfs
+        self.idf = idf
+        self.n_docs = len(self.doc_keys)
+        self.avgdl = float(int(doc_lengths.sum())) / float(self.n_docs) if self.n_docs else 0.0
+        self._norms: Dict[Tuple[float, float], np.ndarray] = {}
+        self._norm_lists: Dict[Tuple[float, float], List[float]] = {}
+        self._max_scores: Dict[Tuple[float, float], np.ndarray] = {}
+        self._doc_nums: Optional[Dict[object, int]] = None
+        if max_scores is not None:
+            self._max_scores[(DEFAULT_K1, DEFAULT_B)] = max_scores
+        self.norms(DEFAULT_K1, DEFAULT_B)
+
+    @classmethod
+    def from_payload(cls, payload: Mapping) -> "ArrayIndex":
+        index = payload.get("index", {})
+        doc_lengths = payload.get("doc_lengths", {})
+        idf = payload.get("idf", {})
+        stored_max = payload.get("max_scores")
+
+        doc_keys = list(doc_lengths.keys())
+        key_to_num = {k: i for i, k in enumerate(doc_keys)}
+        lengths = np.fromiter((doc_lengths[k] for k in doc_keys), dtype=np.int64, count=len(doc_keys))
+
+        terms: Dict[str, int] = {}
+        offsets = [0]
+        nums: List[int] = []
+        tfs: List[int] = []
+        idfs: List[float] = []
+        maxes: List[float] = []
+        for term, postings in index.items():
+            for doc_id, tf in postings.items():
+                num = key_to_num.get(doc_id)
+                if num is None:
+                    continue
+                nums.append(num)
+                tfs.append(tf)
+            terms[term] = len(idfs)
+            idfs.append(idf.get(term, 0.0))
+            if stored_max is not None:
+                maxes.append(stored_max.get(term, 0.0))
+            offsets.append(len(nums))
+
+        return cls(
+            doc_keys=doc_keys,
+            doc_lengths=lengths,
+            terms=terms,
+            offsets=np.asarray(offsets, dtype=np.int64),
+            doc_nums=np.asarray(nums, dtype=np.int64),
+            tfs=np.asarray(tfs, dtype=np.float64),
+            idf=np.asarray(idfs, dtype=np.float64),
+            max_scores=np.asarray(maxes, dtype=np.float64) if stored_max is not None else None,
+        )
+
+    def norms(self, k1: float, b: float) -> np.ndarray:
+        norm = self._norms.get((k1, b))
+        if norm is None:
+            if self.avgdl > 0:
+                norm = k1 * (1 - b + b * (self.doc_lengths / self.avgdl))
+            else:
+                norm = np.zeros(self.n_docs, dtype=np.float64)
+            self._norms[(k1, b)] = norm
+        return norm
+
+    def norms_list(self, k1: float, b: float) -> List[float]:
+        """norms() as a Python list, for per-document loops."""
+        norm = self._norm_lists.get((k1, b))
+        if norm is None:
+            norm = self.norms(k1, b).tolist()
+            self._norm_lists[(k1, b)] = norm
+        return norm
+
+    def max_scores(self, k1: float, b: float) -> np.ndarray:
+        """Per-term upper bound on a single document's BM25 contribution."""
+        maxes = self._max_scores.get((k1, b))
+        if maxes is None:
+            maxes = np.zeros(len(self.terms), dtype=np.float64)
+            if len(self.doc_nums) and self.avgdl > 0:
+                norm = self.norms(k1, b)
+                lengths = np.diff(self.offsets)
+                term_of = np.repeat(np.arange(len(lengths)), lengths)
+                contrib = self.idf[term_of] * (self.tfs * (k1 + 1)) / (self.tfs + norm[self.doc_nums])
+                nonempty = lengths > 0
+                maxes[nonempty] = np.maximum.reduceat(contrib, self.offsets[:-1][nonempty])
+            self._max_scores[(k1, b)] = maxes
+        return maxes
+
+    def doc_num(self, doc_key) -> Optional[int]:
+        """Doc number of a document key (the map is built on first use)."""
+        if self._doc_nums is None:
+            self._doc_nums = {k: i for i, k in enumerate(self.doc_keys)}
+        return self._doc_nums.get(doc_key)
+
+    # Per-term access; the engines go through these so that BinaryArrayIndex
+    # can decode a term's postings only when a query needs them.
+    def slot_of(self, term: str) -> Optional[int]:
+        return self.terms.get(term)
+
+    def postings_at(self, slot: int) -> Tuple[np.ndarray, np.ndarray]:
+        lo, hi = self.offsets[slot], self.offsets[slot + 1]
+        return self.doc_nums[lo:hi], self.tfs[lo:hi]
+
+    def idf_at(self, slot: int) -> float:
+        return float(self.idf[slot])
+
+    def max_score_at(self, slot: int, k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> float:
+        return float(self.max_scores(k1, b)[slot])
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        slot = self.slot_of(term)
+        if slot is None:
+            return None
+        return self.postings_at(slot)
+
+    def score(
+        self, query_terms: List[str], k1: float = DEFAULT_K1, b: float = DEFAULT_B
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (scores, order): the dense score array and the candidate doc
+        numbers in the order bm25_score would first have inserted them.
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        if not self.n_docs or self.avgdl <= 0:
+            return scores, np.empty(0, dtype=np.int64)
+        norm = self.norms(k1, b)
+        unseen = np.iinfo(np.int64).max
+        first_term = np.full(self.n_docs, unseen, dtype=np.int64)
+        first_pos = np.zeros(self.n_docs, dtype=np.int64)
+
+        for qi, term in enumerate(query_terms):
+            slot = self.slot_of(term)
+            if slot is None:
+                continue
+            ids, tf = self.postings_at(slot)
+            if not len(ids):
+                continue
+            denom = tf + norm[ids]
+            scores[ids] += self.idf_at(slot) * (tf * (k1 + 1)) / np.where(denom != 0, denom, 1.0)
+
+            new = first_term[ids] == unseen
+            first_term[ids[new]] = qi
+            first_pos[ids[new]] = np.flatnonzero(new)
+
+        candidates = np.flatnonzero(first_term != unseen)
+        order = candidates[np.lexsort((first_pos[candidates], first_term[candidates]))]
+        return scores, order
+
+    def top_k(
+        self, query_terms: List[str], k: int, k1: float = DEFAULT_K1, b: float = DEFAULT_B
+    ) -> List[Tuple[object, float]]:
+        scores, order = self.score(query_terms, k1=k1, b=b)
+        if not len(order) or k <= 0:
+            return []
+        cand_scores = scores[order]
+        if len(order) > k:
+            # Keep everything tied with the k-th best so the stable sort below
+            # breaks ties exactly as sorted() over the score dict does.
+            kth = np.partition(cand_scores, len(order) - k)[len(order) - k]
+            keep = cand_scores >= kth
+            order = order[keep]
+            cand_scores = cand_scores[keep]
+        ranked = np.argsort(-cand_scores, kind="stable")[:k]
+        return [(self.doc_keys[order[i]], float(cand_scores[i])) for i in ranked]
+
+class BinaryArrayIndex(ArrayIndex):
+    """
+    ArrayIndex over a BinaryIndex or one of its fields. Only the doc lengths
+    are read up front; a term's postings are decoded from the mmap the first
+    time a query needs them (and kept in a small LRU), so a binary index
+    still pages in only the postings its queries touch. Doc keys are the
+    binary index's own doc numbers, or the field's doc_keys when it has them
+    (incremental overlays, which offer the same per-term interface).
+    """
+
+    POSTINGS_CACHE = 1024
+
+    def __init__(self, field: Mapping):
+        lengths = np.asarray(field["doc_lengths"].values(), dtype=np.int64)
+        doc_keys = getattr(field, "doc_keys", None)
+        super().__init__(
+            doc_keys=range(len(lengths)) if doc_keys is None else doc_keys,
+            doc_lengths=lengths,
+            terms={},
+            offsets=np.zeros(1, dtype=np.int64),
+            doc_nums=np.empty(0, dtype=np.int64),
+            tfs=np.empty(0, dtype=np.float64),
+            idf=np.empty(0, dtype=np.float64),
+        )
+        self._field = field
+        self._has_max_scores = "max_scores" in field
+        self._postings: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._postings_lock = threading.Lock()
+
+    def slot_of(self, term: str) -> Optional[int]:
+        slot = self._field.term_slot(term)
+        return slot if slot >= 0 else None
+
+    def postings_at(self, slot: int) -> Tuple[np.ndarray, np.ndarray]:
+        with self._postings_lock:
+            hit = self._postings.get(slot)
+            if hit is not None:
+                self._postings.move_to_end(slot)
+                return hit
+        postings = self._field.postings_at(slot)
+        arrays = (
+            np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+            np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+        )
+        with self._postings_lock:
+            self._postings[slot] = arrays
+            while len(self._postings) > self.POSTINGS_CACHE:
+                self._postings.popitem(last=False)
+        return arrays
+
+    def idf_at(self, slot: int) -> float:
+        return self._field.record_at(slot)[3]
+
+    def max_score_at(self, slot: int, k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> float:
+        if self._has_max_scores and (k1, b) == (DEFAULT_K1, DEFAULT_B):
+            return self._field.max_score_at(slot)
+        maxes = self._max_scores.get((k1, b))
+        if maxes is not None:
+            return float(maxes[slot])
+        return self._max_score(slot, *self.postings_at(slot), k1, b)
+
+    def _max_score(self, slot: int, ids: np.ndarray, tfs: np.ndarray, k1: float, b: float) -> float:
+        if not len(ids) or self.avgdl <= 0:
+            return 0.0
+        return float(np.max(self.idf_at(slot) * (tfs * (k1 + 1)) / (tfs + self.norms(k1, b)[ids])))
+
+    def max_scores(self, k1: float, b: float) -> np.ndarray:
+        """
+        The stored section for the default k1 and b; otherwise computed from
+        every posting list once (bypassing the postings LRU) and kept.
+        """
+        maxes = self._max_scores.get((k1, b))
+        if maxes is None:
+            if self._has_max_scores and (k1, b) == (DEFAULT_K1, DEFAULT_B):
+                maxes = self._field.max_scores_array()
+            else:
+                maxes = np.zeros(self._field.n_terms, dtype=np.float64)
+                for slot in range(self._field.n_terms):
+                    postings = self._field.postings_at(slot)
+                    ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                    tfs = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+                    maxes[slot] = self._max_score(slot, ids, tfs, k1, b)
+            self._max_scores[(k1, b)] = maxes
+        return maxes
+
+    def doc_num(self, doc_key) -> Optional[int]:
+        doc_num = getattr(self._field, "doc_num", None)
+        if doc_num is not None:
+            return doc_num(doc_key)
+        return doc_key if isinstance(doc_key, int) and 0 <= doc_key < self.n_docs else None
+
+def array_index_for(payload: Mapping) -> ArrayIndex:
+    """Build (once) and return the ArrayIndex for a loaded payload."""
+    return per_payload("arrays", payload, _build_arrays)
+
+def _build_arrays(payload: Mapping) -> ArrayIndex:
+    # Binary indexes and overlays decode postings per term; plain payloads are converted whole.
+    if callable(getattr(payload, "postings_at", None)):
+        return BinaryArrayIndex(payload)
+    return ArrayIndex.from_payload(payload)
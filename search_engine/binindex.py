@@ -0,0 +1,982 @@
+"""
+Binary index format: index.bin holds a sorted term dictionary, delta/varint
+encoded postings over integer doc numbers and the doc length table;
+index.fields holds the stored document fields. Both files are mmap'ed, so
+only the pages a query touches are read. Integers are little-endian.
+"""
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .bm25 import compute_idf, compute_max_scores
+from .browse import BROWSE, browse_key, build_browse
+from .fields import STEMMED, TEXT_FIELDS, stem_index
+from .fuzzy import FUZZY, FuzzyEntries, FuzzyIndex
+from .positions import FIELD_STARTS, doc_field_starts
+from .suggest import SUGGEST, Completions, Suggester, build_titles
+
+MAGIC = b"IRIDX\x00\x01\x00"
+FIELDS_MAGIC = b"IRFLD\x00\x01\x00"
+ID_WIDTH = 16
+
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+# postings offset, postings byte length, document frequency, idf
+_TERM_REC = struct.Struct("<QIId")
+_TERM_REC_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("df", "<u4"), ("idf", "<f8")])
+
+def fields_path_for(index_path: str) -> str:
+    p = Path(index_path)
+    return str(p.with_suffix(".fields"))
+
+def _section_name(field: str, name: str) -> str:
+    return f"{field}.{name}" if field else name
+
+def is_binary_index(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varints(buf, start: int = 0, end: Optional[int] = None) -> List[int]:
+    end = len(buf) if end is None else end
+    out: List[int] = []
+    value = 0
+    shift = 0
+    for i in range(start, end):
+        byte = buf[i]
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            out.append(value)
+            value = 0
+            shift = 0
+    return out
+
+def encode_postings(postings: List[Tuple[int, int]]) -> bytes:
+    out = bytearray()
+    prev = 0
+    for doc_num, tf in postings:
+        encode_varint(doc_num - prev, out)
+        encode_varint(tf, out)
+        prev = doc_num
+    return bytes(out)
+
+def decode_postings(buf, start: int = 0, end: Optional[int] = None) -> Dict[int, int]:
+    nums = decode_varints(buf, start, end)
+    postings: Dict[int, int] = {}
+    doc_num = 0
+    for i in range(0, len(nums), 2):
+        doc_num += nums[i]
+        postings[doc_num] = nums[i + 1]
+    return postings
+
+def _write_atomic(path: Path, chunks: List[bytes]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+def _build_id(toc: Dict, parts: Iterable[bytes]) -> str:
+    """
+    Id shared by an index.bin and its .fields, derived from their contents
+    (the header without the id, every section and the stored fields), so
+    equal inputs give byte-identical files whichever writer built them.
+    """
+    digest = hashlib.sha1(json.dumps(toc, sort_keys=True).encode("utf-8"))
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+def _le_bytes(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+def _encode_field(
+    index: Dict[str, Dict[str, int]],
+    doc_lengths: Dict[str, int],
+    doc_ids: List[str],
+    doc_numbers: Dict[str, int],
+) -> Tuple[Dict, List[Tuple[str, bytes]]]:
+    idf = compute_idf(index, n_docs=len(doc_ids))
+    max_scores = compute_max_scores(index, doc_lengths, idf)
+    terms = sorted(index, key=lambda t: t.encode("utf-8"))
+
+    term_blob = bytearray()
+    term_offsets = array("I", [0])
+    records = bytearray()
+    postings_blob = bytearray()
+    for term in terms:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+        plist = sorted((doc_numbers[d], tf) for d, tf in index[term].items() if d in doc_numbers)
+        data = encode_postings(plist)
+        records += _TERM_REC.pack(len(postings_blob), len(data), len(plist), idf[term])
+        postings_blob += data
+
+    lengths = array("I", (doc_lengths.get(d, 0) for d in doc_ids))
+    maxes = array("d", (max_scores.get(t, 0.0) for t in terms))
+    sections = [
+        ("term_offsets", _le_bytes(term_offsets)),
+        ("terms", bytes(term_blob)),
+        ("records", bytes(records)),
+        ("postings", bytes(postings_blob)),
+        ("doc_lengths", _le_bytes(lengths)),
+        ("max_scores", _le_bytes(maxes)),
+    ]
+    toc = {"n_terms": len(terms), "total_length": int(sum(lengths))}
+    return toc, sections
+
+def _encode_positions(
+    index: Dict[str, Dict[str, int]],
+    positions: Dict[str, Dict[str, List[int]]],
+    doc_numbers: Dict[str, int],
+) -> List[Tuple[str, bytes]]:
+    """
+    Per main-field term (in dictionary order), the varint gaps of each of its
+    postings in doc number order. A posting's tf is its number of positions,
+    so only the term's start offset is stored.
+    """
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for term in sorted(index, key=lambda t: t.encode("utf-8")):
+        by_doc = positions.get(term, {})
+        for _, doc_id in sorted((doc_numbers[d], d) for d in index[term] if d in doc_numbers):
+            for gap in by_doc[doc_id]:
+                encode_varint(gap, blob)
+        offsets.append(len(blob))
+    return [("position_offsets", _le_bytes(offsets)), ("positions", bytes(blob))]
+
+def _fuzzy_sections(fuzzy: FuzzyEntries) -> List[Tuple[str, bytes]]:
+    keys, targets = fuzzy.arrays()
+    return [("fuzzy_keys", keys.astype("<u4").tobytes()), ("fuzzy_targets", targets.astype("<u4").tobytes())]
+
+def _title_sections(titles: List[str]) -> List[Tuple[str, bytes]]:
+    """Title completion table; term completions read the term dictionary."""
+    texts, counts = build_titles(titles)
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = array("I", [0])
+    for t in encoded:
+        offsets.append(offsets[-1] + len(t))
+    return [
+        ("suggest_title_offsets", _le_bytes(offsets)),
+        ("suggest_titles", b"".join(encoded)),
+        ("suggest_title_weights", _le_bytes(array("I", counts))),
+    ]
+
+def write_binary_index(
+    index_path: str,
+    docs: Dict[str, Dict],
+    index: Dict[str, Dict[str, int]],
+    doc_lengths: Dict[str, int],
+    fields: Optional[Dict[str, Dict]] = None,
+    positions: Optional[Dict[str, Dict[str, List[int]]]] = None,
+) -> None:
+    if fields is None:
+        from .indexer import build_field_indexes
+        fields = build_field_indexes(docs)
+    doc_ids = list(docs.keys())
+    doc_numbers = {d: i for i, d in enumerate(doc_ids)}
+
+    # Stored fields: offset table followed by one JSON record per document.
+    records = [json.dumps(docs[d], ensure_ascii=False).encode("utf-8") for d in doc_ids]
+    offsets = [0]
+    for r in records:
+        offsets.append(offsets[-1] + len(r))
+    fields_body = [b"".join(_U64.pack(o) for o in offsets)] + records
+
+    field_toc, sections = _encode_field(index, doc_lengths, doc_ids, doc_numbers)
+    id_table = b"".join(d.encode("ascii").ljust(ID_WIDTH, b" ")[:ID_WIDTH] for d in doc_ids)
+    sections = [("doc_ids", id_table)] + sections
+
+    # Secondary fields share doc ids and lengths; only their term sections are stored.
+    fields_toc = {}
+    stem_toc, stem_sections = _encode_field(stem_index(index), doc_lengths, doc_ids, doc_numbers)
+    fields_toc[STEMMED] = {"n_terms": stem_toc["n_terms"]}
+    sections += [(_section_name(STEMMED, name), data) for name, data in stem_sections if name != "doc_lengths"]
+    # Text fields (title, abstract, ...) have their own lengths.
+    for name in TEXT_FIELDS:
+        text_toc, text_sections = _encode_field(fields[name]["index"], fields[name]["doc_lengths"], doc_ids, doc_numbers)
+        fields_toc[name] = text_toc
+        sections += [(_section_name(name, section), data) for section, data in text_sections]
+    if positions is not None:
+        sections += _encode_positions(index, positions, doc_numbers)
+        starts = array("I", [s for d in doc_ids for s in doc_field_starts(docs[d])])
+        sections.append(("field_starts", _le_bytes(starts)))
+    browse = build_browse([browse_key(docs[d]) for d in doc_ids], list(range(len(doc_ids))))
+    sections.append(("browse_order", _le_bytes(array("I", browse["order"]))))
+    # Deletion index for fuzzy expansion; targets are main term slots.
+    fuzzy = FuzzyEntries()
+    for slot, term in enumerate(sorted(index, key=lambda t: t.encode("utf-8"))):
+        fuzzy.add(term, slot)
+    sections += _fuzzy_sections(fuzzy)
+    sections += _title_sections([docs[d].get("title") or "" for d in doc_ids])
+
+    # Section offsets are relative to the end of the header.
+    toc = {
+        "n_docs": len(doc_ids),
+        "id_width": ID_WIDTH,
+        "ids_sorted": doc_ids == sorted(doc_ids),
+        **field_toc,
+        "fields": fields_toc,
+        "browse_years": browse["years"],
+        FUZZY: fuzzy.config(),
+        "sections": {},
+    }
+    offset = 0
+    for name, data in sections:
+        toc["sections"][name] = [offset, len(data)]
+        offset += len(data)
+    build_id = _build_id(toc, [data for _, data in sections] + fields_body)
+    header = json.dumps({"build_id": build_id, **toc}).encode("utf-8")
+    chunks = [MAGIC, _U32.pack(len(header)), header]
+    chunks += [data for _, data in sections]
+    fields_header = json.dumps({"build_id": build_id, "n_docs": len(doc_ids)}).encode("utf-8")
+    fields_chunks = [FIELDS_MAGIC, _U32.pack(len(fields_header)), fields_header] + fields_body
+
+    # Fields first: a reader that sees the new index.bin always finds matching
+    # stored fields (the build_id check catches the opposite race).
+    _write_atomic(Path(fields_path_for(index_path)), fields_chunks)
+    _write_atomic(Path(index_path), chunks)
+
+class BinaryIndexWriter:
+    """
+    Writes the same files as write_binary_index without holding the index in
+    memory: documents are added first (in doc number order), then each
+    field's terms in sorted utf-8 byte order with their postings. Sections
+    are spooled to files under work_dir and stitched together by finish().
+    Per-document state is the length and offset tables (a few bytes per
+    document); titles and browse keys are read back from the stored fields
+    spool by finish(), and fuzzy entries are spooled as they are added.
+    """
+
+    FIELDS = ("", STEMMED) + TEXT_FIELDS
+    # Fields with their own document lengths; the rest share the main field's.
+    LENGTH_FIELDS = ("",) + TEXT_FIELDS
+
+    def __init__(self, index_path: str, work_dir: str, k1: float = 1.2, b: float = 0.75):
+        self.index_path = index_path
+        self.work = Path(work_dir)
+        self.k1 = k1
+        self.b = b
+        names = ["fields", "doc_ids", "fuzzy"]
+        for field in self.FIELDS:
+            names += [_section_name(field, n) for n in ("terms", "records", "postings", "max_scores")]
+        self._spools = {name: (self.work / f"{name}.part").open("w+b") for name in names}
+        self._field_offsets = array("Q", [0])
+        self._lengths = {field: array("I") for field in self.LENGTH_FIELDS}
+        self._term_offsets = {field: array("I", [0]) for field in self.FIELDS}
+        self._postings_size = {field: 0 for field in self.FIELDS}
+        self._norms: Dict[str, List[float]] = {}
+        self._fuzzy = FuzzyEntries(spool=self._spools["fuzzy"])
+        self._last_id: Optional[str] = None
+        self._ids_sorted = True
+
+    @property
+    def n_docs(self) -> int:
+        return len(self._lengths[""])
+
+    def add_document(self, doc_id: str, fields: bytes, length: int, field_lengths: Tuple[int, ...] = ()) -> int:
+        """
+        Append a document (fields as UTF-8 JSON) and return its doc number.
+        field_lengths are its TEXT_FIELDS lengths, in that order.
+        """
+        self._spools["fields"].write(fields)
+        self._field_offsets.append(self._field_offsets[-1] + len(fields))
+        self._spools["doc_ids"].write(doc_id.encode("ascii").ljust(ID_WIDTH, b" ")[:ID_WIDTH])
+        if self._last_id is not None and doc_id < self._last_id:
+            self._ids_sorted = False
+        self._last_id = doc_id
+        self._lengths[""].append(length)
+        for name, field_length in zip(TEXT_FIELDS, field_lengths or (0,) * len(TEXT_FIELDS)):
+            self._lengths[name].append(field_length)
+        return self.n_docs - 1
+
+    def _field_norms(self, field: str) -> List[float]:
+        lengths = self._lengths[field if field in self._lengths else ""]
+        norms = self._norms.get(field)
+        if norms is None:
+            # Same expressions as compute_idf / compute_max_scores.
+            n = len(lengths)
+            avgdl = sum(lengths) / float(n) if n else 0.0
+            norms = self._norms[field] = [self.k1 * (1 - self.b + self.b * (dl / avgdl)) for dl in lengths] if avgdl > 0 else []
+        return norms
+
+    def add_term(self, term: str, postings: List[Tuple[int, int]], field: str = "") -> None:
+        """postings: (doc number, tf) sorted by doc number; terms must arrive sorted per field."""
+        key = term.encode("utf-8")
+        self._spools[_section_name(field, "terms")].write(key)
+        offsets = self._term_offsets[field]
+        offsets.append(offsets[-1] + len(key))
+        if not field:
+            self._fuzzy.add(term, len(offsets) - 2)
+
+        df = len(postings)
+        idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+        k1 = self.k1
+        norms = self._field_norms(field)
+        best = 0.0
+        for doc_num, tf in (postings if norms else ()):
+            denom = tf + norms[doc_num]
+            s = idf * (tf * (k1 + 1)) / (denom if denom else 1.0)
+            if s > best:
+                best = s
+        data = encode_postings(postings)
+        self._spools[_section_name(field, "records")].write(
+            _TERM_REC.pack(self._postings_size[field], len(data), df, idf)
+        )
+        self._spools[_section_name(field, "postings")].write(data)
+        self._spools[_section_name(field, "max_scores")].write(struct.pack("<d", best))
+        self._postings_size[field] += len(data)
+
+    def _stored_documents(self) -> Iterator[Dict]:
+        spool = self._spools["fields"]
+        spool.flush()
+        spool.seek(0)
+        offsets = self._field_offsets
+        for num in range(self.n_docs):
+            yield json.loads(spool.read(offsets[num + 1] - offsets[num]))
+
+    def _copy(self, name: str, out) -> None:
+        spool = self._spools[name]
+        spool.flush()
+        spool.seek(0)
+        shutil.copyfileobj(spool, out, 1 << 20)
+
+    def _read(self, parts: List[Tuple[str, object]]) -> Iterator[bytes]:
+        for kind, part in parts:
+            if kind != "spool":
+                yield part
+                continue
+            spool = self._spools[part]
+            spool.flush()
+            spool.seek(0)
+            yield from iter(lambda: spool.read(1 << 20), b"")
+
+    def _write_file(self, path: Path, parts: List[Tuple[str, object]]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            for kind, part in parts:
+                if kind == "spool":
+                    self._copy(part, f)
+                else:
+                    f.write(part)
+        os.replace(tmp, path)
+
+    def _field_sections(self, field: str, sizes: Dict[str, int]) -> List[Tuple[str, Tuple[str, object], int]]:
+        offsets = self._term_offsets[field]
+        spooled = lambda n: (_section_name(field, n), ("spool", _section_name(field, n)), sizes[_section_name(field, n)])
+        sections = [
+            (_section_name(field, "term_offsets"), ("bytes", _le_bytes(offsets)), 4 * len(offsets)),
+            spooled("terms"),
+            spooled("records"),
+            spooled("postings"),
+        ]
+        if field in self._lengths:
+            lengths = self._lengths[field]
+            sections.append((_section_name(field, "doc_lengths"), ("bytes", _le_bytes(lengths)), 4 * len(lengths)))
+        sections.append(spooled("max_scores"))
+        return sections
+
+    def finish(self) -> None:
+        n_docs = self.n_docs
+        sizes = {name: spool.tell() for name, spool in self._spools.items()}
+        sections = [("doc_ids", ("spool", "doc_ids"), sizes["doc_ids"])]
+        for field in self.FIELDS:
+            sections += self._field_sections(field, sizes)
+        # Browse keys and titles exist only while their sections are built.
+        keys, titles = [], []
+        for stored in self._stored_documents():
+            keys.append(browse_key(stored))
+            titles.append(stored.get("title") or "")
+        browse = build_browse(keys, range(n_docs))
+        order = array("I", browse["order"])
+        sections.append(("browse_order", ("bytes", _le_bytes(order)), 4 * len(order)))
+        tables = _title_sections(titles)
+        del keys, titles
+        for name, data in _fuzzy_sections(self._fuzzy) + tables:
+            sections.append((name, ("bytes", data), len(data)))
+        toc = {
+            "n_docs": n_docs,
+            "id_width": ID_WIDTH,
+            "ids_sorted": self._ids_sorted,
+            "n_terms": len(self._term_offsets[""]) - 1,
+            "total_length": int(sum(self._lengths[""])),
+            "fields": {},
+            "browse_years": browse["years"],
+            FUZZY: self._fuzzy.config(),
+            "sections": {},
+        }
+        for field in self.FIELDS[1:]:
+            toc["fields"][field] = {"n_terms": len(self._term_offsets[field]) - 1}
+            if field in self._lengths:
+                toc["fields"][field]["total_length"] = int(sum(self._lengths[field]))
+        offset = 0
+        for name, _, size in sections:
+            toc["sections"][name] = [offset, size]
+            offset += size
+        fields_body = [("bytes", _le_bytes(self._field_offsets)), ("spool", "fields")]
+        # One extra pass over the spools: both headers carry the content-derived id.
+        build_id = _build_id(toc, self._read([part for _, part, _ in sections] + fields_body))
+        fields_header = json.dumps({"build_id": build_id, "n_docs": n_docs}).encode("utf-8")
+        self._write_file(
+            Path(fields_path_for(self.index_path)),
+            [("bytes", FIELDS_MAGIC), ("bytes", _U32.pack(len(fields_header))), ("bytes", fields_header)] + fields_body,
+        )
+        header = json.dumps({"build_id": build_id, **toc}).encode("utf-8")
+        self._write_file(
+            Path(self.index_path),
+            [("bytes", MAGIC), ("bytes", _U32.pack(len(header))), ("bytes", header)] + [part for _, part, _ in sections],
+        )
+        self.close()
+
+    def close(self) -> None:
+        for spool in self._spools.values():
+            spool.close()
+
+_SHARED = threading.local()
+
+@contextmanager
+def shared_postings():
+    """
+    Within the block, postings (and positions) decoded on this thread are kept
+    and reused, so a batch of queries decodes each term once. The decoded
+    mappings are shared: callers must not modify them.
+    """
+    outer = getattr(_SHARED, "memo", None)
+    if outer is None:
+        _SHARED.memo = {}
+    try:
+        yield
+    finally:
+        if outer is None:
+            _SHARED.memo = None
+
+def _map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class _Postings(Mapping):
+    def __init__(self, owner: "BinaryIndex"):
+        self._owner = owner
+
+    def __getitem__(self, term: str) -> Dict[int, int]:
+        slot = self._owner.term_slot(term)
+        if slot < 0:
+            raise KeyError(term)
+        return self._owner.postings_at(slot)
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self._owner.term_slot(term) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for slot in range(self._owner.n_terms):
+            yield self._owner.term_at(slot)
+
+    def __len__(self) -> int:
+        return self._owner.n_terms
+
+class _Idf(_Postings):
+    def __getitem__(self, term: str) -> float:
+        slot = self._owner.term_slot(term)
+        if slot < 0:
+            raise KeyError(term)
+        return self._owner.record_at(slot)[3]
+
+class _MaxScores(_Postings):
+    def __getitem__(self, term: str) -> float:
+        slot = self._owner.term_slot(term)
+        if slot < 0:
+            raise KeyError(term)
+        return self._owner.max_score_at(slot)
+
+class _TermPositions(Mapping):
+    """
+    {doc number: position gaps} of one term. Only varint boundaries are found
+    up front; each document's gaps are decoded when it is looked up, so a
+    phrase check touches just the candidate documents.
+    """
+
+    def __init__(self, raw: bytes, tfs: Dict[int, int]):
+        self._raw = raw
+        self._tfs = tfs
+        self._ends: Optional[np.ndarray] = None
+        self._first: Dict[int, int] = {}
+
+    def __getitem__(self, doc_num: int) -> List[int]:
+        tf = self._tfs[doc_num]
+        if self._ends is None:
+            # Byte offset just past each varint, and each posting's first varint.
+            self._ends = np.flatnonzero(np.frombuffer(self._raw, dtype=np.uint8) < 0x80) + 1
+            i = 0
+            for d, n in self._tfs.items():
+                self._first[d] = i
+                i += n
+        k = self._first[doc_num]
+        lo = int(self._ends[k - 1]) if k else 0
+        return decode_varints(self._raw, lo, int(self._ends[k + tf - 1]))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._tfs)
+
+    def __len__(self) -> int:
+        return len(self._tfs)
+
+class _Positions(_Postings):
+    """term -> {doc number: position gaps}, read from the positions section."""
+
+    def __getitem__(self, term: str) -> _TermPositions:
+        owner = self._owner
+        slot = owner.term_slot(term)
+        if slot < 0:
+            raise KeyError(term)
+        off, _ = owner._sections["position_offsets"]
+        lo, hi = struct.unpack_from("<QQ", owner._mm, off + 8 * slot)
+        base, _ = owner._sections["positions"]
+        memo = getattr(_SHARED, "memo", None)
+        if memo is None:
+            return _TermPositions(owner._mm[base + lo:base + hi], owner.postings_at(slot))
+        key = (id(self), slot)
+        hit = memo.get(key)
+        if hit is None:
+            hit = memo[key] = _TermPositions(owner._mm[base + lo:base + hi], owner.postings_at(slot))
+        return hit
+
+class _FieldStarts(Mapping):
+    """doc number -> first position of each text field, read from the field_starts section."""
+
+    def __init__(self, owner: "BinaryIndex"):
+        self._owner = owner
+        self._offset, _ = owner._sections["field_starts"]
+        self._row = struct.Struct(f"<{len(TEXT_FIELDS)}I")
+
+    def __getitem__(self, num: int) -> Tuple[int, ...]:
+        if not isinstance(num, int) or not 0 <= num < self._owner.n_docs:
+            raise KeyError(num)
+        return self._row.unpack_from(self._owner._mm, self._offset + self._row.size * num)
+
+    def __iter__(self):
+        return iter(range(self._owner.n_docs))
+
+    def __len__(self) -> int:
+        return self._owner.n_docs
+
+class _BrowseOrder(Sequence):
+    """Doc numbers in browse order; slices are read straight from the mmap."""
+
+    def __init__(self, owner: "BinaryIndex"):
+        self._owner = owner
+        self._offset, size = owner._sections["browse_order"]
+        self._len = size // 4
+
+    def __getitem__(self, i):
+        if not isinstance(i, slice):
+            if i < 0:
+                i += self._len
+            if not 0 <= i < self._len:
+                raise IndexError(i)
+            return _U32.unpack_from(self._owner._mm, self._offset + 4 * i)[0]
+        start, stop, step = i.indices(self._len)
+        nums = array("I")
+        if stop > start:
+            nums.frombytes(self._owner._mm[self._offset + 4 * start:self._offset + 4 * stop])
+            if sys.byteorder != "little":
+                nums.byteswap()
+        return list(nums[::step])
+
+    def __len__(self) -> int:
+        return self._len
+
+class _Strings(Sequence):
+    """UTF-8 strings of an offsets/data section pair, decoded from the mmap on access."""
+
+    def __init__(self, owner: "BinaryIndex", offsets_section: str, data_section: str):
+        self._owner = owner
+        self._offsets, size = owner._sections[offsets_section]
+        self._data, _ = owner._sections[data_section]
+        self._len = size // 4 - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        lo, hi = struct.unpack_from("<II", self._owner._mm, self._offsets + 4 * i)
+        return self._owner._mm[self._data + lo:self._data + hi].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._len
+
+class _DocLengths(Mapping):
+    def __init__(self, lengths: array):
+        self._lengths = lengths
+
+    def __getitem__(self, doc_num: int) -> int:
+        if not isinstance(doc_num, int) or not 0 <= doc_num < len(self._lengths):
+            raise KeyError(doc_num)
+        return self._lengths[doc_num]
+
+    def get(self, doc_num, default=None):
+        try:
+            return self[doc_num]
+        except KeyError:
+            return default
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self._lengths)))
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def values(self):
+        return self._lengths
+
+class _Docs(Mapping):
+    def __init__(self, owner: "BinaryIndex"):
+        self._owner = owner
+
+    def __getitem__(self, doc_num: int) -> Dict:
+        if not isinstance(doc_num, int) or not 0 <= doc_num < self._owner.n_docs:
+            raise KeyError(doc_num)
+        return self._owner.stored_fields(doc_num)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._owner.n_docs))
+
+    def __len__(self) -> int:
+        return self._owner.n_docs
+
+class BinaryField(Mapping):
+    """
+    One postings field of a BinaryIndex (the main field or a secondary one
+    such as "stemmed" or "title"), shaped like a payload: "index", "idf",
+    "max_scores" plus the owner's "docs", and "doc_lengths" of its own for
+    text fields or the owner's otherwise.
+    """
+
+    def __init__(self, owner: "BinaryIndex", name: str, n_terms: int):
+        self._owner = owner
+        self.name = name
+        self.n_terms = n_terms
+        self._slot_cache: Dict[str, int] = {}
+        self._views = {
+            "docs": owner._docs_view,
+            "index": _Postings(self),
+            "doc_lengths": owner._lengths_view,
+            "idf": _Idf(self),
+        }
+        if name and _section_name(name, "doc_lengths") in owner._sections:
+            self._views["doc_lengths"] = _DocLengths(owner._read_lengths(_section_name(name, "doc_lengths")))
+        if _section_name(name, "max_scores") in owner._sections:
+            self._views["max_scores"] = _MaxScores(self)
+
+    def __getitem__(self, key: str):
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def _section(self, name: str) -> Tuple[int, int]:
+        return self._owner._sections[_section_name(self.name, name)]
+
+    def term_at(self, slot: int) -> str:
+        return self._term_bytes_at(slot).decode("utf-8")
+
+    def _term_bytes_at(self, slot: int) -> bytes:
+        off, _ = self._section("term_offsets")
+        lo, hi = struct.unpack_from("<II", self._owner._mm, off + 4 * slot)
+        toff, _ = self._section("terms")
+        return self._owner._mm[toff + lo:toff + hi]
+
+    def term_slot(self, term: str) -> int:
+        slot = self._slot_cache.get(term)
+        if slot is not None:
+            return slot
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        slot = -1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._term_bytes_at(mid)
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                slot = mid
+                break
+        if len(self._slot_cache) < 65536:
+            self._slot_cache[term] = slot
+        return slot
+
+    def record_at(self, slot: int) -> Tuple[int, int, int, float]:
+        off, _ = self._section("records")
+        return _TERM_REC.unpack_from(self._owner._mm, off + _TERM_REC.size * slot)
+
+    def max_score_at(self, slot: int) -> float:
+        off, _ = self._section("max_scores")
+        return struct.unpack_from("<d", self._owner._mm, off + 8 * slot)[0]
+
+    def max_scores_array(self) -> np.ndarray:
+        off, size = self._section("max_scores")
+        return np.frombuffer(self._owner._mm[off:off + size], dtype="<f8").astype(np.float64)
+
+    def postings_at(self, slot: int) -> Dict[int, int]:
+        memo = getattr(_SHARED, "memo", None)
+        if memo is not None:
+            hit = memo.get((id(self), slot))
+            if hit is not None:
+                return hit
+        poff, plen, _, _ = self.record_at(slot)
+        base, _ = self._section("postings")
+        postings = decode_postings(self._owner._mm, base + poff, base + poff + plen)
+        if memo is not None:
+            memo[(id(self), slot)] = postings
+        return postings
+
+class BinaryIndex(Mapping):
+    """
+    Read-only, mmap-backed index. It behaves like the JSON payload dict
+    ("docs", "index", "doc_lengths", "idf"), keyed by integer doc numbers,
+    so it can be passed straight to search().
+    """
+
+    def __init__(self, index_path: str):
+        self.path = index_path
+        self._mm = _map_file(index_path)
+        if self._mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{index_path} is not a binary index")
+        (hlen,) = _U32.unpack_from(self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.toc = json.loads(bytes(self._mm[start:start + hlen]))
+        base = start + hlen
+        self._sections = {k: (base + off, size) for k, (off, size) in self.toc["sections"].items()}
+        self.n_docs: int = self.toc["n_docs"]
+        self.n_terms: int = self.toc["n_terms"]
+        self.total_length: int = self.toc.get("total_length", 0)
+
+        self._fmm = _map_file(fields_path_for(index_path))
+        if self._fmm[: len(FIELDS_MAGIC)] != FIELDS_MAGIC:
+            raise ValueError("stored fields file is missing or corrupt")
+        (flen,) = _U32.unpack_from(self._fmm, len(FIELDS_MAGIC))
+        fstart = len(FIELDS_MAGIC) + 4
+        fields_header = json.loads(bytes(self._fmm[fstart:fstart + flen]))
+        if fields_header.get("build_id") != self.toc["build_id"]:
+            raise ValueError("index.bin and index.fields come from different builds")
+        self._fields_offsets = fstart + flen
+        self._fields_data = self._fields_offsets + 8 * (self.n_docs + 1)
+
+        self._id_width = self.toc.get("id_width", ID_WIDTH)
+        self._doc_numbers: Optional[Dict[str, int]] = None
+        self._docs_view = _Docs(self)
+        self._lengths_view = _DocLengths(self._read_lengths("doc_lengths"))
+        self._main = BinaryField(self, "", self.n_terms)
+        self._views = dict(self._main._views)
+        text_fields: Dict[str, BinaryField] = {}
+        for name, info in self.toc.get("fields", {}).items():
+            field = BinaryField(self, name, info["n_terms"])
+            if name in TEXT_FIELDS:
+                text_fields[name] = field
+            else:
+                self._views[name] = field
+        if text_fields:
+            self._views["fields"] = text_fields
+        if "positions" in self._sections:
+            self._views["positions"] = _Positions(self)
+        if "field_starts" in self._sections:
+            self._views[FIELD_STARTS] = _FieldStarts(self)
+        if "browse_order" in self._sections:
+            self._views[BROWSE] = {"order": _BrowseOrder(self), "years": self.toc.get("browse_years", {})}
+        if "fuzzy_keys" in self._sections:
+            self._views[FUZZY] = FuzzyIndex(
+                self._read_u32("fuzzy_keys"), self._read_u32("fuzzy_targets"), self.term_at, **self.toc.get(FUZZY, {})
+            )
+        if "suggest_titles" in self._sections:
+            self._views[SUGGEST] = Suggester(
+                Completions(_Strings(self, "term_offsets", "terms"), self._read_dfs()),
+                Completions(_Strings(self, "suggest_title_offsets", "suggest_titles"), self._read_u32("suggest_title_weights")),
+            )
+
+    # Mapping interface mirrors the JSON payload keys.
+    def __getitem__(self, key: str):
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def close(self) -> None:
+        self._mm.close()
+        self._fmm.close()
+
+    def _read_lengths(self, section: str) -> array:
+        off, size = self._sections[section]
+        lengths = array("I")
+        lengths.frombytes(self._mm[off:off + size])
+        if sys.byteorder != "little":
+            lengths.byteswap()
+        return lengths
+
+    def _read_u32(self, section: str) -> np.ndarray:
+        # Slicing copies: arrays viewing the mmap would keep close() from unmapping it.
+        off, size = self._sections[section]
+        return np.frombuffer(self._mm[off:off + size], dtype="<u4").astype(np.uint32, copy=False)
+
+    def _read_dfs(self) -> np.ndarray:
+        off, size = self._sections["records"]
+        return np.frombuffer(self._mm[off:off + size], dtype=_TERM_REC_DTYPE)["df"].astype(np.uint32)
+
+    # -- term dictionary of the main field
+    def term_at(self, slot: int) -> str:
+        return self._main.term_at(slot)
+
+    def term_slot(self, term: str) -> int:
+        return self._main.term_slot(term)
+
+    def record_at(self, slot: int) -> Tuple[int, int, int, float]:
+        return self._main.record_at(slot)
+
+    def max_score_at(self, slot: int) -> float:
+        return self._main.max_score_at(slot)
+
+    def max_scores_array(self) -> np.ndarray:
+        return self._main.max_scores_array()
+
+    def postings_at(self, slot: int) -> Dict[int, int]:
+        return self._main.postings_at(slot)
+
+    # -- documents
+    def stable_id(self, doc_num: int) -> str:
+        off, _ = self._sections["doc_ids"]
+        w = self._id_width
+        return self._mm[off + w * doc_num:off + w * (doc_num + 1)].decode("ascii").rstrip()
+
+    def doc_number(self, stable_id: str) -> Optional[int]:
+        if self.toc.get("ids_sorted"):
+            # Ids written in sorted order are binary searched in the mmap.
+            num = bisect_left(range(self.n_docs), stable_id, key=self.stable_id)
+            return num if num < self.n_docs and self.stable_id(num) == stable_id else None
+        if self._doc_numbers is None:
+            self._doc_numbers = {self.stable_id(i): i for i in range(self.n_docs)}
+        return self._doc_numbers.get(stable_id)
+
+    def stored_fields(self, doc_num: int) -> Dict:
+        lo, hi = struct.unpack_from("<QQ", self._fmm, self._fields_offsets + 8 * doc_num)
+        base = self._fields_data
+        return json.loads(self._fmm[base + lo:base + hi].decode("utf-8"))
+
+    def to_payload(self) -> Dict:
+        """Decode everything back into the JSON payload layout (stable ids as keys)."""
+        ids = [self.stable_id(i) for i in range(self.n_docs)]
+        lengths = self["doc_lengths"]
+        index: Dict[str, Dict[str, int]] = {}
+        idf: Dict[str, float] = {}
+        for slot in range(self.n_terms):
+            term = self.term_at(slot)
+            index[term] = {ids[d]: tf for d, tf in self.postings_at(slot).items()}
+            idf[term] = self.record_at(slot)[3]
+        payload = {
+            "docs": {ids[i]: self.stored_fields(i) for i in range(self.n_docs)},
+            "index": index,
+            "doc_lengths": {ids[i]: lengths[i] for i in range(self.n_docs)},
+            "idf": idf,
+        }
+        if "max_scores" in self._views:
+            payload["max_scores"] = {t: self.max_score_at(s) for s, t in enumerate(index)}
+        if BROWSE in self._views:
+            browse = self._views[BROWSE]
+            payload[BROWSE] = {"order": [ids[d] for d in browse["order"][:]], "years": browse["years"]}
+        if SUGGEST in self._views:
+            payload[SUGGEST] = self._views[SUGGEST].as_stored()
+        if "positions" in self._views:
+            positions = self._views["positions"]
+            payload["positions"] = {t: {ids[d]: gaps for d, gaps in positions[t].items()} for t in index}
+        if FIELD_STARTS in self._views:
+            starts = self._views[FIELD_STARTS]
+            payload[FIELD_STARTS] = {ids[i]: list(starts[i]) for i in range(self.n_docs)}
+        for name in self.toc.get("fields", {}):
+            if name in TEXT_FIELDS:
+                field = self._views["fields"][name]
+                field_lengths = field["doc_lengths"]
+                payload.setdefault("fields", {})[name] = {
+                    "index": {
+                        field.term_at(slot): {ids[d]: tf for d, tf in field.postings_at(slot).items()}
+                        for slot in range(field.n_terms)
+                    },
+                    "doc_lengths": {ids[i]: field_lengths[i] for i in range(self.n_docs)},
+                }
+                continue
+            field = self._views[name]
+            field_index: Dict[str, Dict[str, int]] = {}
+            stored = {"index": field_index, "idf": {}, "max_scores": {}}
+            for slot in range(field.n_terms):
+                term = field.term_at(slot)
+                field_index[term] = {ids[d]: tf for d, tf in field.postings_at(slot).items()}
+                stored["idf"][term] = field.record_at(slot)[3]
+                stored["max_scores"][term] = field.max_score_at(slot)
+            payload[name] = stored
+        return payload
+
+def export_json(index_path: str, json_path: str) -> None:
+    from .storage import save_json
+    bidx = BinaryIndex(index_path)
+    try:
+        save_json(json_path, bidx.to_payload())
+    finally:
+        bidx.close()
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert between JSON and binary index formats")
+    ap.add_argument("--input", required=True, help="index.json or index.bin")
+    ap.add_argument("--output", required=True, help="index.bin or index.json")
+    args = ap.parse_args()
+
+    if is_binary_index(args.input):
+        export_json(args.input, args.output)
+    else:
+        from .storage import load_json
+        payload = load_json(args.input)
+        if not payload:
+            print(f"Index not found: {args.input}")
+            return
+        write_binary_index(
+            args.output, payload["docs"], payload["index"], payload["doc_lengths"],
+            payload.get("fields"), payload.get("positions"),
+        )
+    print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
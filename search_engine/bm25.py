@@ -1,5 +1,5 @@
 import math
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
 
 def compute_idf(index: Dict[str, Dict[str, int]], n_docs: int) -> Dict[str, float]:
     idf: Dict[str, float] = {}
@@ -14,12 +14,20 @@ def bm25_score(
     doc_lengths: Dict[str, int],
     idf: Dict[str, float],
     k1: float = 1.2,
-    b: float = 0.75
+    b: float = 0.75,
+    avgdl: Optional[float] = None,
+    candidates: Optional[Set[str]] = None,
+    term_weights: Optional[Dict[str, float]] = None
 ) -> Dict[str, float]:
+    """
+    candidates, if given, limits scoring to those documents (e.g. phrase matches).
+    term_weights scales the contribution of the terms it lists (e.g. fuzzy expansions).
+    """
     scores: Dict[str, float] = {}
     if not doc_lengths:
         return scores
-    avgdl = sum(doc_lengths.values()) / float(len(doc_lengths))
+    if avgdl is None:
+        avgdl = sum(doc_lengths.values()) / float(len(doc_lengths))
     if avgdl <= 0:
         return scores
 
@@ -28,9 +36,39 @@ def bm25_score(
         if not postings:
             continue
         term_idf = idf.get(term, 0.0)
+        if term_weights and term in term_weights:
+            term_idf *= term_weights[term]
+        if candidates is not None:
+            postings = {doc_id: postings[doc_id] for doc_id in candidates if doc_id in postings}
         for doc_id, tf in postings.items():
             dl = doc_lengths.get(doc_id, 0)
             denom = tf + k1 * (1 - b + b * (dl / avgdl))
             s = term_idf * (tf * (k1 + 1)) / (denom if denom else 1.0)
             scores[doc_id] = scores.get(doc_id, 0.0) + s
     return scores
+
+def compute_max_scores(
+    index: Dict[str, Dict[str, int]],
+    doc_lengths: Dict[str, int],
+    idf: Dict[str, float],
+    k1: float = 1.2,
+    b: float = 0.75
+) -> Dict[str, float]:
+    """Largest BM25 contribution each term makes to any single document."""
+    max_scores: Dict[str, float] = {}
+    if not doc_lengths:
+        return max_scores
+    avgdl = sum(doc_lengths.values()) / float(len(doc_lengths))
+    if avgdl <= 0:
+        return max_scores
+    for term, postings in index.items():
+        term_idf = idf.get(term, 0.0)
+        best = 0.0
+        for doc_id, tf in postings.items():
+            dl = doc_lengths.get(doc_id, 0)
+            denom = tf + k1 * (1 - b + b * (dl / avgdl))
+            s = term_idf * (tf * (k1 + 1)) / (denom if denom else 1.0)
+            if s > best:
+                best = s
+        max_scores[term] = best
+    return max_scores
@@ -0,0 +1,195 @@
+"""
+BM25F over the per-field postings (title, abstract, authors, year) and
+field-restricted queries such as
+
+    author:smith year:2021 neural networks
+
+Each `field:value` clause is matched against that field's postings only and
+must hold for every result. In an index built with positions, a quoted value
+(title:"neural networks") and a quoted phrase in the free text must occur as
+a phrase, within that field for a clause; without positions both are a bag
+of words. The remaining free terms are scored with BM25F:
+a term's tf in each field is length-normalised against that field's average
+length, weighted, and summed before the usual k1 saturation, with the idf of
+the combined index. Clause terms add their score within their own field.
+"""
+import math
+import re
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Tuple
+
+from .fields import TEXT_FIELDS, text_fields
+from .positions import (
+    FIELD_STARTS, POSITIONS, QueryPositions, field_span, field_spans, parse_phrases, phrase_matches, positioned_terms,
+)
+from .preprocess import preprocess
+from .topk import TopKStats
+
+FIELD_ALIASES = {
+    "title": "title",
+    "abstract": "abstract",
+    "author": "authors",
+    "authors": "authors",
+    "year": "year",
+}
+DEFAULT_FIELD_WEIGHTS = {"title": 3.0, "abstract": 1.0, "authors": 2.0, "year": 1.0}
+
+_CLAUSE_RE = re.compile(r'(?<!\S)([A-Za-z]+):("[^"]*"|\S+)')
+
+def parse_query(query: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    Split a query into its free text and (field, value) clauses. Values may
+    be quoted ("author:\"jane smith\"") and then keep their quotes; unknown
+    prefixes stay free text.
+    """
+    clauses: List[Tuple[str, str]] = []
+
+    def take(m: "re.Match") -> str:
+        field = FIELD_ALIASES.get(m.group(1).lower())
+        if field is None:
+            return m.group(0)
+        clauses.append((field, m.group(2)))
+        return " "
+
+    free = _CLAUSE_RE.sub(take, query)
+    return " ".join(free.split()), clauses
+
+def parse_field_weights(spec: str) -> Dict[str, float]:
+    """"title=3,authors=2" -> {"title": 3.0, "authors": 2.0}; fields not given keep their defaults."""
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        field = FIELD_ALIASES.get(name.strip().lower())
+        if field is None:
+            raise ValueError(f"unknown field: {name.strip()}")
+        weights[field] = float(value)
+    return weights
+
+def _idf(df: int, n_docs: int) -> float:
+    # Same expression as compute_idf.
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+def _weighted_tf(
+    term: str,
+    field_names: Tuple[str, ...],
+    fields: Mapping,
+    weights: Dict[str, float],
+    b: float,
+    candidates: Optional[set],
+) -> Tuple[Dict, int]:
+    """Sum over fields of weight * tf / length norm, per document; also the postings scanned."""
+    wtf: Dict = {}
+    scanned = 0
+    for name in field_names:
+        weight = weights.get(name, 0.0)
+        field = fields[name]
+        postings = field["index"].get(term)
+        if not postings or weight <= 0 or field["avgdl"] <= 0:
+            continue
+        scanned += len(postings)
+        doc_lengths = field["doc_lengths"]
+        avgdl = field["avgdl"]
+        for doc_id, tf in postings.items():
+            if candidates is not None and doc_id not in candidates:
+                continue
+            norm = 1 - b + b * (doc_lengths.get(doc_id, 0) / avgdl)
+            wtf[doc_id] = wtf.get(doc_id, 0.0) + weight * tf / (norm if norm else 1.0)
+    return wtf, scanned
+
+def _accumulate(scores: Dict, wtf: Dict, idf: float, k1: float) -> None:
+    for doc_id, t in wtf.items():
+        scores[doc_id] = scores.get(doc_id, 0.0) + idf * t * (k1 + 1) / (k1 + t)
+
+def _phrase_candidates(
+    positions: Mapping, payload: Mapping, free_text: str, clauses: List[Tuple[str, str]], candidates: Optional[set]
+) -> Optional[set]:
+    """candidates narrowed to the documents holding each quoted clause value (in its field) and free-text phrase."""
+    starts = payload.get(FIELD_STARTS)
+    for name, value in clauses:
+        phrase = positioned_terms(value.strip('"')) if value.startswith('"') else []
+        if len(phrase) > 1:
+            if starts is not None:
+                span = lambda doc_id, name=name: field_span(starts[doc_id], name)
+            else:
+                # Indexes built before field starts were stored: re-tokenize the document.
+                docs = payload.get("docs", {})
+                span = lambda doc_id, name=name: field_spans(docs[doc_id])[name]
+            candidates = phrase_matches(positions, phrase, candidates, within=span)
+    for phrase in parse_phrases(free_text):
+        candidates = phrase_matches(positions, phrase, candidates)
+    return candidates
+
+def bm25f_search(
+    query: str,
+    payload: Mapping,
+    top_k: int = 10,
+    field_weights: Optional[Dict[str, float]] = None,
+    k1: float = 1.2,
+    b: float = 0.75,
+    stats: Optional[TopKStats] = None,
+) -> List[Tuple[object, float]]:
+    """Top k (doc id, score) for `query` against the text fields of `payload`."""
+    scores = bm25f_scores(query, payload, field_weights, k1, b, stats)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+def bm25f_scores(
+    query: str,
+    payload: Mapping,
+    field_weights: Optional[Dict[str, float]] = None,
+    k1: float = 1.2,
+    b: float = 0.75,
+    stats: Optional[TopKStats] = None,
+) -> Dict:
+    """BM25F score of every document matching `query`."""
+    weights = DEFAULT_FIELD_WEIGHTS if field_weights is None else field_weights
+    fields = text_fields(payload)
+    n_docs = len(payload.get("doc_lengths", {}))
+    free_text, clauses = parse_query(query)
+    scores: Dict = {}
+    scanned = 0
+
+    # Clauses first: each narrows the candidates using only its field's postings.
+    candidates: Optional[set] = None
+    clause_terms: List[Tuple[str, str]] = []
+    for name, value in clauses:
+        terms = preprocess(value)
+        if not terms:
+            continue
+        index = fields[name]["index"]
+        for term in terms:
+            postings = index.get(term) or {}
+            scanned += len(postings)
+            matched = set(postings)
+            candidates = matched if candidates is None else candidates & matched
+            clause_terms.append((name, term))
+    if clauses and not clause_terms:
+        # Every clause value was a stopword: the clauses cannot match anything.
+        candidates = set()
+    positions = payload.get(POSITIONS)
+    if positions is not None and (candidates is None or candidates):
+        candidates = _phrase_candidates(QueryPositions(positions), payload, free_text, clauses, candidates)
+    if candidates is not None and not candidates:
+        return {}
+
+    for name, term in clause_terms:
+        index = fields[name]["index"]
+        wtf, _ = _weighted_tf(term, (name,), fields, weights, b, candidates)
+        _accumulate(scores, wtf, _idf(len(index.get(term) or {}), n_docs), k1)
+
+    idf = payload.get("idf", {})
+    for term in preprocess(free_text):
+        wtf, term_scanned = _weighted_tf(term, TEXT_FIELDS, fields, weights, b, candidates)
+        scanned += term_scanned
+        _accumulate(scores, wtf, idf.get(term, 0.0), k1)
+
+    if candidates is not None:
+        for doc_id in candidates:
+            scores.setdefault(doc_id, 0.0)
+
+    if stats is not None:
+        stats.postings_total += scanned
+        stats.postings_evaluated += scanned
+        stats.docs_scored += len(scores)
+    return scores
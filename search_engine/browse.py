@@ -0,0 +1,75 @@
+"""
+Browse listing: every document ordered by year (newest first), then title.
+
+The order is computed when the index is built and stored with it
+(payload["browse"] = {"order": [doc ids], "years": {"2021": [start, end]}}),
+so a page of the listing, optionally restricted to one year, is a slice of
+the stored order. Documents without a numeric year sort last and have no
+year entry. Indexes stored without it get it computed once per payload.
+"""
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .fields import per_payload
+
+BROWSE = "browse"
+
+def doc_year(d: Mapping) -> int:
+    try:
+        return int(d.get("year") or "")
+    except ValueError:
+        return 0
+
+def browse_key(d: Mapping) -> Tuple[int, str]:
+    return -doc_year(d), (d.get("title") or "").lower()
+
+def build_browse(keys: Sequence[Tuple[int, str]], doc_keys: Sequence) -> Dict:
+    """Browse order of doc_keys given their browse_key()s; ties keep input order."""
+    ranks = sorted(range(len(keys)), key=keys.__getitem__)
+    years: Dict[str, List[int]] = {}
+    for pos, i in enumerate(ranks):
+        year = -keys[i][0]
+        if not year:
+            continue
+        span = years.get(str(year))
+        if span is None:
+            years[str(year)] = [pos, pos + 1]
+        else:
+            span[1] = pos + 1
+    return {"order": [doc_keys[i] for i in ranks], "years": years}
+
+def build_browse_for_docs(docs: Mapping) -> Dict:
+    doc_keys = list(docs.keys())
+    return build_browse([browse_key(docs[k]) for k in doc_keys], doc_keys)
+
+def browse_for(payload: Mapping) -> Mapping:
+    """payload's stored browse order, or one computed once per payload."""
+    stored = payload.get(BROWSE)
+    if stored is not None:
+        return stored
+    return per_payload(BROWSE, payload, lambda p: build_browse_for_docs(p.get("docs", {})))
+
+def browse_page(payload: Mapping, page: int = 1, per_page: int = 20, year: Optional[str] = None) -> Dict:
+    """
+    One page of the listing: {"results", "page", "pages", "total", "years"}.
+    An unknown year gives an empty listing; page is clamped to the valid range.
+    """
+    browse = browse_for(payload)
+    order = browse["order"]
+    years = browse["years"]
+    if year:
+        lo, hi = years.get(str(year), (0, 0))
+    else:
+        lo, hi = 0, len(order)
+    total = hi - lo
+    pages = max(1, -(-total // per_page))
+    page = min(max(1, page), pages)
+    start = lo + (page - 1) * per_page
+    docs = payload.get("docs", {})
+    return {
+        "results": [{**docs[k], "score": None} for k in order[start:min(start + per_page, hi)]],
+        "page": page,
+        "pages": pages,
+        "total": total,
+        "years": list(years),
+    }
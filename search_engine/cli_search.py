@@ -1,26 +1,121 @@
 import argparse
-from .storage import load_json
-from .search import search
+import time
+from .config import default_index_path
+from .storage import load_index
+from .bm25f import parse_field_weights
+from .instrument import Instrumentation, format_trace
+from .positions import DEFAULT_PROXIMITY_WEIGHT
+from .result_cache import ResultCache
+from .search import search, search_page, ENGINES
+from .topk import TopKStats
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--q", required=True, help="Your query")
-    ap.add_argument("--top", type=int, default=10)
-    ap.add_argument("--index", default="data/index.json")
+    ap.add_argument("--q", default=None, help="Your query")
+    ap.add_argument("--queries", default=None,
+                    help="File with one query per line; prints a timing summary per query instead of results")
+    ap.add_argument("--top", type=int, default=10, help="Results per page")
+    ap.add_argument("--cursor", default=None, help="Show the page after this cursor (printed after each page)")
+    ap.add_argument("--offset", type=int, default=0, help="Show the page starting at this rank (ignored with --cursor)")
+    ap.add_argument("--index", default=None, help="index.bin or index.json (format is detected)")
     ap.add_argument("--stem", action="store_true", help="Use simple stemming")
+    ap.add_argument("--engine", choices=ENGINES, default="dict",
+                    help="dict/numpy score every match; maxscore prunes to the top k; bm25f weights fields")
+    ap.add_argument("--field-weights", default="",
+                    help="BM25F field weights, e.g. title=3,abstract=1,authors=2,year=1")
+    ap.add_argument("--proximity-weight", type=float, default=DEFAULT_PROXIMITY_WEIGHT,
+                    help="Proximity boost for indexes built with --positions (0 = off)")
+    ap.add_argument("--no-fuzzy", dest="fuzzy", action="store_false",
+                    help="Do not expand query terms missing from the index to their nearest spellings")
+    ap.add_argument("--stats", action="store_true", help="Print postings evaluated vs skipped")
+    ap.add_argument("--cache-mb", type=float, default=0,
+                    help="Result cache size in MB (0 = no cache); prints hit/miss/eviction counters")
+    ap.add_argument("--cache-entries", type=int, default=1024)
+    ap.add_argument("--trace", action="store_true",
+                    help="Print per-stage timings (and p50/p95/p99 with --queries)")
+    ap.add_argument("--trace-log", default=None, help="Append one JSON line per query to this file")
+    ap.add_argument("--profile-slow-ms", type=float, default=None,
+                    help="cProfile every query and dump those slower than this many ms to --profile-dir")
+    ap.add_argument("--profile-dir", default="profiles")
     args = ap.parse_args()
+    if not args.q and not args.queries:
+        ap.error("one of --q or --queries is required")
 
-    payload = load_json(args.index)
+    payload = load_index(args.index or default_index_path())
     if not payload:
-        print("Index not found. Run the crawler first to build data/index.json")
+        print("Index not found. Run the crawler first to build data/index.bin")
         return
 
-    results = search(args.q, payload, top_k=args.top, use_stemming=args.stem)
+    stats = TopKStats()
+    weights = parse_field_weights(args.field_weights) if args.field_weights else None
+    cache = ResultCache(args.cache_entries, int(args.cache_mb * 1024 * 1024)) if args.cache_mb > 0 else None
+    metrics = Instrumentation(
+        enabled=args.trace or bool(args.trace_log) or args.profile_slow_ms is not None,
+        log_path=args.trace_log,
+        slow_ms=args.profile_slow_ms if args.profile_slow_ms is not None else float("inf"),
+        profile=args.profile_slow_ms is not None,
+        profile_sample=1.0,
+        profile_dir=args.profile_dir,
+    )
+
+    def traced(trace):
+        # A traced query counts into its trace; fold that into the totals afterwards.
+        return trace.stats if trace is not None else stats
+
+    def fold(trace):
+        if trace is not None:
+            for name, value in trace.stats.as_dict().items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+    def run(q):
+        with metrics.trace(q, kind="cli") as trace:
+            results = search(q, payload, top_k=args.top, use_stemming=args.stem, engine=args.engine,
+                             stats=traced(trace), field_weights=weights, proximity_weight=args.proximity_weight,
+                             cache=cache, fuzzy=args.fuzzy)
+        fold(trace)
+        return results
+
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        start = time.perf_counter()
+        for q in queries:
+            t = time.perf_counter()
+            results = run(q)
+            print(f"{(time.perf_counter() - t) * 1000:8.2f} ms  {len(results):3d} results  {q}")
+        elapsed = time.perf_counter() - start
+        print(f"Queries: {len(queries)} in {elapsed:.2f}s ({len(queries) / elapsed if elapsed else 0:.1f}/s)")
+        if args.stats:
+            print(f"Postings: {stats.postings_evaluated} evaluated, {stats.postings_skipped} skipped "
+                  f"of {stats.postings_total}; documents scored: {stats.docs_scored}")
+        if cache is not None:
+            c = cache.stats()
+            print(f"Cache: {c.hits} hits, {c.misses} misses ({c.hit_rate:.0%}), {c.evictions} evictions, "
+                  f"{c.entries} entries, {c.bytes / 1024:.0f} KB")
+        if args.trace:
+            snap = metrics.snapshot()
+            for name, p in [("total", snap["latency_ms"].get("cli", {}))] + list(snap["stages_ms"].items()):
+                if p.get("count"):
+                    print(f"{name:12s} p50 {p['p50']:8.3f}  p95 {p['p95']:8.3f}  p99 {p['p99']:8.3f} ms")
+        return
+
+    with metrics.trace(args.q, kind="cli") as trace:
+        page = search_page(args.q, payload, page_size=args.top, cursor=args.cursor, offset=args.offset,
+                           use_stemming=args.stem, engine=args.engine, stats=traced(trace), field_weights=weights,
+                           proximity_weight=args.proximity_weight, cache=cache, fuzzy=args.fuzzy)
+    fold(trace)
+    results = page.results
+    if args.trace:
+        print("\n".join(format_trace(trace)))
+    if args.stats:
+        print(f"Postings: {stats.postings_evaluated} evaluated, {stats.postings_skipped} skipped "
+              f"of {stats.postings_total}; documents scored: {stats.docs_scored}")
     if not results:
         print("No results.")
         return
 
-    for i, r in enumerate(results, 1):
+    first = 1 if args.cursor else args.offset + 1
+    for i, r in enumerate(results, first):
         print(f"{i}. {r.get('title','(no title)')} ({r.get('year','')}) [score={r.get('score')}]")
         print(f"   Publication: {r.get('publication_url')}")
         if r.get('authors'):
@@ -32,6 +127,8 @@ def main():
         elif r.get("author_urls"):
             print(f"   Author profiles: {', '.join(r.get('author_urls', []))}")
         print()
+    if page.next_cursor:
+        print(f"Next page: --cursor {page.next_cursor}")
 
 if __name__ == "__main__":
     main()
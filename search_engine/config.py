@@ -12,3 +12,14 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = BASE_DIR / "data"
 PUBLICATIONS_JSONL = str(DATA_DIR / "publications.jsonl")
 INDEX_JSON = str(DATA_DIR / "index.json")
+INDEX_BIN = str(DATA_DIR / "index.bin")
+FETCH_CACHE_JSON = str(DATA_DIR / "fetch_cache.json")
+SEGMENTS_DIR = str(DATA_DIR / "segments")
+
+def default_index_path() -> str:
+    if (Path(SEGMENTS_DIR) / "manifest.json").exists():
+        return SEGMENTS_DIR
+    return base_index_path()
+
+def base_index_path() -> str:
+    return INDEX_BIN if Path(INDEX_BIN).exists() else INDEX_JSON
@@ -1,19 +1,30 @@
 import argparse
+import threading
 import time
 import re
 from collections import deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, urlunparse
 import urllib.robotparser as robotparser
+from typing import Dict, Optional
 
 import requests
 
-from .config import CrawlConfig, PUBLICATIONS_JSONL, INDEX_JSON
-from .storage import append_jsonl, load_jsonl
-from .parser import extract_links, parse_publication_page, parse_list_page_for_publications
-from .indexer import build_documents, build_inverted_index, save_index
+from .config import CrawlConfig, PUBLICATIONS_JSONL, INDEX_JSON, INDEX_BIN, FETCH_CACHE_JSON, SEGMENTS_DIR, base_index_path
+from .storage import write_jsonl, load_jsonl
+from .parser import analyze_page
+from .indexer import build_documents, build_indexes, save_index
+from .positions import build_positions
+from .binindex import write_binary_index
+from .incremental import IncrementalIndex, diff_publications, remove_delta
+from .segments import BATCH_MERGE_DOCS, SegmentStore
+from .fetch_cache import FetchCache, content_hash
 
 PUB_RE = re.compile(r"/en/publications/")
 ORG_SLUG = "/en/organisations/ics-research-centre-for-computational-science-and-mathematical-mo"
+# The fetch cache is written every this many pages, so an interrupted crawl keeps its validators.
+CACHE_SAVE_EVERY = 50
 
 def same_domain(a: str, b: str) -> bool:
     return urlparse(a).netloc == urlparse(b).netloc
@@ -26,10 +37,42 @@ def normalize_url(url: str) -> str:
 def is_org_url(url: str) -> bool:
     return ORG_SLUG in url
 
+class HostRateLimiter:
+    """
+    Per-host token bucket: at most `burst` requests may start back-to-back,
+    after which request starts on the same host are spaced by `interval`
+    seconds. Time spent waiting for responses or parsing counts towards the
+    interval rather than being added on top of it.
+    """
+
+    def __init__(self, interval: float, burst: int = 1, clock=time.monotonic, sleep=time.sleep):
+        self.interval = interval
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tat = {}
+
+    def reserve(self, url: str) -> float:
+        """Reserve the next start slot for url's host; return seconds to wait."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = self._clock()
+            tat = max(self._tat.get(host, now), now)
+            start = max(now, tat - (self.burst - 1) * self.interval)
+            self._tat[host] = tat + self.interval
+        return start - now
+
+    def acquire(self, url: str) -> None:
+        wait = self.reserve(url)
+        if wait > 0:
+            self._sleep(wait)
+
 class PoliteCrawler:
-    def __init__(self, seed_url: str, cfg: CrawlConfig):
+    def __init__(self, seed_url: str, cfg: CrawlConfig, cache: Optional[FetchCache] = None):
         self.seed_url = seed_url
         self.cfg = cfg
+        self.cache = cache
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": cfg.user_agent})
         self.delay_seconds = cfg.delay_seconds
@@ -52,24 +95,86 @@ class PoliteCrawler:
         except Exception:
             self.robots_ok = False
 
+        # Spaces every fetch, sequential or concurrent; honours the robots.txt crawl delay.
+        self.limiter = HostRateLimiter(self.delay_seconds)
+        self._local = threading.local()
+        self._unsaved_pages = 0
+
     def allowed(self, url: str) -> bool:
         try:
             return self.robots.can_fetch(self.cfg.user_agent, url) if self.robots_ok else True
         except Exception:
             return False
 
-    def fetch(self, url: str) -> str:
-        time.sleep(self.delay_seconds)
-        r = self.session.get(url, timeout=30)
+    def _thread_session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.session.headers)
+            self._local.session = session
+        return session
+
+    def _request(self, session: requests.Session, url: str, norm_url: str) -> requests.Response:
+        # A 304 uses up the delay like any request: crawl_delay limits requests, not bytes.
+        self.limiter.acquire(url)
+        headers = self.cache.conditional_headers(norm_url) if self.cache else {}
+        r = session.get(url, timeout=30, headers=headers)
         r.raise_for_status()
-        return r.text
+        return r
 
-    def crawl_bfs(self):
-        queue = deque([self.seed_url])
-        visited = set()
-        publications = []
+    def fetch_response(self, url: str, norm_url: str) -> requests.Response:
+        return self._request(self.session, url, norm_url)
+
+    def fetch_limited(self, url: str, norm_url: str) -> requests.Response:
+        return self._request(self._thread_session(), url, norm_url)
 
-        while queue and (self.cfg.max_pages == 0 or len(visited) < self.cfg.max_pages):
+    def analyze_response(self, url: str, norm_url: str, r: requests.Response) -> Dict:
+        """Parsed page for a response, reusing the cached parse when the page has not changed."""
+        is_pub = bool(PUB_RE.search(norm_url))
+        cache = self.cache
+        if cache is None:
+            return analyze_page(url, r.text, parse_publication=is_pub)
+
+        etag = r.headers.get("ETag", "")
+        last_modified = r.headers.get("Last-Modified", "")
+        cached = cache.get(norm_url)
+        if r.status_code == 304:
+            if cached is None or cached.get("page") is None:
+                raise ValueError(f"304 without a cached copy: {url}")
+            cache.stats.not_modified += 1
+            cache.touch(norm_url, etag, last_modified)
+            return cached["page"]
+
+        cache.stats.fetched += 1
+        cache.stats.bytes_downloaded += len(r.content)
+        digest = content_hash(r.content)
+        if cached and cached.get("content_hash") == digest and cached.get("page") is not None:
+            if not is_pub or cached["page"].get("publication") is not None:
+                cache.stats.unchanged += 1
+                cache.touch(norm_url, etag, last_modified)
+                return cached["page"]
+
+        page = analyze_page(url, r.text, parse_publication=is_pub)
+        cache.stats.parsed += 1
+        cache.put(norm_url, etag, last_modified, digest, page)
+        return page
+
+    def _page_done(self) -> None:
+        self._unsaved_pages += 1
+        if self.cache is not None and self._unsaved_pages >= CACHE_SAVE_EVERY:
+            self.save_cache()
+
+    def save_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.save()
+        self._unsaved_pages = 0
+
+    def _within_budget(self, visited) -> bool:
+        return self.cfg.max_pages == 0 or len(visited) < self.cfg.max_pages
+
+    def _next_fetchable(self, queue, visited):
+        """Pop the queue until a URL that should be fetched turns up (or it is empty)."""
+        while queue and self._within_budget(visited):
             url = queue.popleft()
             norm_url = normalize_url(url)
             if norm_url in visited:
@@ -81,47 +186,104 @@ class PoliteCrawler:
 
             if not self.allowed(url):
                 continue
+            return url, norm_url
+        return None
 
-            try:
-                html = self.fetch(url)
-            except Exception:
-                continue
+    def crawl_bfs(self):
+        queue = deque([self.seed_url])
+        visited = set()
+        publications = []
 
-            is_org = is_org_url(url)
-            links = extract_links(url, html)
-
-            if is_org:
-                for link in links:
-                    nlink = normalize_url(link)
-                    if "/en/persons/" in nlink and not nlink.endswith("/en/persons"):
-                        self.ics_person_urls.add(nlink)
-
-            # Extract publication links from list pages
-            for lp in parse_list_page_for_publications(url, html):
-                pu = lp.get("publication_url")
-                if pu:
-                    npu = normalize_url(pu)
-                    if is_org:
-                        self.org_publication_urls.add(npu)
-                    if npu not in visited:
-                        queue.append(pu)
-
-            # Extract publication data if it is a publication page
-            if PUB_RE.search(norm_url):
-                pub = parse_publication_page(url, html)
-                pub["source_url"] = url
-                publications.append(pub)
-
-            # Add more internal links for BFS
-            for link in links:
-                if self.cfg.same_domain_only and not same_domain(self.seed_url, link):
+        try:
+            while True:
+                nxt = self._next_fetchable(queue, visited)
+                if nxt is None:
+                    break
+                url, norm_url = nxt
+
+                try:
+                    page = self.analyze_response(url, norm_url, self.fetch_response(url, norm_url))
+                except Exception:
                     continue
-                if ("/en/organisations/" in link) or ("/en/publications/" in link) or ("/en/persons/" in link):
-                    if normalize_url(link) not in visited:
-                        queue.append(link)
+
+                self._process_page(url, norm_url, page, queue, visited, publications)
+                self._page_done()
+        finally:
+            self.save_cache()
+
+        return publications
+
+    def crawl_concurrent(self, workers: int):
+        """
+        BFS with up to `workers` fetches in flight. URLs are dequeued and
+        marked visited in the same order as crawl_bfs and pages are processed
+        in dequeue order, so the crawl visits the same pages; only the waiting
+        overlaps. Politeness is enforced per host by self.limiter.
+        """
+        queue = deque([self.seed_url])
+        visited = set()
+        publications = []
+        inflight = deque()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    while len(inflight) < workers:
+                        nxt = self._next_fetchable(queue, visited)
+                        if nxt is None:
+                            break
+                        url, norm_url = nxt
+                        inflight.append((url, norm_url, pool.submit(self.fetch_limited, url, norm_url)))
+                    if not inflight:
+                        break
+
+                    url, norm_url, future = inflight.popleft()
+                    try:
+                        page = self.analyze_response(url, norm_url, future.result())
+                    except Exception:
+                        continue
+
+                    self._process_page(url, norm_url, page, queue, visited, publications)
+                    self._page_done()
+        finally:
+            self.save_cache()
 
         return publications
 
+    def _process_page(self, url, norm_url, page, queue, visited, publications):
+        is_org = is_org_url(url)
+        links = page["links"]
+
+        if is_org:
+            for link in links:
+                nlink = normalize_url(link)
+                if "/en/persons/" in nlink and not nlink.endswith("/en/persons"):
+                    self.ics_person_urls.add(nlink)
+
+        # Extract publication links from list pages
+        for lp in page["list_publications"]:
+            pu = lp.get("publication_url")
+            if pu:
+                npu = normalize_url(pu)
+                if is_org:
+                    self.org_publication_urls.add(npu)
+                if npu not in visited:
+                    queue.append(pu)
+
+        # Extract publication data if it is a publication page
+        if page["publication"] is not None:
+            pub = dict(page["publication"])
+            pub["source_url"] = url
+            publications.append(pub)
+
+        # Add more internal links for BFS
+        for link in links:
+            if self.cfg.same_domain_only and not same_domain(self.seed_url, link):
+                continue
+            if ("/en/organisations/" in link) or ("/en/publications/" in link) or ("/en/persons/" in link):
+                if normalize_url(link) not in visited:
+                    queue.append(link)
+
 def filter_publications_by_membership(publications, ics_person_urls, org_publication_urls):
     if not publications:
         return []
@@ -152,11 +314,25 @@ def main():
     ap.add_argument("--max-pages", type=int, default=CrawlConfig.max_pages, help="0 = no limit")
     ap.add_argument("--delay", type=float, default=CrawlConfig.delay_seconds)
     ap.add_argument("--user-agent", default=CrawlConfig.user_agent)
+    ap.add_argument("--concurrency", type=int, default=1,
+                    help="Fetches in flight (1 = sequential); --delay still applies per host")
+    ap.add_argument("--cache", default=FETCH_CACHE_JSON, help="Fetch cache for conditional GETs")
+    ap.add_argument("--no-cache", action="store_true", help="Always download and parse every page")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Record added/changed/removed publications in a delta instead of rebuilding the index")
+    ap.add_argument("--segments", action="store_true",
+                    help="Write changed publications as a new segment under data/segments, then merge per the tiered policy")
+    ap.add_argument("--positions", action="store_true",
+                    help="Store term positions in a full rebuild or new segments (phrase queries and proximity ranking)")
     args = ap.parse_args()
 
     cfg = CrawlConfig(user_agent=args.user_agent, delay_seconds=args.delay, max_pages=args.max_pages)
-    crawler = PoliteCrawler(args.seed, cfg)
-    new_pubs = crawler.crawl_bfs()
+    cache = None if args.no_cache else FetchCache(args.cache)
+    crawler = PoliteCrawler(args.seed, cfg, cache=cache)
+    if args.concurrency > 1:
+        new_pubs = crawler.crawl_concurrent(args.concurrency)
+    else:
+        new_pubs = crawler.crawl_bfs()
     new_pubs = filter_publications_by_membership(
         new_pubs, crawler.ics_person_urls, crawler.org_publication_urls
     )
@@ -167,16 +343,50 @@ def main():
         merged, crawler.ics_person_urls, crawler.org_publication_urls
     )
 
-    append_jsonl(PUBLICATIONS_JSONL, merged)
+    write_jsonl(PUBLICATIONS_JSONL, merged)
 
-    docs = build_documents(merged)
-    index, doc_lengths = build_inverted_index(docs)
-    save_index(INDEX_JSON, docs, index, doc_lengths)
+    index_path = base_index_path()
+    store = SegmentStore(SEGMENTS_DIR, positions=args.positions)
+    if args.segments:
+        if store.exists():
+            upserts, deletes = diff_publications(old, merged)
+            store.add_batch(upserts, deletes)
+            print(f"New segment: {len(upserts)} upserted, {len(deletes)} deleted")
+        else:
+            store.replace_all(build_documents(merged))
+        store.maybe_merge(max_docs=BATCH_MERGE_DOCS)
+        store.collect_garbage()
+        saved = [store.manifest_path]
+    elif args.incremental and Path(index_path).exists():
+        inc = IncrementalIndex(index_path)
+        upserts, deletes = diff_publications(old, merged)
+        inc.apply(upserts, deletes)
+        inc.commit()
+        saved = [inc.delta_path]
+        print(f"Index delta: {len(upserts)} upserted, {len(deletes)} deleted")
+    else:
+        docs = build_documents(merged)
+        index, doc_lengths, fields = build_indexes(docs)
+        positions = build_positions(docs) if args.positions else None
+        write_binary_index(INDEX_BIN, docs, index, doc_lengths, fields, positions)
+        save_index(INDEX_JSON, docs, index, doc_lengths, fields, positions)
+        remove_delta(INDEX_BIN)
+        remove_delta(INDEX_JSON)
+        saved = [INDEX_BIN, INDEX_JSON]
+        if store.exists():
+            # Keep the segment directory, which readers prefer, in step.
+            store.replace_all(docs)
+            saved.append(store.manifest_path)
 
     print("Crawl finished.")
+    if cache is not None:
+        s = cache.stats
+        print(f"Fetched: {s.fetched} ({s.bytes_downloaded} bytes), not modified: {s.not_modified}, "
+              f"unchanged: {s.unchanged}, parsed: {s.parsed}")
     print(f"Publications stored: {len(merged)}")
     print(f"Saved: {PUBLICATIONS_JSONL}")
-    print(f"Saved: {INDEX_JSON}")
+    for path in saved:
+        print(f"Saved: {path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+from .storage import load_json, save_json
+
+def content_hash(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+@dataclass
+class FetchStats:
+    fetched: int = 0
+    not_modified: int = 0
+    unchanged: int = 0
+    parsed: int = 0
+    bytes_downloaded: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+class FetchCache:
+    """
+    Persistent per-URL fetch cache, keyed by normalize_url(url).
+
+    Each entry keeps the response validators (ETag, Last-Modified), a hash of
+    the body and the parsed page (links, list-page publications, publication
+    fields), so a 304 or an identical body can be served without re-parsing.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict] = load_json(path)
+        self._lock = threading.Lock()
+        self.stats = FetchStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, norm_url: str) -> Optional[Dict]:
+        return self._entries.get(norm_url)
+
+    def conditional_headers(self, norm_url: str) -> Dict[str, str]:
+        entry = self._entries.get(norm_url)
+        if not entry or entry.get("page") is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, norm_url: str, etag: str, last_modified: str, digest: str, page: Dict) -> None:
+        with self._lock:
+            self._entries[norm_url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "content_hash": digest,
+                "page": page,
+                "checked_at": int(time.time()),
+            }
+
+    def touch(self, norm_url: str, etag: str = "", last_modified: str = "") -> None:
+        with self._lock:
+            entry = self._entries.get(norm_url)
+            if entry is None:
+                return
+            if etag:
+                entry["etag"] = etag
+            if last_modified:
+                entry["last_modified"] = last_modified
+            entry["checked_at"] = int(time.time())
+
+    def save(self) -> None:
+        with self._lock:
+            save_json(self.path, self._entries)
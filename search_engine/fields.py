@@ -0,0 +1,112 @@
+"""
+Secondary postings fields built at index time.
+
+TEXT_FIELDS each get their own postings and document lengths (see
+indexer.build_indexes), used for BM25F and field-restricted queries.
+
+The "stemmed" field indexes simple_stem() of every term. Stemming maps each
+token to exactly one stem, so the field is derived from the unstemmed
+postings (summing the tfs of terms that share a stem) and shares their
+document lengths; only its postings, idf and max scores are stored.
+"""
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Callable, Dict, Tuple
+
+from .bm25 import compute_idf, compute_max_scores
+from .preprocess import simple_stem
+
+STEMMED = "stemmed"
+TEXT_FIELDS = ("title", "abstract", "authors", "year")
+
+def stem_index(index: Mapping) -> Dict[object, Dict[object, int]]:
+    stemmed: Dict[object, Dict[object, int]] = {}
+    for term, postings in index.items():
+        target = stemmed.setdefault(simple_stem(term), {})
+        for doc_id, tf in postings.items():
+            target[doc_id] = target.get(doc_id, 0) + tf
+    return stemmed
+
+def build_stemmed_field(index: Mapping, doc_lengths: Mapping) -> Dict:
+    """Stored form of the stemmed field: postings, idf and max scores."""
+    stemmed = stem_index(index)
+    idf = compute_idf(stemmed, n_docs=len(doc_lengths))
+    return {
+        "index": stemmed,
+        "idf": idf,
+        "max_scores": compute_max_scores(stemmed, doc_lengths, idf),
+    }
+
+_CACHES: "Dict[str, OrderedDict[int, Tuple[Mapping, Mapping]]]" = {}
+_CACHE_SIZE = 2
+_CACHE_LOCK = threading.Lock()
+
+def per_payload(kind: str, payload: Mapping, build: Callable[[Mapping], object]):
+    """
+    build(payload), remembered for the last _CACHE_SIZE payloads of each kind.
+    Payloads are told apart by identity; the entry holds the payload, so its
+    id cannot be reused while cached. build runs outside the lock, so lookups
+    for other payloads do not wait for it.
+    """
+    key = id(payload)
+    with _CACHE_LOCK:
+        cache = _CACHES.setdefault(kind, OrderedDict())
+        hit = cache.get(key)
+        if hit is not None and hit[0] is payload:
+            cache.move_to_end(key)
+            return hit[1]
+
+    value = build(payload)
+
+    with _CACHE_LOCK:
+        cache[key] = (payload, value)
+        cache.move_to_end(key)
+        while len(cache) > _CACHE_SIZE:
+            cache.popitem(last=False)
+    return value
+
+def _stemmed_field(payload: Mapping) -> Mapping:
+    stored = payload.get(STEMMED)
+    if stored is not None and "doc_lengths" in stored:
+        return stored
+    doc_lengths = payload.get("doc_lengths", {})
+    if stored is None:
+        stored = build_stemmed_field(payload.get("index", {}), doc_lengths)
+    field = {"doc_lengths": doc_lengths, **stored}
+    if payload.get("avgdl") is not None:
+        field["avgdl"] = payload["avgdl"]
+    return field
+
+def stemmed_payload(payload: Mapping) -> Mapping:
+    """
+    The stemmed field of `payload` shaped like a payload itself (index,
+    doc_lengths, idf, ...), ready for bm25_score / array_index_for.
+    Indexes built before the field existed get it derived once per payload.
+    """
+    return per_payload(STEMMED, payload, _stemmed_field)
+
+def _text_fields(payload: Mapping) -> Mapping:
+    stored = payload.get("fields")
+    if stored is None:
+        # Late import: indexer imports this module.
+        from .indexer import build_field_indexes
+        docs = payload.get("docs", {})
+        stored = build_field_indexes({doc_id: docs[doc_id] for doc_id in payload.get("doc_lengths", {})})
+    fields = {}
+    for name in TEXT_FIELDS:
+        field = stored[name]
+        lengths = field["doc_lengths"]
+        avgdl = field.get("avgdl")
+        if avgdl is None:
+            avgdl = sum(lengths.values()) / float(len(lengths)) if len(lengths) else 0.0
+        fields[name] = {"index": field["index"], "doc_lengths": lengths, "avgdl": avgdl}
+    return fields
+
+def text_fields(payload: Mapping) -> Mapping:
+    """
+    {field name: {"index", "doc_lengths", "avgdl"}} for each of TEXT_FIELDS.
+    Indexes without stored text fields (segments, older builds) get them
+    derived from the stored documents once per payload.
+    """
+    return per_payload("fields", payload, _text_fields)
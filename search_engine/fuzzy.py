@@ -0,0 +1,289 @@
+"""
+Fuzzy term expansion for misspelled queries ("nueral netwrok").
+
+A SymSpell-style deletion index over the vocabulary is built with the index:
+every string obtained by deleting up to max_distance characters from the
+first prefix_length characters of a term is hashed (crc32) and paired with
+the term. Two terms within edit distance d share such a delete, so a query
+term's candidates are the terms under the hashes of its own deletes; they
+are then checked with a bounded edit distance (adjacent transpositions count
+as one edit). Hash collisions only add candidates that this check drops.
+Lookups go closest first and return only the nearest terms found.
+
+The entries are two parallel uint32 arrays sorted by hash, so a lookup is a
+handful of binary searches. A binary index stores them (fuzzy_keys and
+fuzzy_targets sections; targets are main term dictionary slots). JSON
+indexes do not: as JSON lists they would be several times the size of the
+rest of the index, so they are derived from the vocabulary on the first
+fuzzy lookup, once per payload (about 3 s for 50k terms; that first query
+pays for it).
+
+Only query terms missing from the index are expanded. Each expansion is
+scored like a query term, weighted by DISTANCE_DECAY ** distance.
+"""
+import zlib
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .fields import per_payload
+from .preprocess import simple_stem
+
+FUZZY = "fuzzy"
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+# Shorter terms (and terms with digits) are neither indexed nor expanded.
+MIN_LENGTH = 4
+# Terms this long may be corrected by two edits, shorter ones by one.
+LONG_TERM = 8
+MAX_EXPANSIONS = 3
+DISTANCE_DECAY = 0.5
+
+def fuzzy_eligible(term: str) -> bool:
+    return len(term) >= MIN_LENGTH and term.isalpha()
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    """word and every string made by deleting up to max_distance of its characters."""
+    out = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))} - out
+        out |= frontier
+    return out
+
+def delete_hash(s: str) -> int:
+    return zlib.crc32(s.encode("utf-8"))
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance of a and b, or max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Candidates mostly share a long prefix and suffix with the query term;
+    # only the differing middle needs the DP.
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    if start or end:
+        # Keep one matched character on each side: it may be half of a transposition.
+        start = max(0, start - 1)
+        end = max(0, end - 1)
+        a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return len(a) + len(b) if len(a) + len(b) <= max_distance else max_distance + 1
+    # Only cells within max_distance of the diagonal can stay within bounds.
+    over = max_distance + 1
+    la, lb = len(a), len(b)
+    prev2: List[int] = []
+    prev = [j if j < over else over for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        cur = [over] * (lb + 1)
+        if i < over:
+            cur[0] = i
+        best = cur[0]
+        ca = a[i - 1]
+        for j in range(max(1, i - max_distance), min(lb, i + max_distance) + 1):
+            cb = b[j - 1]
+            d = prev[j - 1] if ca == cb else prev[j - 1] + 1
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and prev2[j - 2] + 1 < d:
+                d = prev2[j - 2] + 1
+            if d > over:
+                d = over
+            cur[j] = d
+            if d < best:
+                best = d
+        if best >= over:
+            return over
+        prev2, prev = prev, cur
+    return prev[lb]
+
+class FuzzyEntries:
+    """
+    Accumulates (delete hash, target) pairs, one vocabulary term at a time.
+    With a spool (a binary file opened for reading and writing) the pairs
+    are written there instead of kept in memory until arrays().
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, prefix_length: int = PREFIX_LENGTH, spool=None):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._spool = spool
+        self._pairs: List[np.ndarray] = []
+
+    def add(self, term: str, target: int) -> None:
+        if not fuzzy_eligible(term):
+            return
+        hashes = {delete_hash(d) for d in deletes(term[:self.prefix_length], self.max_distance)}
+        pairs = np.empty((len(hashes), 2), dtype="<u4")
+        pairs[:, 0] = np.fromiter(hashes, dtype=np.uint32, count=len(hashes))
+        pairs[:, 1] = target
+        if self._spool is not None:
+            self._spool.write(pairs.tobytes())
+        else:
+            self._pairs.append(pairs)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(keys, targets), sorted by key and then target."""
+        if self._spool is not None:
+            self._spool.flush()
+            self._spool.seek(0)
+            pairs = np.frombuffer(self._spool.read(), dtype="<u4").reshape(-1, 2)
+        elif self._pairs:
+            pairs = np.concatenate(self._pairs)
+        else:
+            pairs = np.empty((0, 2), dtype="<u4")
+        keys = pairs[:, 0].astype(np.uint32)
+        targets = pairs[:, 1].astype(np.uint32)
+        order = np.lexsort((targets, keys))
+        return keys[order], targets[order]
+
+    def config(self) -> Dict:
+        return {"max_distance": self.max_distance, "prefix_length": self.prefix_length, "min_length": MIN_LENGTH}
+
+def build_fuzzy(terms: Iterable[str]) -> Dict:
+    """Deletion index over terms, in the form FuzzyIndex.from_stored() reads."""
+    vocabulary = sorted(t for t in terms if fuzzy_eligible(t))
+    entries = FuzzyEntries()
+    for i, term in enumerate(vocabulary):
+        entries.add(term, i)
+    keys, targets = entries.arrays()
+    return {**entries.config(), "terms": vocabulary, "keys": keys.tolist(), "targets": targets.tolist()}
+
+class FuzzyIndex:
+    """Lookup side of the deletion index; term_at maps a target back to its term."""
+
+    def __init__(
+        self,
+        keys: np.ndarray,
+        targets: np.ndarray,
+        term_at: Callable[[int], str],
+        max_distance: int = MAX_DISTANCE,
+        prefix_length: int = PREFIX_LENGTH,
+        min_length: int = MIN_LENGTH,
+    ):
+        self.keys = keys
+        self.targets = targets
+        self.term_at = term_at
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.min_length = min_length
+
+    @classmethod
+    def from_stored(cls, stored: Mapping) -> "FuzzyIndex":
+        terms = stored["terms"]
+        return cls(
+            np.asarray(stored["keys"], dtype=np.uint32),
+            np.asarray(stored["targets"], dtype=np.uint32),
+            terms.__getitem__,
+            stored.get("max_distance", MAX_DISTANCE),
+            stored.get("prefix_length", PREFIX_LENGTH),
+            stored.get("min_length", MIN_LENGTH),
+        )
+
+    def _candidates(self, probes: Set[str]) -> np.ndarray:
+        hashes = np.fromiter((delete_hash(p) for p in probes), dtype=np.uint32, count=len(probes))
+        lo = np.searchsorted(self.keys, hashes, side="left")
+        hi = np.searchsorted(self.keys, hashes, side="right")
+        spans = [self.targets[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        return np.unique(np.concatenate(spans)) if spans else np.empty(0, dtype=np.uint32)
+
+    def lookup(
+        self, term: str, max_distance: Optional[int] = None, accept: Optional[Callable[[str], bool]] = None
+    ) -> List[Tuple[str, int]]:
+        """
+        (vocabulary term, edit distance) of the terms nearest to term, at most
+        max_distance edits away. Distances are tried closest first: the
+        candidates of a larger distance are only fetched and verified when no
+        term is nearer, which keeps long terms cheap in dense vocabularies.
+        Candidates rejected by accept() are skipped as if absent.
+        """
+        if max_distance is None:
+            max_distance = 2 if len(term) >= LONG_TERM else 1
+        max_distance = min(max_distance, self.max_distance)
+        if len(term) < self.min_length or not term.isalpha() or max_distance <= 0 or not len(self.keys):
+            return []
+        prefix = term[:self.prefix_length]
+        seen = np.empty(0, dtype=np.uint32)
+        found: List[Tuple[str, int]] = []
+        for distance in range(1, max_distance + 1):
+            # Stored deletes go max_distance deep, so a query delete `distance`
+            # deep meets every term within `distance` edits.
+            targets = self._candidates(deletes(prefix, distance))
+            for target in np.setdiff1d(targets, seen, assume_unique=True).tolist():
+                candidate = self.term_at(target)
+                if accept is not None and not accept(candidate):
+                    continue
+                d = edit_distance(term, candidate, max_distance)
+                if d <= max_distance:
+                    found.append((candidate, d))
+            seen = targets
+            nearest = [c for c in found if c[1] <= distance]
+            if nearest:
+                return nearest
+        return []
+
+class FuzzyUnion:
+    """
+    Several deletion indexes looked up as one vocabulary (an overlay's base
+    and the terms its delta adds); accept() drops terms no longer indexed.
+    """
+
+    def __init__(self, parts: Sequence[FuzzyIndex], accept: Callable[[str], bool]):
+        self.parts = parts
+        self.accept = accept
+
+    def lookup(self, term: str, max_distance: Optional[int] = None) -> List[Tuple[str, int]]:
+        found: Dict[str, int] = {}
+        for part in self.parts:
+            found.update(part.lookup(term, max_distance, self.accept))
+        if not found:
+            return []
+        nearest = min(found.values())
+        return [(t, d) for t, d in found.items() if d == nearest]
+
+def fuzzy_index_for(payload: Mapping) -> FuzzyIndex:
+    """payload's stored deletion index (binary indexes), or one built once per payload from its vocabulary."""
+    stored = payload.get(FUZZY)
+    if isinstance(stored, (FuzzyIndex, FuzzyUnion)):
+        return stored
+    return per_payload(FUZZY, payload, lambda p: FuzzyIndex.from_stored(
+        stored if stored is not None else build_fuzzy(p.get("index", {}))
+    ))
+
+def expand_terms(
+    terms: Sequence[str],
+    payload: Mapping,
+    index: Mapping,
+    use_stemming: bool = False,
+    max_expansions: int = MAX_EXPANSIONS,
+) -> Dict[str, float]:
+    """
+    {expansion: weight} for the query terms (unstemmed, as from preprocess)
+    that are missing from index, the postings the query is scored against
+    (stemmed when use_stemming). Each missing term contributes its
+    max_expansions nearest vocabulary terms, most frequent first among equally
+    near ones. Empty when every term is known.
+    """
+    query_terms = {simple_stem(t) if use_stemming else t for t in terms}
+    missing = [t for t in dict.fromkeys(terms) if (simple_stem(t) if use_stemming else t) not in index]
+    if not missing:
+        return {}
+    fuzzy = fuzzy_index_for(payload)
+    idf = payload.get("idf", {})
+    weights: Dict[str, float] = {}
+    for term in missing:
+        # Lower idf = higher document frequency.
+        found = sorted(fuzzy.lookup(term), key=lambda c: (c[1], idf.get(c[0], float("inf")), c[0]))
+        for candidate, distance in found[:max_expansions]:
+            expansion = simple_stem(candidate) if use_stemming else candidate
+            if expansion in query_terms:
+                continue
+            weights[expansion] = max(weights.get(expansion, 0.0), DISTANCE_DECAY ** distance)
+    return weights
@@ -0,0 +1,791 @@
+"""
+Incremental index updates.
+
+A full build (index.json or index.bin) is treated as an immutable base. Adds,
+updates and deletes go into a small delta file next to it (e.g. index.bin.delta.json)
+holding the changed documents' postings (combined, per text field and, when
+the base stores them, positions), the ids removed from the base and the
+collection statistics (N, total length, field length totals, per-term df
+changes). OverlayPayload merges each stored section of the base with the
+delta as it is read, so serving an overlay costs about what serving the base
+does plus the size of the change. Committing
+rewrites only the delta, so the cost depends on the size of the change, not
+the corpus. compact() folds the delta back into a new base.
+"""
+import argparse
+import math
+import os
+import threading
+from bisect import bisect_right
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .binindex import BinaryIndex, is_binary_index, write_binary_index
+from .browse import BROWSE, browse_key, build_browse_for_docs, doc_year
+from .fields import STEMMED, TEXT_FIELDS, stem_index
+from .fuzzy import FUZZY, FuzzyIndex, FuzzyUnion, build_fuzzy, fuzzy_index_for
+from .indexer import build_documents, build_field_indexes, combined_counts, doc_field_counts, save_index
+from .positions import FIELD_STARTS, POSITIONS, build_positions, doc_field_starts, doc_positions, encode_gaps
+from .storage import load_json, load_jsonl, save_json
+from .suggest import SUGGEST, ChangedCompletions, Suggester, suggest_for, suggest_key
+
+def delta_path_for(index_path: str) -> str:
+    p = Path(index_path)
+    return str(p.with_name(p.name + ".delta.json"))
+
+def _signature(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def _drop_postings(index: Dict[str, Dict], terms: Iterable[str], doc_id: str) -> None:
+    for term in terms:
+        postings = index.get(term)
+        if postings is not None:
+            postings.pop(doc_id, None)
+            if not postings:
+                del index[term]
+
+class StableIdReader:
+    """Uniform, stable-id keyed access to a JSON payload or a BinaryIndex."""
+
+    def __init__(self, payload: Mapping):
+        self.payload = payload
+        self.binary = isinstance(payload, BinaryIndex)
+        self._index = payload.get("index", {})
+        self._docs = payload.get("docs", {})
+        self._lengths = payload.get("doc_lengths", {})
+        self._keys: Optional[List[str]] = None
+        self._nums: Optional[Dict[str, int]] = None
+
+    def _num(self, doc_id: str) -> Optional[int]:
+        return self.payload.doc_number(doc_id) if self.binary else None
+
+    def num(self, doc_id: str) -> Optional[int]:
+        """Position of doc_id in the base's document order."""
+        if self.binary:
+            return self._num(doc_id)
+        if self._nums is None:
+            self._nums = {d: i for i, d in enumerate(self._lengths)}
+        return self._nums.get(doc_id)
+
+    def key_at(self, num: int) -> str:
+        if self.binary:
+            return self.payload.stable_id(num)
+        if self._keys is None:
+            self._keys = list(self._lengths)
+        return self._keys[num]
+
+    def base_key(self, doc_id: str):
+        """doc_id as the payload's own sections key it (doc number or stable id), or None."""
+        return self._num(doc_id) if self.binary else (doc_id if doc_id in self._lengths else None)
+
+    def stable(self, key) -> str:
+        return self.payload.stable_id(key) if self.binary else key
+
+    def has(self, doc_id: str) -> bool:
+        if self.binary:
+            return self._num(doc_id) is not None
+        return doc_id in self._lengths
+
+    def doc(self, doc_id: str) -> Optional[Dict]:
+        if self.binary:
+            num = self._num(doc_id)
+            return None if num is None else self._docs[num]
+        return self._docs.get(doc_id)
+
+    def length(self, doc_id: str) -> int:
+        if self.binary:
+            num = self._num(doc_id)
+            return 0 if num is None else self._lengths[num]
+        return self._lengths.get(doc_id, 0)
+
+    def lengths_array(self) -> np.ndarray:
+        if self.binary:
+            return np.asarray(self._lengths.values(), dtype=np.int64)
+        return np.fromiter(self._lengths.values(), dtype=np.int64, count=len(self._lengths))
+
+    def doc_ids(self) -> Iterator[str]:
+        if self.binary:
+            for num in range(self.payload.n_docs):
+                yield self.payload.stable_id(num)
+        else:
+            yield from self._lengths.keys()
+
+    def postings(self, term: str) -> Dict[str, int]:
+        postings = self._index.get(term) or {}
+        if self.binary:
+            return {self.payload.stable_id(num): tf for num, tf in postings.items()}
+        return postings
+
+    def df(self, term: str) -> int:
+        if self.binary:
+            slot = self.payload.term_slot(term)
+            return self.payload.record_at(slot)[2] if slot >= 0 else 0
+        return len(self._index.get(term) or {})
+
+    def terms(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def n_docs(self) -> int:
+        return len(self._lengths)
+
+    def total_length(self) -> int:
+        if self.binary:
+            return self.payload.total_length
+        return sum(self._lengths.values())
+
+    def field_total(self, name: str) -> int:
+        return int(sum(self.payload["fields"][name]["doc_lengths"].values()))
+
+class IncrementalIndex:
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.delta_path = delta_path_for(index_path)
+        if is_binary_index(index_path):
+            base_payload: Mapping = BinaryIndex(index_path)
+        else:
+            base_payload = load_json(index_path)
+        self.base = StableIdReader(base_payload)
+
+        delta = load_json(self.delta_path)
+        if delta and delta.get("base_signature") != _signature(index_path):
+            # The base was rebuilt after this delta was written.
+            delta = {}
+        self.deleted = set(delta.get("deleted", []))
+        self.docs: Dict[str, Dict] = delta.get("docs", {})
+        self.doc_lengths: Dict[str, int] = delta.get("doc_lengths", {})
+        self.postings: Dict[str, Dict[str, int]] = delta.get("postings", {})
+        self.df_delta: Dict[str, int] = delta.get("df_delta", {})
+        self.n_docs: int = delta.get("n_docs", self.base.n_docs())
+        self.total_length: int = delta.get("total_length", self.base.total_length())
+        # Per text field postings and lengths of the delta documents, and the
+        # field length totals of base + delta, when the base stores fields.
+        self.has_fields = base_payload.get("fields") is not None
+        self.fields: Dict[str, Dict] = delta.get("fields") or {
+            name: {"index": {}, "doc_lengths": {}} for name in TEXT_FIELDS
+        }
+        self.field_totals: Dict[str, int] = delta.get("field_totals") or (
+            {name: self.base.field_total(name) for name in TEXT_FIELDS} if self.has_fields else {}
+        )
+        # Positions of the delta documents, when the base stores positions.
+        self.positions: Optional[Dict[str, Dict[str, List[int]]]] = None
+        if base_payload.get(POSITIONS) is not None:
+            self.positions = delta.get(POSITIONS, {})
+        # Field starts of the delta documents, when the base stores them.
+        self.field_starts: Optional[Dict[str, List[int]]] = None
+        if base_payload.get(FIELD_STARTS) is not None:
+            self.field_starts = delta.get(FIELD_STARTS, {})
+        self.dirty = False
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.docs or (doc_id not in self.deleted and self.base.has(doc_id))
+
+    def get_doc(self, doc_id: str) -> Optional[Dict]:
+        if doc_id in self.docs:
+            return self.docs[doc_id]
+        if doc_id in self.deleted:
+            return None
+        return self.base.doc(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        if doc_id in self.docs:
+            doc = self.docs.pop(doc_id)
+            self.doc_lengths.pop(doc_id)
+            field_counts = doc_field_counts(doc)
+            tf, length = combined_counts(field_counts)
+            _drop_postings(self.postings, tf, doc_id)
+            for name, field_tf, _ in field_counts:
+                field = self.fields[name]
+                field["doc_lengths"].pop(doc_id, None)
+                _drop_postings(field["index"], field_tf, doc_id)
+            if self.positions is not None:
+                _drop_postings(self.positions, tf, doc_id)
+            if self.field_starts is not None:
+                self.field_starts.pop(doc_id, None)
+        elif doc_id not in self.deleted and self.base.has(doc_id):
+            field_counts = doc_field_counts(self.base.doc(doc_id))
+            tf, length = combined_counts(field_counts)
+            self.deleted.add(doc_id)
+        else:
+            return
+        for term in tf:
+            self.df_delta[term] = self.df_delta.get(term, 0) - 1
+        for name, _, field_length in field_counts:
+            if name in self.field_totals:
+                self.field_totals[name] -= field_length
+        self.n_docs -= 1
+        self.total_length -= length
+
+    def upsert(self, doc: Dict) -> None:
+        doc_id = doc["id"]
+        self._remove(doc_id)
+        field_counts = doc_field_counts(doc)
+        tf, length = combined_counts(field_counts)
+        self.docs[doc_id] = doc
+        self.doc_lengths[doc_id] = length
+        for term, freq in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = freq
+            self.df_delta[term] = self.df_delta.get(term, 0) + 1
+        for name, field_tf, field_length in field_counts:
+            field = self.fields[name]
+            field["doc_lengths"][doc_id] = field_length
+            for term, freq in field_tf.items():
+                field["index"].setdefault(term, {})[doc_id] = freq
+            if name in self.field_totals:
+                self.field_totals[name] += field_length
+        if self.positions is not None:
+            for term, plist in doc_positions(doc).items():
+                self.positions.setdefault(term, {})[doc_id] = encode_gaps(plist)
+        if self.field_starts is not None:
+            self.field_starts[doc_id] = doc_field_starts(doc)
+        self.n_docs += 1
+        self.total_length += length
+        self.dirty = True
+
+    def delete(self, doc_id: str) -> None:
+        if doc_id in self:
+            self._remove(doc_id)
+            self.dirty = True
+
+    def apply(self, upserts: Iterable[Dict] = (), deletes: Iterable[str] = ()) -> None:
+        for doc_id in deletes:
+            self.delete(doc_id)
+        for doc in upserts:
+            self.upsert(doc)
+
+    def has_changes(self) -> bool:
+        return bool(self.docs or self.deleted)
+
+    def df(self, term: str) -> int:
+        return self.base.df(term) + self.df_delta.get(term, 0)
+
+    def commit(self) -> None:
+        if not self.dirty:
+            return
+        delta = {
+            "base_signature": _signature(self.index_path),
+            "n_docs": self.n_docs,
+            "total_length": self.total_length,
+            "deleted": sorted(self.deleted),
+            "docs": self.docs,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+            "df_delta": {t: d for t, d in self.df_delta.items() if d},
+            "fields": self.fields,
+            "field_totals": self.field_totals,
+        }
+        if self.positions is not None:
+            delta[POSITIONS] = self.positions
+        if self.field_starts is not None:
+            delta[FIELD_STARTS] = self.field_starts
+        save_json(self.delta_path, delta)
+        self.dirty = False
+
+    def payload(self) -> "OverlayPayload":
+        return OverlayPayload(self)
+
+    def to_payload(self) -> Dict:
+        view = self.payload()
+        docs = {doc_id: view["docs"][doc_id] for doc_id in view["docs"]}
+        doc_lengths = {doc_id: view["doc_lengths"][doc_id] for doc_id in docs}
+        index: Dict[str, Dict[str, int]] = {}
+        for term in view["index"]:
+            postings = view["index"].get(term)
+            if postings:
+                index[term] = postings
+        return {"docs": docs, "index": index, "doc_lengths": doc_lengths}
+
+    def compact(self, json_path: Optional[str] = None, bin_path: Optional[str] = None) -> None:
+        """Write base + delta as a fresh full index and drop the delta."""
+        full = self.to_payload()
+        fields = build_field_indexes(full["docs"])
+        positions = build_positions(full["docs"]) if self.positions is not None else None
+        if bin_path:
+            write_binary_index(bin_path, full["docs"], full["index"], full["doc_lengths"], fields, positions)
+        if json_path:
+            save_index(json_path, full["docs"], full["index"], full["doc_lengths"], fields, positions)
+        remove_delta(self.index_path)
+
+class _Numbering:
+    """
+    Overlay doc numbers: the live base documents in base order, then the
+    delta's documents (the order the overlay's "docs" iterate in).
+    """
+
+    def __init__(self, inc: IncrementalIndex):
+        self._base = inc.base
+        removed = [n for n in (inc.base.num(doc_id) for doc_id in inc.deleted) if n is not None]
+        self.live = np.setdiff1d(np.arange(inc.base.n_docs(), dtype=np.int64), np.asarray(removed, dtype=np.int64))
+        self.of_base = np.full(inc.base.n_docs(), -1, dtype=np.int64)
+        self.of_base[self.live] = np.arange(len(self.live))
+        self.delta_ids = list(inc.docs)
+        self._delta_nums = {doc_id: len(self.live) + i for i, doc_id in enumerate(self.delta_ids)}
+
+    def __len__(self) -> int:
+        return len(self.live) + len(self.delta_ids)
+
+    def num(self, doc_id: str) -> Optional[int]:
+        num = self._delta_nums.get(doc_id)
+        if num is not None:
+            return num
+        base_num = self._base.num(doc_id)
+        if base_num is None or self.of_base[base_num] < 0:
+            return None
+        return int(self.of_base[base_num])
+
+    def key(self, num: int) -> str:
+        num = int(num)
+        if num < len(self.live):
+            return self._base.key_at(int(self.live[num]))
+        return self.delta_ids[num - len(self.live)]
+
+class _Keys(Sequence):
+    """Stable ids of overlay doc numbers (all of them, or those in nums), resolved on access."""
+
+    def __init__(self, numbering: _Numbering, nums: Optional[np.ndarray] = None):
+        self._numbering = numbering
+        self._nums = nums
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._numbering.key(i if self._nums is None else self._nums[i])
+
+    def __len__(self) -> int:
+        return len(self._numbering) if self._nums is None else len(self._nums)
+
+class _OverlayDocs(Mapping):
+    def __init__(self, inc: IncrementalIndex):
+        self._inc = inc
+
+    def __getitem__(self, doc_id: str) -> Dict:
+        doc = self._inc.get_doc(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __iter__(self) -> Iterator[str]:
+        inc = self._inc
+        for doc_id in inc.base.doc_ids():
+            if doc_id not in inc.deleted:
+                yield doc_id
+        yield from inc.docs
+
+    def __len__(self) -> int:
+        return self._inc.n_docs
+
+class _OverlayLengths(_OverlayDocs):
+    """doc id -> length, from the base's lengths (of the main index or a text field) and the delta's."""
+
+    def __init__(self, overlay: "OverlayPayload", base_lengths: Mapping, delta_lengths: Dict[str, int]):
+        super().__init__(overlay.inc)
+        self._overlay = overlay
+        self._base_lengths = base_lengths
+        self._delta_lengths = delta_lengths
+
+    def __getitem__(self, doc_id: str) -> int:
+        inc = self._inc
+        if doc_id in self._delta_lengths:
+            return self._delta_lengths[doc_id]
+        key = None if doc_id in inc.deleted else inc.base.base_key(doc_id)
+        if key is None:
+            raise KeyError(doc_id)
+        return self._base_lengths[key]
+
+    def values(self) -> np.ndarray:
+        """Lengths in overlay doc-number order."""
+        numbering = self._overlay.numbering()
+        base = self._base_lengths.values()
+        base = np.asarray(base, dtype=np.int64) if self._inc.base.binary else np.fromiter(base, dtype=np.int64, count=len(base))
+        delta = np.fromiter((self._delta_lengths[d] for d in numbering.delta_ids), dtype=np.int64, count=len(numbering.delta_ids))
+        return np.concatenate((base[numbering.live], delta))
+
+class _OverlayPostings(Mapping):
+    """term -> {doc id: tf}: the base's postings without the removed documents, then the delta's."""
+
+    def __init__(self, inc: IncrementalIndex, base_index: Mapping, delta_index: Mapping):
+        self._inc = inc
+        self._base = base_index
+        self._delta = delta_index
+
+    def __getitem__(self, term: str) -> Dict[str, int]:
+        inc = self._inc
+        postings = self._base.get(term) or {}
+        if inc.base.binary:
+            postings = {inc.base.stable(num): tf for num, tf in postings.items()}
+        if inc.deleted:
+            postings = {d: tf for d, tf in postings.items() if d not in inc.deleted}
+        extra = self._delta.get(term)
+        if extra:
+            postings = {**postings, **extra}
+        if not postings:
+            raise KeyError(term)
+        return postings
+
+    def __iter__(self) -> Iterator[str]:
+        for term in self._base:
+            if term in self:
+                yield term
+        for term in self._delta:
+            if term not in self._base:
+                yield term
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+class _MainPostings(_OverlayPostings):
+    def __iter__(self) -> Iterator[str]:
+        inc = self._inc
+        for term in inc.base.terms():
+            if inc.df(term) > 0:
+                yield term
+        for term in inc.postings:
+            if inc.base.df(term) == 0:
+                yield term
+
+class _Idf(Mapping):
+    def __init__(self, field: "_OverlayField"):
+        self._field = field
+
+    def __getitem__(self, term: str) -> float:
+        df = self._field.df(term)
+        if df <= 0:
+            raise KeyError(term)
+        return math.log(1 + (self._field.n_docs - df + 0.5) / (df + 0.5))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._field["index"])
+
+    def __len__(self) -> int:
+        return len(self._field["index"])
+
+class _TermPositions(Mapping):
+    """One term's {doc id: gaps}; base documents are decoded only when looked up."""
+
+    def __init__(self, inc: IncrementalIndex, base: Mapping, extra: Mapping):
+        self._inc = inc
+        self._base = base
+        self._extra = extra
+        self._len: Optional[int] = None
+
+    def __getitem__(self, doc_id: str) -> List[int]:
+        inc = self._inc
+        if doc_id in self._extra:
+            return self._extra[doc_id]
+        key = None if doc_id in inc.deleted else inc.base.base_key(doc_id)
+        if key is None:
+            raise KeyError(doc_id)
+        try:
+            return self._base[key]
+        except KeyError:
+            raise KeyError(doc_id) from None
+
+    def __iter__(self) -> Iterator[str]:
+        inc = self._inc
+        for key in self._base:
+            doc_id = inc.base.stable(key)
+            if doc_id not in inc.deleted:
+                yield doc_id
+        yield from self._extra
+
+    def __len__(self) -> int:
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+class _OverlayPositions(Mapping):
+    def __init__(self, inc: IncrementalIndex, base_positions: Mapping):
+        self._inc = inc
+        self._base = base_positions
+
+    def __getitem__(self, term: str) -> _TermPositions:
+        base = self._base.get(term)
+        extra = self._inc.positions.get(term)
+        if base is None and extra is None:
+            raise KeyError(term)
+        return _TermPositions(self._inc, base or {}, extra or {})
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._base
+        for term in self._inc.positions:
+            if term not in self._base:
+                yield term
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+class _OverlayFieldStarts(Mapping):
+    def __init__(self, inc: IncrementalIndex, base_starts: Mapping):
+        self._inc = inc
+        self._base = base_starts
+
+    def __getitem__(self, doc_id: str) -> Sequence[int]:
+        inc = self._inc
+        if doc_id in inc.field_starts:
+            return inc.field_starts[doc_id]
+        key = None if doc_id in inc.deleted else inc.base.base_key(doc_id)
+        if key is None:
+            raise KeyError(doc_id)
+        return self._base[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_OverlayDocs(self._inc))
+
+    def __len__(self) -> int:
+        return self._inc.n_docs
+
+class _OverlayField(Mapping):
+    """
+    A postings field of the overlay (the main index or the stemmed one),
+    shaped like a payload for bm25_score. It also offers the per-term
+    interface of a BinaryField (term_slot, postings_at, record_at) keyed by
+    overlay doc numbers, so array_index_for() decodes only the postings a
+    query touches instead of converting the whole vocabulary.
+    """
+
+    def __init__(self, overlay: "OverlayPayload", views: Dict, df: Callable[[str], int]):
+        self._overlay = overlay
+        self._views = views
+        self.df = df
+        self.n_docs = overlay.inc.n_docs
+        self._slots: Dict[str, int] = {}
+        self._terms: List[str] = []
+        self._slots_lock = threading.Lock()
+
+    def __getitem__(self, key: str):
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    @property
+    def doc_keys(self) -> Sequence[str]:
+        return _Keys(self._overlay.numbering())
+
+    def doc_num(self, doc_id) -> Optional[int]:
+        return self._overlay.numbering().num(doc_id) if isinstance(doc_id, str) else None
+
+    def term_slot(self, term: str) -> int:
+        slot = self._slots.get(term)
+        if slot is not None:
+            return slot
+        if self.df(term) <= 0:
+            return -1
+        with self._slots_lock:
+            slot = self._slots.get(term)
+            if slot is None:
+                slot = self._slots[term] = len(self._terms)
+                self._terms.append(term)
+        return slot
+
+    def term_at(self, slot: int) -> str:
+        return self._terms[slot]
+
+    @property
+    def n_terms(self) -> int:
+        for term in self["index"]:
+            self.term_slot(term)
+        return len(self._terms)
+
+    def record_at(self, slot: int) -> Tuple[int, int, int, float]:
+        term = self._terms[slot]
+        return 0, 0, self.df(term), self["idf"][term]
+
+    def postings_at(self, slot: int) -> Dict[int, int]:
+        numbering = self._overlay.numbering()
+        return {numbering.num(doc_id): tf for doc_id, tf in self["index"][self._terms[slot]].items()}
+
+class OverlayPayload(_OverlayField):
+    """
+    Base + delta, exposed with the same keys as a JSON index payload. The
+    sections the base stores (text fields, stemmed field, positions, browse
+    order, completion tables, fuzzy index) are merged with the delta's
+    documents on lookup, so loading an overlay never rebuilds them from the
+    whole corpus; browse, suggest and fuzzy are merged on first use.
+    """
+
+    def __init__(self, inc: IncrementalIndex):
+        self.inc = inc
+        base = inc.base.payload
+        avgdl = inc.total_length / float(inc.n_docs) if inc.n_docs else 0.0
+        views = {
+            "docs": _OverlayDocs(inc),
+            "index": _MainPostings(inc, base.get("index", {}), inc.postings),
+            "doc_lengths": _OverlayLengths(self, base.get("doc_lengths", {}), inc.doc_lengths),
+            "avgdl": avgdl,
+        }
+        super().__init__(self, views, inc.df)
+        views["idf"] = _Idf(self)
+        self._numbering: Optional[_Numbering] = None
+        if inc.has_fields:
+            views["fields"] = {
+                name: {
+                    "index": _OverlayPostings(inc, base["fields"][name]["index"], inc.fields[name]["index"]),
+                    "doc_lengths": _OverlayLengths(self, base["fields"][name]["doc_lengths"], inc.fields[name]["doc_lengths"]),
+                    "avgdl": inc.field_totals[name] / float(inc.n_docs) if inc.n_docs else 0.0,
+                }
+                for name in TEXT_FIELDS
+            }
+        if base.get(STEMMED) is not None:
+            stemmed_index = _OverlayPostings(inc, base[STEMMED]["index"], stem_index(inc.postings))
+            stemmed_df: Dict[str, int] = {}
+
+            def stem_df(stem: str) -> int:
+                df = stemmed_df.get(stem)
+                if df is None:
+                    df = stemmed_df[stem] = len(stemmed_index.get(stem) or {})
+                return df
+
+            stemmed = _OverlayField(self, {"index": stemmed_index, "doc_lengths": views["doc_lengths"], "avgdl": avgdl}, stem_df)
+            stemmed._views["idf"] = _Idf(stemmed)
+            views[STEMMED] = stemmed
+        if inc.positions is not None:
+            views[POSITIONS] = _OverlayPositions(inc, base[POSITIONS])
+        if inc.field_starts is not None:
+            views[FIELD_STARTS] = _OverlayFieldStarts(inc, base[FIELD_STARTS])
+        self._lazy = {BROWSE: self._browse, SUGGEST: self._suggest, FUZZY: self._fuzzy}
+        self._built: Dict[str, object] = {}
+
+    def __getitem__(self, key: str):
+        if key in self._views:
+            return self._views[key]
+        if key not in self._lazy:
+            raise KeyError(key)
+        value = self._built.get(key)
+        if value is None:
+            value = self._built[key] = self._lazy[key]()
+        return value
+
+    def __iter__(self):
+        yield from self._views
+        yield from self._lazy
+
+    def __len__(self) -> int:
+        return len(self._views) + len(self._lazy)
+
+    def numbering(self) -> _Numbering:
+        if self._numbering is None:
+            self._numbering = _Numbering(self.inc)
+        return self._numbering
+
+    def _browse(self) -> Mapping:
+        """The base's browse order without removed documents, with the delta's inserted in place."""
+        inc = self.inc
+        stored = inc.base.payload.get(BROWSE)
+        docs = self["docs"]
+        if stored is None:
+            return build_browse_for_docs(docs)
+        numbering = self.numbering()
+        order = stored["order"][:]
+        base_nums = np.asarray(order if inc.base.binary else [inc.base.num(d) for d in order], dtype=np.int64)
+        years = np.zeros(len(base_nums), dtype=np.int64)
+        for year, (lo, hi) in stored["years"].items():
+            years[lo:hi] = int(year)
+        nums = numbering.of_base[base_nums]
+        keep = nums >= 0
+        nums, years = nums[keep], years[keep]
+
+        key_of = lambda num: browse_key(docs[numbering.key(num)])
+        # Ties keep overlay order, which puts delta documents after base ones.
+        added = sorted(range(len(numbering.live), len(numbering)), key=lambda num: (key_of(num), num))
+        at = [bisect_right(nums, key_of(num), key=key_of) for num in added]
+        nums = np.insert(nums, at, added)
+        years = np.insert(years, at, [doc_year(docs[numbering.key(num)]) for num in added])
+
+        spans: Dict[str, List[int]] = {}
+        bounds = (np.flatnonzero(np.diff(years)) + 1).tolist()
+        for lo, hi in zip([0] + bounds, bounds + [len(years)]):
+            if lo < hi and years[lo]:
+                spans[str(int(years[lo]))] = [lo, hi]
+        return {"order": _Keys(numbering, nums), "years": spans}
+
+    def _suggest(self) -> Suggester:
+        """The base's completion tables with the weights the delta changed."""
+        inc = self.inc
+        base = suggest_for(inc.base.payload)
+        terms = {term: (term, inc.df(term)) for term in inc.df_delta}
+        removed: Dict[str, int] = {}
+        added: Dict[str, Tuple[str, int]] = {}
+        for doc_id in inc.deleted:
+            key = suggest_key(inc.base.doc(doc_id).get("title") or "")
+            if key:
+                removed[key] = removed.get(key, 0) + 1
+        for doc in inc.docs.values():
+            title = doc.get("title") or ""
+            key = suggest_key(title)
+            if key:
+                text, count = added.get(key, (" ".join(title.split()), 0))
+                added[key] = (text, count + 1)
+        titles = {}
+        for key in set(removed) | set(added):
+            text, weight = base.titles.entry(key)
+            left = weight - removed.get(key, 0)
+            if left <= 0 or text is None:
+                text = added.get(key, (text, 0))[0]
+            titles[key] = (text, left + added.get(key, ("", 0))[1])
+        return Suggester(ChangedCompletions(base.terms, terms), ChangedCompletions(base.titles, titles))
+
+    def _fuzzy(self) -> FuzzyUnion:
+        """The base's deletion index plus one over the terms only the delta has."""
+        inc = self.inc
+        parts = [fuzzy_index_for(inc.base.payload)]
+        new_terms = [term for term in inc.postings if inc.base.df(term) == 0]
+        if new_terms:
+            parts.append(FuzzyIndex.from_stored(build_fuzzy(new_terms)))
+        return FuzzyUnion(parts, accept=lambda term: inc.df(term) > 0)
+
+    def close(self) -> None:
+        close = getattr(self.inc.base.payload, "close", None)
+        if close is not None:
+            close()
+
+def diff_publications(old: List[Dict], new: List[Dict]) -> Tuple[List[Dict], List[str]]:
+    """Documents to upsert and stable ids to delete to turn `old` into `new`."""
+    old_docs = build_documents(old)
+    new_docs = build_documents(new)
+    upserts = [d for doc_id, d in new_docs.items() if old_docs.get(doc_id) != d]
+    deletes = [doc_id for doc_id in old_docs if doc_id not in new_docs]
+    return upserts, deletes
+
+def remove_delta(index_path: str) -> None:
+    try:
+        os.remove(delta_path_for(index_path))
+    except FileNotFoundError:
+        pass
+
+def main():
+    from .config import INDEX_BIN, INDEX_JSON, PUBLICATIONS_JSONL, base_index_path
+
+    ap = argparse.ArgumentParser(description="Apply publication changes to the index without a full rebuild")
+    ap.add_argument("--index", default=None, help="Base index (index.bin or index.json)")
+    ap.add_argument("--old", default=None, help="Previous publications.jsonl to diff against")
+    ap.add_argument("--new", default=PUBLICATIONS_JSONL, help="Current publications.jsonl")
+    ap.add_argument("--compact", action="store_true", help="Fold the delta into a new full index")
+    args = ap.parse_args()
+
+    index_path = args.index or base_index_path()
+    inc = IncrementalIndex(index_path)
+    if args.compact:
+        inc.compact(json_path=INDEX_JSON, bin_path=INDEX_BIN)
+        print(f"Compacted {inc.n_docs} documents into {INDEX_BIN} and {INDEX_JSON}")
+        return
+    if not args.old:
+        ap.error("--old is required unless --compact is given")
+    upserts, deletes = diff_publications(load_jsonl(args.old), load_jsonl(args.new))
+    inc.apply(upserts, deletes)
+    inc.commit()
+    print(f"Upserted {len(upserts)}, deleted {len(deletes)}; documents: {inc.n_docs}")
+    print(f"Saved: {inc.delta_path}")
+
+if __name__ == "__main__":
+    main()
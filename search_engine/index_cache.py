@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .storage import load_json
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    payload: Dict
+    generation: int
+    mtime_ns: int
+    size: int
+    extra: Tuple = ()
+    path: str = ""
+
+    @property
+    def signature(self) -> Tuple:
+        return (self.path, (self.mtime_ns, self.size)) + self.extra
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class IndexHolder:
+    """
+    Process-wide holder for a loaded index.
+
+    Readers call get() and receive an immutable snapshot. The file is
+    stat()ed at most once per check_interval; when its mtime/size changes a
+    single thread reloads it and swaps the snapshot reference, while other
+    readers keep being served the previous snapshot. Files listed in
+    watch_paths (e.g. an incremental delta next to the index) trigger a
+    reload the same way.
+
+    path may be a callable, resolved again at every check, so an index
+    created after startup (or one that moved, e.g. to a segment directory)
+    is picked up; watch_paths may then be a callable of the resolved path.
+    With close_replaced, a replaced snapshot's payload is closed once the
+    readers holding it through acquire()/use() have released it; snapshots
+    taken with get() alone are not counted and must not outlive a reload.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Callable[[], str]],
+        loader: Callable[[str], Dict] = load_json,
+        check_interval: float = 1.0,
+        watch_paths: Union[Iterable[str], Callable[[str], Iterable[str]]] = (),
+        close_replaced: bool = False,
+    ):
+        self._path = path
+        self._watch_paths = watch_paths if callable(watch_paths) else tuple(watch_paths)
+        self.loader = loader
+        self.check_interval = check_interval
+        self.close_replaced = close_replaced
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+        self._readers: Dict[int, int] = {}
+
+    @property
+    def path(self) -> str:
+        return self._path() if callable(self._path) else self._path
+
+    def watch_paths(self, path: str) -> Tuple[str, ...]:
+        return tuple(self._watch_paths(path)) if callable(self._watch_paths) else self._watch_paths
+
+    @property
+    def generation(self) -> int:
+        snap = self._snapshot
+        return snap.generation if snap else 0
+
+    def get(self) -> IndexSnapshot:
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is not None and now < self._next_check:
+            return snap
+        self._next_check = now + self.check_interval
+
+        if snap is not None and self._signature() == snap.signature:
+            return snap
+        return self._reload(snap)
+
+    def reload(self) -> IndexSnapshot:
+        return self._reload(self._snapshot, force=True)
+
+    def acquire(self) -> IndexSnapshot:
+        """The current snapshot, kept open until release()."""
+        self.get()
+        with self._readers_lock:
+            snap = self._snapshot
+            self._readers[snap.generation] = self._readers.get(snap.generation, 0) + 1
+        return snap
+
+    def release(self, snap: IndexSnapshot) -> None:
+        with self._readers_lock:
+            left = self._readers[snap.generation] - 1
+            if left:
+                self._readers[snap.generation] = left
+                return
+            del self._readers[snap.generation]
+            retired = snap is not self._snapshot
+        if retired and self.close_replaced:
+            _close(snap.payload)
+
+    @contextmanager
+    def use(self) -> Iterator[IndexSnapshot]:
+        snap = self.acquire()
+        try:
+            yield snap
+        finally:
+            self.release(snap)
+
+    def _signature(self) -> Tuple:
+        path = self.path
+        return (path,) + tuple(_file_signature(p) for p in (path,) + self.watch_paths(path))
+
+    def _reload(self, seen: Optional[IndexSnapshot], force: bool = False) -> IndexSnapshot:
+        # Only the first cold load waits; later reloads never block readers.
+        if not self._reload_lock.acquire(blocking=seen is None or force):
+            return seen
+        try:
+            current = self._snapshot
+            if current is not seen and not force:
+                return current
+            full_sig = self._signature()
+            if current is not None and not force and full_sig == current.signature:
+                return current
+            path, sig = full_sig[0], full_sig[1]
+            if sig is None:
+                payload: Dict = {}
+                sig = (0, 0)
+            else:
+                try:
+                    payload = self.loader(path)
+                except Exception:
+                    # Half-written file or similar: keep serving the old snapshot.
+                    if current is not None:
+                        return current
+                    payload = {}
+                    sig = (0, 0)
+            generation = (current.generation + 1) if current else 1
+            snap = IndexSnapshot(
+                payload=payload, generation=generation, mtime_ns=sig[0], size=sig[1], extra=full_sig[2:], path=path
+            )
+            with self._readers_lock:
+                self._snapshot = snap
+                idle = current is not None and current.generation not in self._readers
+            if idle and self.close_replaced:
+                _close(current.payload)
+            return snap
+        finally:
+            self._reload_lock.release()
+
+def _close(payload) -> None:
+    close = getattr(payload, "close", None)
+    if close is not None:
+        close()
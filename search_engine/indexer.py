@@ -1,60 +1,238 @@
+import argparse
 import hashlib
-from typing import Dict, List, Tuple
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
 from .preprocess import preprocess
-from .bm25 import compute_idf
+from .bm25 import compute_idf, compute_max_scores
+from .browse import BROWSE, build_browse_for_docs
+from .suggest import SUGGEST, build_suggest
+from .fields import STEMMED, TEXT_FIELDS, build_stemmed_field
+from .positions import FIELD_STARTS, POSITIONS, build_field_starts, build_positions
 from .storage import save_json
 
 def stable_id(text: str) -> str:
     return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
 
-def build_documents(publications: List[Dict]) -> Dict[str, Dict]:
+def publication_document(p: Dict) -> Optional[Dict]:
+    url = p.get("publication_url") or ""
+    if not url:
+        return None
+    doc_id = stable_id(url)
+    return {
+        "id": doc_id,
+        "title": p.get("title", ""),
+        "year": p.get("year", ""),
+        "authors": p.get("authors", []),
+        "publication_url": url,
+        "author_urls": p.get("author_urls", []),
+        "author_profiles": p.get("author_profiles", []),
+        "abstract": p.get("abstract", ""),
+    }
+
+def build_documents(publications: Iterable[Dict]) -> Dict[str, Dict]:
     docs: Dict[str, Dict] = {}
     for p in publications:
-        url = p.get("publication_url") or ""
-        if not url:
-            continue
-        doc_id = stable_id(url)
-        docs[doc_id] = {
-            "id": doc_id,
-            "title": p.get("title", ""),
-            "year": p.get("year", ""),
-            "authors": p.get("authors", []),
-            "publication_url": url,
-            "author_urls": p.get("author_urls", []),
-            "author_profiles": p.get("author_profiles", []),
-            "abstract": p.get("abstract", ""),
-        }
+        d = publication_document(p)
+        if d is not None:
+            docs[d["id"]] = d
     return docs
 
+def doc_field_texts(d: Dict) -> List[Tuple[str, str]]:
+    return [
+        ("title", d.get("title","")),
+        ("abstract", d.get("abstract","")),
+        ("authors", " ".join(d.get("authors", []))),
+        ("year", str(d.get("year",""))),
+    ]
+
+def doc_text(d: Dict) -> str:
+    return " ".join(text for _, text in doc_field_texts(d))
+
+def doc_term_counts(d: Dict) -> Tuple[Dict[str, int], int]:
+    terms = preprocess(doc_text(d))
+    tf: Dict[str, int] = {}
+    for t in terms:
+        tf[t] = tf.get(t, 0) + 1
+    return tf, len(terms)
+
+def doc_field_counts(d: Dict) -> List[Tuple[str, Dict[str, int], int]]:
+    """Per-field (name, term counts, length). Summed over fields they equal doc_term_counts(d)."""
+    out = []
+    for name, text in doc_field_texts(d):
+        terms = preprocess(text)
+        tf: Dict[str, int] = {}
+        for t in terms:
+            tf[t] = tf.get(t, 0) + 1
+        out.append((name, tf, len(terms)))
+    return out
+
+def combined_counts(field_counts: List[Tuple[str, Dict[str, int], int]]) -> Tuple[Dict[str, int], int]:
+    # Fields are visited in doc_text order, so the combined counts keep the
+    # term order of tokenizing the joined text.
+    tf: Dict[str, int] = {}
+    for _, field_tf, _ in field_counts:
+        for term, freq in field_tf.items():
+            tf[term] = tf.get(term, 0) + freq
+    return tf, sum(length for _, _, length in field_counts)
+
 def build_inverted_index(docs: Dict[str, Dict]) -> Tuple[Dict[str, Dict[str, int]], Dict[str, int]]:
     index: Dict[str, Dict[str, int]] = {}
     doc_lengths: Dict[str, int] = {}
 
     for doc_id, d in docs.items():
-        text = " ".join([
-            d.get("title",""),
-            d.get("abstract",""),
-            " ".join(d.get("authors", [])),
-            str(d.get("year","")),
-        ])
-        terms = preprocess(text)
-        doc_lengths[doc_id] = len(terms)
+        tf, doc_lengths[doc_id] = doc_term_counts(d)
 
-        tf: Dict[str, int] = {}
-        for t in terms:
-            tf[t] = tf.get(t, 0) + 1
+        for term, freq in tf.items():
+            index.setdefault(term, {})[doc_id] = freq
+
+    return index, doc_lengths
+
+def build_indexes(docs: Dict[str, Dict]) -> Tuple[Dict[str, Dict[str, int]], Dict[str, int], Dict[str, Dict]]:
+    """
+    The combined index (identical to build_inverted_index) plus one index and
+    doc-length map per text field, from a single tokenization pass.
+    """
+    index: Dict[str, Dict[str, int]] = {}
+    doc_lengths: Dict[str, int] = {}
+    fields: Dict[str, Dict] = {name: {"index": {}, "doc_lengths": {}} for name in TEXT_FIELDS}
+
+    for doc_id, d in docs.items():
+        field_counts = doc_field_counts(d)
+        for name, field_tf, field_length in field_counts:
+            field = fields[name]
+            field["doc_lengths"][doc_id] = field_length
+            for term, freq in field_tf.items():
+                field["index"].setdefault(term, {})[doc_id] = freq
+        tf, doc_lengths[doc_id] = combined_counts(field_counts)
 
         for term, freq in tf.items():
             index.setdefault(term, {})[doc_id] = freq
 
+    return index, doc_lengths, fields
+
+def build_field_indexes(docs: Dict[str, Dict]) -> Dict[str, Dict]:
+    return build_indexes(docs)[2]
+
+def _doc_chunks(docs: Dict[str, Dict], workers: int, chunks_per_worker: int) -> List[Dict[str, Dict]]:
+    items = list(docs.items())
+    size = -(-len(items) // min(len(items), workers * chunks_per_worker))
+    return [dict(items[i:i + size]) for i in range(0, len(items), size)]
+
+def _merge_postings(index: Dict[str, Dict[str, int]], part: Dict[str, Dict[str, int]]) -> None:
+    for term, postings in part.items():
+        merged = index.get(term)
+        if merged is None:
+            index[term] = postings
+        else:
+            merged.update(postings)
+
+def build_inverted_index_parallel(
+    docs: Dict[str, Dict], workers: int, chunks_per_worker: int = 4
+) -> Tuple[Dict[str, Dict[str, int]], Dict[str, int]]:
+    """
+    build_inverted_index over a process pool. Documents are split into
+    contiguous chunks and the partial indexes merged in chunk order, so term
+    and posting order (and therefore the saved index) match the serial build.
+    """
+    if workers <= 1 or len(docs) < 2:
+        return build_inverted_index(docs)
+    index: Dict[str, Dict[str, int]] = {}
+    doc_lengths: Dict[str, int] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part_index, part_lengths in pool.map(build_inverted_index, _doc_chunks(docs, workers, chunks_per_worker)):
+            doc_lengths.update(part_lengths)
+            _merge_postings(index, part_index)
     return index, doc_lengths
 
-def save_index(index_path: str, docs: Dict[str, Dict], index: Dict[str, Dict[str, int]], doc_lengths: Dict[str, int]) -> None:
+def build_indexes_parallel(
+    docs: Dict[str, Dict], workers: int, chunks_per_worker: int = 4
+) -> Tuple[Dict[str, Dict[str, int]], Dict[str, int], Dict[str, Dict]]:
+    """build_indexes over a process pool, merged like build_inverted_index_parallel."""
+    if workers <= 1 or len(docs) < 2:
+        return build_indexes(docs)
+    index: Dict[str, Dict[str, int]] = {}
+    doc_lengths: Dict[str, int] = {}
+    fields: Dict[str, Dict] = {name: {"index": {}, "doc_lengths": {}} for name in TEXT_FIELDS}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part_index, part_lengths, part_fields in pool.map(build_indexes, _doc_chunks(docs, workers, chunks_per_worker)):
+            doc_lengths.update(part_lengths)
+            _merge_postings(index, part_index)
+            for name, part in part_fields.items():
+                fields[name]["doc_lengths"].update(part["doc_lengths"])
+                _merge_postings(fields[name]["index"], part["index"])
+    return index, doc_lengths, fields
+
+def save_index(
+    index_path: str,
+    docs: Dict[str, Dict],
+    index: Dict[str, Dict[str, int]],
+    doc_lengths: Dict[str, int],
+    fields: Optional[Dict[str, Dict]] = None,
+    positions: Optional[Dict[str, Dict[str, List[int]]]] = None,
+) -> None:
+    if fields is None:
+        fields = build_field_indexes(docs)
     idf = compute_idf(index, n_docs=len(docs))
     payload = {
         "docs": docs,
         "index": index,
         "doc_lengths": doc_lengths,
         "idf": idf,
+        "max_scores": compute_max_scores(index, doc_lengths, idf),
+        STEMMED: build_stemmed_field(index, doc_lengths),
+        "fields": fields,
+        BROWSE: build_browse_for_docs(docs),
+        SUGGEST: build_suggest(index, docs),
     }
+    if positions is not None:
+        payload[POSITIONS] = positions
+        payload[FIELD_STARTS] = build_field_starts(docs)
     save_json(index_path, payload)
+
+def main():
+    from .binindex import write_binary_index
+    from .config import INDEX_BIN, INDEX_JSON, PUBLICATIONS_JSONL
+    from .storage import iter_jsonl, load_jsonl
+
+    ap = argparse.ArgumentParser(description="Rebuild the index from publications.jsonl")
+    ap.add_argument("--input", default=PUBLICATIONS_JSONL)
+    ap.add_argument("--output", default=INDEX_BIN, help="Binary index path (with --stream the only output)")
+    ap.add_argument("--json", default=INDEX_JSON, help="JSON index path (in-memory build only)")
+    ap.add_argument("--stream", action="store_true",
+                    help="Bounded-memory build: spill sorted runs to disk and merge them")
+    ap.add_argument("--memory-mb", type=float, default=256, help="Memory budget for --stream (postings buffer and per-document state)")
+    ap.add_argument("--tmp-dir", default=None, help="Directory for --stream runs (default: system temp)")
+    ap.add_argument("--workers", type=int, default=1, help="Tokenizer processes (1 = serial)")
+    ap.add_argument("--positions", action="store_true",
+                    help="Also store term positions (phrase queries and proximity ranking)")
+    args = ap.parse_args()
+    if args.stream and args.positions:
+        ap.error("--positions is only supported by the in-memory build")
+
+    from .stream_indexer import build_index_streaming, peak_rss_mb
+
+    if args.stream:
+        stats = build_index_streaming(
+            iter_jsonl(args.input), args.output, args.memory_mb, args.tmp_dir, workers=args.workers
+        )
+        print(f"Documents: {stats.docs} ({stats.records} records), terms: {stats.terms}, "
+              f"postings: {stats.postings}, runs: {stats.runs}, {stats.seconds:.2f}s")
+        saved = [args.output]
+    else:
+        start = time.perf_counter()
+        docs = build_documents(load_jsonl(args.input))
+        index, doc_lengths, fields = build_indexes_parallel(docs, args.workers)
+        positions = build_positions(docs) if args.positions else None
+        write_binary_index(args.output, docs, index, doc_lengths, fields, positions)
+        save_index(args.json, docs, index, doc_lengths, fields, positions)
+        print(f"Documents: {len(docs)}, terms: {len(index)}, {time.perf_counter() - start:.2f}s")
+        saved = [args.output, args.json]
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"Peak RSS: {peak} MB")
+    for path in saved:
+        print(f"Saved: {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Query instrumentation: per-stage timings, postings scanned and result counts.
+
+An Instrumentation object is off by default and can be switched on (and
+reconfigured) at runtime with configure(). While it is on, each traced query
+gets a QueryTrace; code on the query path times its stages with
+
+    with stage("preprocess"):
+        ...
+
+which is a no-op when no trace is active. Finished traces are appended as
+one JSON line to log_path, and feed rolling windows from which snapshot()
+reports p50/p95/p99 per query kind and per stage. With profile on, a sample
+of queries runs under cProfile; the profile of any that exceed slow_ms is
+handed to profile_hook (by default written to profile_dir as a .prof file).
+"""
+import cProfile
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+from .topk import TopKStats
+
+DEFAULT_WINDOW = 2048
+
+_PROFILE_SEQ = itertools.count(1)
+
+@dataclass
+class QueryTrace:
+    query: str
+    kind: str = "search"
+    stages: Dict[str, float] = field(default_factory=dict)
+    stats: TopKStats = field(default_factory=TopKStats)
+    results: int = 0
+    cached: bool = False
+    total_ms: float = 0.0
+    profile_path: Optional[str] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def as_record(self) -> Dict:
+        return {
+            "ts": round(time.time(), 3),
+            "kind": self.kind,
+            "query": self.query,
+            "total_ms": round(self.total_ms, 3),
+            "stages_ms": {k: round(v, 3) for k, v in self.stages.items()},
+            "postings_scanned": self.stats.postings_evaluated,
+            "postings_skipped": self.stats.postings_skipped,
+            "docs_scored": self.stats.docs_scored,
+            "results": self.results,
+            "cached": self.cached,
+            "profile": self.profile_path,
+        }
+
+_CURRENT: ContextVar[Optional[QueryTrace]] = ContextVar("query_trace", default=None)
+
+def current_trace() -> Optional[QueryTrace]:
+    return _CURRENT.get()
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block into the active trace's `name` stage (no-op without one)."""
+    trace = _CURRENT.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+def _percentiles(values: Deque[float]) -> Dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+
+    def at(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+
+    return {"count": len(ordered), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1], 3)}
+
+def write_profile(directory: str) -> Callable[[QueryTrace, cProfile.Profile], str]:
+    """Profile hook that dumps each slow query's profile into directory."""
+    def hook(trace: QueryTrace, profiler: cProfile.Profile) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_PROFILE_SEQ)}-"
+                                       f"{trace.kind}-{int(trace.total_ms)}ms.prof")
+        profiler.dump_stats(path)
+        return path
+    return hook
+
+def _flag(value) -> bool:
+    # Strict: bool("false") would be True.
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return value
+
+def _milliseconds(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"expected a non-negative number, got {value!r}")
+    return float(value)
+
+def _fraction(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+        raise ValueError(f"expected a number between 0 and 1, got {value!r}")
+    return float(value)
+
+class Instrumentation:
+    # Options configure() changes at runtime. log_path and profile_dir name
+    # files to write, so they are only set by the constructor.
+    OPTIONS = {
+        "enabled": _flag,
+        "slow_ms": _milliseconds,
+        "profile": _flag,
+        "profile_sample": _fraction,
+    }
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        log_path: Optional[str] = None,
+        slow_ms: float = 250.0,
+        profile: bool = False,
+        profile_sample: float = 0.1,
+        profile_dir: Optional[str] = None,
+        window: int = DEFAULT_WINDOW,
+        profile_hook: Optional[Callable[[QueryTrace, cProfile.Profile], Optional[str]]] = None,
+    ):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.slow_ms = slow_ms
+        self.profile = profile
+        self.profile_sample = profile_sample
+        self.profile_dir = profile_dir
+        self.profile_hook = profile_hook
+        self.window = window
+        self._lock = threading.Lock()
+        self._latency: Dict[str, Deque[float]] = {}
+        self._stages: Dict[str, Deque[float]] = {}
+        self._count = 0
+        self._slow = 0
+
+    def configure(self, **options) -> None:
+        """Change options at runtime (see OPTIONS); unknown names or bad values raise ValueError."""
+        unknown = set(options) - set(self.OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown instrumentation options: {', '.join(sorted(unknown))}")
+        values = {}
+        for name, value in options.items():
+            try:
+                values[name] = self.OPTIONS[name](value)
+            except ValueError as exc:
+                raise ValueError(f"bad instrumentation option {name}: {exc}") from None
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+
+    def options(self) -> Dict:
+        return {name: getattr(self, name) for name in (*self.OPTIONS, "log_path", "profile_dir")}
+
+    @contextmanager
+    def trace(self, query: str, kind: str = "search") -> Iterator[Optional[QueryTrace]]:
+        """Trace the block as one query; yields None (and records nothing) when disabled."""
+        if not self.enabled:
+            yield None
+            return
+        trace = QueryTrace(query, kind)
+        token = _CURRENT.set(trace)
+        profiler = None
+        if self.profile and random.random() < self.profile_sample:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield trace
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            trace.total_ms = (time.perf_counter() - start) * 1000
+            _CURRENT.reset(token)
+            if profiler is not None and trace.total_ms >= self.slow_ms:
+                hook = self.profile_hook or (write_profile(self.profile_dir) if self.profile_dir else None)
+                if hook is not None:
+                    try:
+                        trace.profile_path = hook(trace, profiler)
+                    except OSError:
+                        # Instrumentation must never fail the query it observes.
+                        pass
+            self.record(trace)
+
+    def record(self, trace: QueryTrace) -> None:
+        with self._lock:
+            self._count += 1
+            if trace.total_ms >= self.slow_ms:
+                self._slow += 1
+            self._latency.setdefault(trace.kind, deque(maxlen=self.window)).append(trace.total_ms)
+            for name, ms in trace.stages.items():
+                self._stages.setdefault(name, deque(maxlen=self.window)).append(ms)
+        # Outside the lock: a slow disk must not stall other requests' record().
+        # Each trace is one write() to a file opened for append.
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.as_record(), ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+    def snapshot(self) -> Dict:
+        """Counters and rolling latency percentiles (ms) over the last `window` queries."""
+        with self._lock:
+            return {
+                "options": self.options(),
+                "queries": self._count,
+                "slow_queries": self._slow,
+                "window": self.window,
+                "latency_ms": {kind: _percentiles(v) for kind, v in self._latency.items()},
+                "stages_ms": {name: _percentiles(v) for name, v in self._stages.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latency.clear()
+            self._stages.clear()
+            self._count = 0
+            self._slow = 0
+
+def format_trace(trace: QueryTrace) -> List[str]:
+    """Human-readable stage breakdown of one trace, for the CLI."""
+    lines = [f"total {trace.total_ms:.2f} ms, {trace.results} results"
+             f"{' (cached)' if trace.cached else ''}, {trace.stats.postings_evaluated} postings scanned"]
+    for name, ms in trace.stages.items():
+        lines.append(f"  {name:12s} {ms:8.3f} ms")
+    return lines
@@ -14,8 +14,13 @@ def is_person_profile(url: str) -> bool:
         return False
     return not url.rstrip("/").endswith("/en/persons")
 
+def make_soup(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "lxml")
+
 def extract_links(base_url: str, html: str) -> List[str]:
-    soup = BeautifulSoup(html, "lxml")
+    return links_from_soup(base_url, make_soup(html))
+
+def links_from_soup(base_url: str, soup: BeautifulSoup) -> List[str]:
     urls: List[str] = []
     for a in soup.select("a[href]"):
         href = (a.get("href") or "").strip()
@@ -62,17 +67,23 @@ def _extract_author_names_from_jsonld(obj: Any, names: List[str]) -> None:
     if isinstance(obj, str):
         names.append(obj)
 
+def _first_year(soup: BeautifulSoup) -> str:
+    # Same result as YEAR_RE.search(soup.get_text(" ", strip=True)) (a year
+    # cannot span two strings), without joining the whole page first.
+    for text in soup.stripped_strings:
+        m = YEAR_RE.search(text)
+        if m:
+            return m.group(0)
+    return ""
+
 def parse_publication_page(url: str, html: str) -> Dict:
-    soup = BeautifulSoup(html, "lxml")
+    return publication_from_soup(url, make_soup(html))
 
+def publication_from_soup(url: str, soup: BeautifulSoup) -> Dict:
     title = _txt(soup.find("h1")) or _meta_content(soup, "citation_title") or _meta_content(soup, "og:title") or _txt(soup.find("title"))
 
-    page_text = soup.get_text(" ", strip=True)
-    year = ""
-    m = YEAR_RE.search(page_text)
-    if m:
-        year = m.group(0)
-    else:
+    year = _first_year(soup)
+    if not year:
         meta_date = _meta_content(soup, "citation_publication_date") or _meta_content(soup, "citation_date")
         m2 = YEAR_RE.search(meta_date)
         if m2:
@@ -147,7 +158,9 @@ def parse_publication_page(url: str, html: str) -> Dict:
     }
 
 def parse_list_page_for_publications(base_url: str, html: str) -> List[Dict]:
-    soup = BeautifulSoup(html, "lxml")
+    return list_publications_from_soup(base_url, make_soup(html))
+
+def list_publications_from_soup(base_url: str, soup: BeautifulSoup) -> List[Dict]:
     pubs = []
     seen = set()
 
@@ -172,3 +185,16 @@ def parse_list_page_for_publications(base_url: str, html: str) -> List[Dict]:
         seen.add(absu)
 
     return pubs
+
+def analyze_page(url: str, html: str, parse_publication: bool = True) -> Dict:
+    """
+    Parse a fetched page once and return everything the crawler needs:
+    {"links", "list_publications", "publication"}. "publication" is None when
+    parse_publication is False.
+    """
+    soup = make_soup(html)
+    return {
+        "links": links_from_soup(url, soup),
+        "list_publications": list_publications_from_soup(url, soup),
+        "publication": publication_from_soup(url, soup) if parse_publication else None,
+    }
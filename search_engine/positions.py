@@ -0,0 +1,220 @@
+"""
+Optional positional postings, phrase queries and a proximity boost.
+
+Positions count every token of doc_text (stopwords and one-letter tokens
+included, though only indexed terms are stored), so "university of oxford"
+matches the phrase with its stopword in place. Each text field starts
+FIELD_GAP positions after the previous one, so phrases never span two
+fields. Positions are stored gap-encoded: [first, p2 - p1, p3 - p2, ...].
+
+A payload built with positions has payload["positions"][term] ->
+{doc id: gaps} and payload["field_starts"][doc id] -> the first position of
+each of TEXT_FIELDS, so a phrase can be kept to one field without
+re-tokenizing the document. Phrases ("machine learning") filter the candidates by
+positional intersection; the proximity boost rewards documents where
+consecutive query terms occur close together.
+"""
+import re
+import sys
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .fields import TEXT_FIELDS
+from .preprocess import STOPWORDS, tokenize
+
+POSITIONS = "positions"
+FIELD_STARTS = "field_starts"
+FIELD_GAP = 100
+# Documents from the top of the bag-of-words ranking reranked by proximity.
+PROXIMITY_WINDOW = 100
+DEFAULT_PROXIMITY_WEIGHT = 1.0
+
+_PHRASE_RE = re.compile(r'"([^"]*)"')
+
+def encode_gaps(positions: Sequence[int]) -> List[int]:
+    prev = 0
+    out = []
+    for p in positions:
+        out.append(p - prev)
+        prev = p
+    return out
+
+def decode_gaps(gaps: Iterable[int]) -> List[int]:
+    out = []
+    p = 0
+    for gap in gaps:
+        p += gap
+        out.append(p)
+    return out
+
+def _indexed(token: str) -> bool:
+    # Same filter as normalize_tokens.
+    return len(token) > 1 and token not in STOPWORDS
+
+def positioned_terms(text: str, start: int = 0) -> List[Tuple[str, int]]:
+    """(term, position) for the indexed terms of text; positions count every token."""
+    return [(t, start + i) for i, t in enumerate(tokenize(text)) if _indexed(t)]
+
+def doc_positions(d: Dict) -> Dict[str, List[int]]:
+    # Late import: indexer imports this module.
+    from .indexer import doc_field_texts
+    positions: Dict[str, List[int]] = {}
+    start = 0
+    for _, text in doc_field_texts(d):
+        tokens = tokenize(text)
+        for i, t in enumerate(tokens):
+            if _indexed(t):
+                positions.setdefault(t, []).append(start + i)
+        start += len(tokens) + FIELD_GAP
+    return positions
+
+def field_spans(d: Dict) -> Dict[str, Tuple[int, int]]:
+    """[start, end) positions of each text field of d, counted as in doc_positions."""
+    from .indexer import doc_field_texts
+    spans = {}
+    start = 0
+    for name, text in doc_field_texts(d):
+        end = start + len(tokenize(text))
+        spans[name] = (start, end)
+        start = end + FIELD_GAP
+    return spans
+
+def doc_field_starts(d: Dict) -> List[int]:
+    """First position of each of TEXT_FIELDS in d, as stored under FIELD_STARTS."""
+    spans = field_spans(d)
+    return [spans[name][0] for name in TEXT_FIELDS]
+
+def field_span(starts: Sequence[int], name: str) -> Tuple[int, int]:
+    """[start, end) of field name given a document's stored field starts."""
+    i = TEXT_FIELDS.index(name)
+    # Positions in the gap before the next field never occur.
+    return starts[i], starts[i + 1] if i + 1 < len(starts) else sys.maxsize
+
+def build_positions(docs: Dict[str, Dict]) -> Dict[str, Dict[str, List[int]]]:
+    """Gap-encoded positions per term and document, in build_inverted_index order."""
+    out: Dict[str, Dict[str, List[int]]] = {}
+    for doc_id, d in docs.items():
+        for term, plist in doc_positions(d).items():
+            out.setdefault(term, {})[doc_id] = encode_gaps(plist)
+    return out
+
+def build_field_starts(docs: Dict[str, Dict]) -> Dict[str, List[int]]:
+    return {doc_id: doc_field_starts(d) for doc_id, d in docs.items()}
+
+def parse_phrases(query: str) -> List[List[Tuple[str, int]]]:
+    """Quoted phrases of two or more indexed terms, as (term, offset in phrase)."""
+    phrases = []
+    for text in _PHRASE_RE.findall(query):
+        terms = positioned_terms(text)
+        if len(terms) > 1:
+            phrases.append(terms)
+    return phrases
+
+class QueryPositions(Mapping):
+    """Memo over payload["positions"] for one query, so each term is read once."""
+
+    def __init__(self, positions: Mapping):
+        self._positions = positions
+        self._cache: Dict[str, Optional[Mapping]] = {}
+
+    def __getitem__(self, term: str) -> Mapping:
+        if term not in self._cache:
+            self._cache[term] = self._positions.get(term)
+        value = self._cache[term]
+        if value is None:
+            raise KeyError(term)
+        return value
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+def _doc_positions(positions: Mapping, term: str) -> Mapping:
+    return positions.get(term) or {}
+
+def phrase_matches(
+    positions: Mapping,
+    phrase: List[Tuple[str, int]],
+    candidates: Optional[set] = None,
+    within: Optional[Callable[[object], Tuple[int, int]]] = None,
+) -> set:
+    """
+    Documents containing the phrase: intersect the postings, then the aligned
+    positions. within(doc id) -> (start, end) keeps only occurrences starting
+    in that span (e.g. one field; phrases never cross fields).
+    """
+    per_term = [(_doc_positions(positions, term), offset) for term, offset in phrase]
+    # Rarest term first keeps the candidate set small.
+    per_term.sort(key=lambda x: len(x[0]))
+    docs = set(per_term[0][0]) if candidates is None else candidates & set(per_term[0][0])
+    for plist, _ in per_term[1:]:
+        docs.intersection_update(plist.keys())
+        if not docs:
+            return docs
+    matched = set()
+    for doc_id in docs:
+        starts = None
+        for plist, offset in per_term:
+            aligned = {p - offset for p in decode_gaps(plist[doc_id])}
+            starts = aligned if starts is None else starts & aligned
+            if not starts:
+                break
+        if starts and within is not None:
+            lo, hi = within(doc_id)
+            starts = [p for p in starts if lo <= p < hi]
+        if starts:
+            matched.add(doc_id)
+    return matched
+
+def min_distance(a: Sequence[int], b: Sequence[int]) -> int:
+    """Smallest |x - y| over x in a, y in b; both sorted."""
+    i = j = 0
+    best = -1
+    while i < len(a) and j < len(b):
+        d = a[i] - b[j]
+        if best < 0 or abs(d) < best:
+            best = abs(d)
+        if d < 0:
+            i += 1
+        else:
+            j += 1
+    return best
+
+def _pairs(query_terms: List[str]) -> List[Tuple[str, str]]:
+    return [(a, b) for a, b in zip(query_terms, query_terms[1:]) if a != b]
+
+def proximity_bound(query_terms: List[str], idf: Mapping, weight: float = DEFAULT_PROXIMITY_WEIGHT) -> float:
+    """The largest bonus proximity_rerank() can add to one document (every pair adjacent)."""
+    if weight <= 0:
+        return 0.0
+    return sum(weight * min(idf.get(a, 0.0), idf.get(b, 0.0)) for a, b in _pairs(query_terms))
+
+def proximity_rerank(
+    ranked: List[Tuple[object, float]],
+    query_terms: List[str],
+    positions: Mapping,
+    idf: Mapping,
+    weight: float = DEFAULT_PROXIMITY_WEIGHT,
+) -> List[Tuple[object, float]]:
+    """
+    Add weight * min(idf) / distance for each pair of consecutive query terms
+    found in a document, and re-sort. query_terms are unstemmed: positions
+    are stored for the indexed (unstemmed) terms.
+    """
+    pairs = _pairs(query_terms)
+    if not pairs or weight <= 0:
+        return ranked
+    lookup = {term: _doc_positions(positions, term) for pair in pairs for term in pair}
+    boosted = []
+    for doc_id, score in ranked:
+        bonus = 0.0
+        for a, b in pairs:
+            pa, pb = lookup[a].get(doc_id), lookup[b].get(doc_id)
+            if pa and pb:
+                distance = min_distance(decode_gaps(pa), decode_gaps(pb))
+                bonus += weight * min(idf.get(a, 0.0), idf.get(b, 0.0)) / max(distance, 1)
+        boosted.append((doc_id, score + bonus))
+    boosted.sort(key=lambda x: x[1], reverse=True)
+    return boosted
@@ -0,0 +1,137 @@
+"""
+LRU cache of search results.
+
+Entries are keyed on the normalised query (terms after preprocessing, field
+clauses and phrases) plus everything else that changes the ranking: the
+stemming flag, top_k, engine and weights. The cache belongs to one index at a
+time: a lookup for a different index generation (or, without a generation,
+a different payload object) empties it first, so results computed against an
+old index are never served after a reload.
+"""
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+from .bm25f import parse_query
+from .positions import parse_phrases
+from .preprocess import preprocess
+
+# Rough fixed cost of one entry (key tuple, OrderedDict slot, list and dicts).
+_ENTRY_OVERHEAD = 512
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+def query_key(
+    query: str,
+    top_k: int,
+    use_stemming: bool = False,
+    engine: str = "dict",
+    field_weights: Optional[Mapping[str, float]] = None,
+    proximity_weight: Optional[float] = None,
+    fuzzy: bool = True,
+) -> Tuple:
+    """Cache key: queries differing only in case, punctuation or stopwords share it."""
+    free_text, clauses = parse_query(query)
+    return (
+        tuple(preprocess(free_text, use_stemming=use_stemming)),
+        tuple((field, value.startswith('"'), tuple(preprocess(value))) for field, value in clauses),
+        tuple(tuple(p) for p in parse_phrases(free_text)),
+        bool(use_stemming),
+        top_k,
+        engine,
+        tuple(sorted(field_weights.items())) if field_weights else None,
+        proximity_weight,
+        bool(fuzzy),
+    )
+
+# A cached value is a result list, or a (results, next_cursor) page.
+Cached = Union[List[Dict], Tuple[List[Dict], Optional[str]]]
+
+def _result_size(results: Cached) -> int:
+    return _ENTRY_OVERHEAD + len(json.dumps(results, ensure_ascii=False, default=str))
+
+def _copy(results: Cached) -> Cached:
+    if isinstance(results, tuple):
+        return [dict(r) for r in results[0]], results[1]
+    return [dict(r) for r in results]
+
+class ResultCache:
+    """
+    Thread-safe LRU of result lists (or result pages), bounded by entry count and by the
+    approximate serialized size of the cached results (max_bytes).
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[Cached, int]]" = OrderedDict()
+        self._owner: Optional[Tuple] = None
+        self._payload: Optional[Mapping] = None
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def _bind(self, payload: Mapping, generation: Optional[int]) -> None:
+        # Holding the payload keeps id(payload) from being reused while cached.
+        owner = ("generation", generation) if generation is not None else ("payload", id(payload))
+        if owner != self._owner or (generation is None and payload is not self._payload):
+            if self._entries:
+                self._stats.invalidations += 1
+            self._entries.clear()
+            self._stats.bytes = 0
+            self._owner = owner
+            self._payload = payload if generation is None else None
+
+    def get(self, payload: Mapping, generation: Optional[int], key: Tuple) -> Optional[Cached]:
+        with self._lock:
+            self._bind(payload, generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return _copy(entry[0])
+
+    def put(self, payload: Mapping, generation: Optional[int], key: Tuple, results: Cached) -> None:
+        size = _result_size(results)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._bind(payload, generation)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stats.bytes -= old[1]
+            self._entries[key] = (_copy(results), size)
+            self._stats.bytes += size
+            while len(self._entries) > self.max_entries or self._stats.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._stats.bytes -= evicted
+                self._stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.bytes = 0
+            self._owner = None
+            self._payload = None
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**{**self._stats.as_dict(), "entries": len(self._entries)})
@@ -1,19 +1,536 @@
-from typing import Dict, List
+import base64
+import json
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
 from .preprocess import preprocess
 from .bm25 import bm25_score
+from .binindex import shared_postings
+from .array_index import ArrayIndex, array_index_for
+from .bm25f import bm25f_scores, bm25f_search, parse_query
+from .fields import stemmed_payload
+from .fuzzy import expand_terms
+from .instrument import current_trace, stage
+from .positions import (
+    DEFAULT_PROXIMITY_WEIGHT, POSITIONS, PROXIMITY_WINDOW, QueryPositions, parse_phrases, phrase_matches,
+    proximity_bound, proximity_rerank,
+)
+from .result_cache import ResultCache, query_key
+from .topk import TopKStats, maxscore_top_k
 
-def search(query: str, payload: Dict, top_k: int = 10, use_stemming: bool = False) -> List[Dict]:
-    docs: Dict[str, Dict] = payload.get("docs", {})
-    index: Dict[str, Dict[str, int]] = payload.get("index", {})
-    doc_lengths: Dict[str, int] = payload.get("doc_lengths", {})
-    idf: Dict[str, float] = payload.get("idf", {})
+ENGINES = ("dict", "numpy", "maxscore", "bm25f")
+
+@dataclass
+class SearchPage:
+    results: List[Dict]
+    next_cursor: Optional[str] = None
+
+@dataclass
+class BatchResult:
+    query: str
+    page: SearchPage
+    seconds: float
+
+def search(
+    query: str,
+    payload: Dict,
+    top_k: int = 10,
+    use_stemming: bool = False,
+    engine: str = "dict",
+    stats: Optional[TopKStats] = None,
+    field_weights: Optional[Dict[str, float]] = None,
+    proximity_weight: float = DEFAULT_PROXIMITY_WEIGHT,
+    cache: Optional[ResultCache] = None,
+    generation: Optional[int] = None,
+    fuzzy: bool = True,
+) -> List[Dict]:
+    """
+    Top k results for query. With a cache, repeated queries against the same
+    index generation (or the same payload when generation is None) are served
+    from it; stats then only counts the work of cache misses. With fuzzy,
+    query terms missing from the index are expanded to nearby vocabulary
+    terms (see fuzzy.py); phrase and field queries are never expanded.
+    """
+    stats = _traced_stats(stats)
+    if cache is None:
+        return _search(query, payload, top_k, use_stemming, engine, stats, field_weights, proximity_weight, fuzzy)
+    key = query_key(query, top_k, use_stemming, engine, field_weights, proximity_weight, fuzzy)
+    results = _cache_get(cache, payload, generation, key)
+    if results is None:
+        results = _search(query, payload, top_k, use_stemming, engine, stats, field_weights, proximity_weight,
+                          fuzzy)
+        cache.put(payload, generation, key, results)
+    return results
+
+def search_page(
+    query: str,
+    payload: Dict,
+    page_size: int = 10,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    use_stemming: bool = False,
+    engine: str = "dict",
+    stats: Optional[TopKStats] = None,
+    field_weights: Optional[Dict[str, float]] = None,
+    proximity_weight: float = DEFAULT_PROXIMITY_WEIGHT,
+    cache: Optional[ResultCache] = None,
+    generation: Optional[int] = None,
+    fuzzy: bool = True,
+) -> SearchPage:
+    """
+    One page of results for query, in the same order as search().
+
+    Without a cursor the page starts at offset. next_cursor (None on the last
+    page) encodes the score and doc id of the page's last result; passing it
+    back returns the page after it, using a bounded selection over the scores
+    of the results after the cursor rather than ranking everything before it.
+    A cursor that does not decode starts again from the first page.
+    """
+    stats = _traced_stats(stats)
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            after = None
+    if cache is None:
+        return _search_page(query, payload, page_size, after, offset, use_stemming, engine, stats, field_weights,
+                            proximity_weight, fuzzy)
+    key = query_key(query, page_size, use_stemming, engine, field_weights, proximity_weight, fuzzy) + (
+        "page", after, 0 if after else offset)
+    hit = _cache_get(cache, payload, generation, key)
+    if hit is None:
+        page = _search_page(query, payload, page_size, after, offset, use_stemming, engine, stats, field_weights,
+                            proximity_weight, fuzzy)
+        cache.put(payload, generation, key, (page.results, page.next_cursor))
+        return page
+    return SearchPage(*hit)
+
+def search_batch(
+    queries: Sequence[str],
+    payload: Dict,
+    page_size: int = 10,
+    use_stemming: bool = False,
+    engine: str = "dict",
+    stats: Optional[TopKStats] = None,
+    field_weights: Optional[Dict[str, float]] = None,
+    proximity_weight: float = DEFAULT_PROXIMITY_WEIGHT,
+    cache: Optional[ResultCache] = None,
+    generation: Optional[int] = None,
+    fuzzy: bool = True,
+) -> List[BatchResult]:
+    """
+    First result page of each query, in order, with its own wall time.
+    Postings decoded for one query of the batch are reused by the rest, and
+    queries that normalise to the same cache key are answered once.
+    """
+    answered: Dict[Tuple, SearchPage] = {}
+    out: List[BatchResult] = []
+    with shared_postings():
+        for query in queries:
+            start = time.perf_counter()
+            key = query_key(query, page_size, use_stemming, engine, field_weights, proximity_weight, fuzzy)
+            page = answered.get(key)
+            if page is None:
+                page = answered[key] = search_page(
+                    query, payload, page_size, use_stemming=use_stemming, engine=engine, stats=stats,
+                    field_weights=field_weights, proximity_weight=proximity_weight, cache=cache,
+                    generation=generation, fuzzy=fuzzy,
+                )
+            else:
+                page = SearchPage([dict(r) for r in page.results], page.next_cursor)
+            out.append(BatchResult(query, page, time.perf_counter() - start))
+    return out
 
-    q_terms = preprocess(query, use_stemming=use_stemming)
-    scores = bm25_score(q_terms, index=index, doc_lengths=doc_lengths, idf=idf)
+def _traced_stats(stats: Optional[TopKStats]) -> Optional[TopKStats]:
+    # A traced query counts its postings into the trace unless given stats.
+    if stats is None:
+        trace = current_trace()
+        if trace is not None:
+            return trace.stats
+    return stats
 
-    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+def _cache_get(cache: ResultCache, payload: Dict, generation: Optional[int], key: Tuple):
+    with stage("cache"):
+        hit = cache.get(payload, generation, key)
+    trace = current_trace()
+    if trace is not None:
+        trace.cached = hit is not None
+        if hit is not None:
+            trace.results = len(hit[0] if isinstance(hit, tuple) else hit)
+    return hit
+
+def encode_cursor(score: float, doc_id) -> str:
+    raw = json.dumps([score, doc_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, object]:
+    """(score, doc id) of an encode_cursor() string; ValueError if it is malformed."""
+    try:
+        score, doc_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        score = float(score)
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f"invalid cursor: {cursor!r}") from exc
+    if not isinstance(doc_id, (str, int)):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return score, doc_id
+
+def _results(payload: Dict, ranked: List[Tuple[object, float]]) -> List[Dict]:
+    docs: Dict[str, Dict] = payload.get("docs", {})
     results = []
-    for doc_id, score in ranked:
-        d = docs.get(doc_id, {})
-        results.append({"score": round(float(score), 4), **d})
+    with stage("fetch"):
+        for doc_id, score in ranked:
+            d = docs.get(doc_id, {})
+            results.append({"score": round(float(score), 4), **d})
+    trace = current_trace()
+    if trace is not None:
+        trace.results = len(results)
     return results
+
+def _search(
+    query: str,
+    payload: Dict,
+    top_k: int,
+    use_stemming: bool,
+    engine: str,
+    stats: Optional[TopKStats],
+    field_weights: Optional[Dict[str, float]],
+    proximity_weight: float,
+    fuzzy: bool = True,
+) -> List[Dict]:
+    return _results(payload, _rank(query, payload, top_k, use_stemming, engine, stats, field_weights,
+                                   proximity_weight, fuzzy))
+
+def _search_page(
+    query: str,
+    payload: Dict,
+    page_size: int,
+    after: Optional[Tuple[float, object]],
+    offset: int,
+    use_stemming: bool,
+    engine: str,
+    stats: Optional[TopKStats],
+    field_weights: Optional[Dict[str, float]],
+    proximity_weight: float,
+    fuzzy: bool = True,
+) -> SearchPage:
+    # One result past the page tells whether there is a next page.
+    if after is None:
+        offset = max(0, offset)
+        ranked = _rank(query, payload, offset + page_size + 1, use_stemming, engine, stats, field_weights,
+                       proximity_weight, fuzzy)[offset:]
+    else:
+        ranked = _rank_after(query, payload, page_size + 1, after, use_stemming, engine, stats, field_weights,
+                             proximity_weight, fuzzy)
+    next_cursor = None
+    if len(ranked) > page_size > 0:
+        ranked = ranked[:page_size]
+        next_cursor = encode_cursor(float(ranked[-1][1]), ranked[-1][0])
+    return SearchPage(_results(payload, ranked), next_cursor)
+
+def _uses_fields(query: str, engine: str) -> bool:
+    # Field clauses (author:smith) need the per-field postings; stemming
+    # does not apply there.
+    return engine == "bm25f" or bool(parse_query(query)[1])
+
+def _query_positions(payload: Dict) -> Optional[QueryPositions]:
+    # Indexes built with positions support "quoted phrases" and rerank the
+    # top of the ranking by term proximity; others treat both as bag of words.
+    positions = payload.get(POSITIONS)
+    return QueryPositions(positions) if positions is not None else None
+
+def _phrase_matches(positions: QueryPositions, query: str) -> Optional[set]:
+    matched = None
+    for phrase in parse_phrases(query):
+        matched = phrase_matches(positions, phrase, matched)
+    return matched
+
+def _expansions(query: str, payload: Dict, index: Mapping, use_stemming: bool) -> Dict[str, float]:
+    with stage("fuzzy"):
+        return expand_terms(preprocess(query), payload, index, use_stemming)
+
+def _count_scanned(stats: Optional[TopKStats], index: Mapping, q_terms: List[str], scored: int) -> None:
+    if stats is not None:
+        scanned = sum(len(index.get(t) or {}) for t in q_terms)
+        stats.postings_total += scanned
+        stats.postings_evaluated += scanned
+        stats.docs_scored += scored
+
+def _rank(
+    query: str,
+    payload: Dict,
+    top_k: int,
+    use_stemming: bool,
+    engine: str,
+    stats: Optional[TopKStats],
+    field_weights: Optional[Dict[str, float]],
+    proximity_weight: float,
+    fuzzy: bool = True,
+) -> List[Tuple[object, float]]:
+    """Top k (doc id, score) for query."""
+    if _uses_fields(query, engine):
+        with stage("score"):
+            return bm25f_search(query, payload, top_k, field_weights=field_weights, stats=stats)
+
+    # Stemmed queries score against the stemmed field built at index time.
+    field = stemmed_payload(payload) if use_stemming else payload
+    index: Dict[str, Dict[str, int]] = field.get("index", {})
+    doc_lengths: Dict[str, int] = field.get("doc_lengths", {})
+    idf: Dict[str, float] = field.get("idf", {})
+
+    with stage("preprocess"):
+        q_terms = preprocess(query, use_stemming=use_stemming)
+    positions = _query_positions(payload)
+    phrases = positions is not None and bool(parse_phrases(query))
+    proximity = positions is not None and proximity_weight > 0 and len(q_terms) > 1
+    depth = max(top_k, PROXIMITY_WINDOW) if proximity else top_k
+    # A document scoring more than the largest bonus below the k-th best
+    # cannot be reranked into the top k, so the window stops there.
+    margin = proximity_bound(preprocess(query), payload.get("idf", {}), proximity_weight) + 1e-9 if proximity else 0.0
+    expansions = _expansions(query, payload, index, use_stemming) if fuzzy and not phrases else {}
+
+    if phrases or expansions:
+        # Phrase candidates and weighted fuzzy expansions are scored exhaustively.
+        matched = None
+        if phrases:
+            with stage("phrase"):
+                matched = _phrase_matches(positions, query)
+        terms = q_terms + list(expansions)
+        with stage("score"):
+            scores = bm25_score(
+                terms, index=index, doc_lengths=doc_lengths, idf=idf, avgdl=field.get("avgdl"),
+                candidates=matched, term_weights=expansions,
+            )
+        with stage("sort"):
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:depth]
+        _count_scanned(stats, index, terms, len(scores))
+    elif engine == "maxscore":
+        with stage("score"):
+            ranked = maxscore_top_k(array_index_for(field), q_terms, depth, stats=stats,
+                                    floor_rank=top_k if proximity else 0, margin=margin)
+    elif engine == "numpy":
+        arrays = array_index_for(field)
+        with stage("score"):
+            ranked = arrays.top_k(q_terms, depth)
+        if stats is not None:
+            scanned = sum(len(p[0]) for p in map(arrays.postings, q_terms) if p is not None)
+            stats.postings_total += scanned
+            stats.postings_evaluated += scanned
+    else:
+        with stage("score"):
+            scores = bm25_score(q_terms, index=index, doc_lengths=doc_lengths, idf=idf, avgdl=field.get("avgdl"))
+        with stage("sort"):
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:depth]
+        _count_scanned(stats, index, q_terms, len(scores))
+
+    if proximity:
+        # Only the top PROXIMITY_WINDOW are reranked, however deep the ranking,
+        # so every top_k (and cursor paging) sees the same order. Of those,
+        # only the ones within margin of the k-th best can reach the top k.
+        with stage("rerank"):
+            window = ranked[:PROXIMITY_WINDOW]
+            if top_k < len(window):
+                floor = window[top_k - 1][1] - margin
+                window = [r for r in window if r[1] >= floor]
+            head = proximity_rerank(window, preprocess(query), positions, payload.get("idf", {}), proximity_weight)
+            ranked = head + ranked[PROXIMITY_WINDOW:]
+    return ranked[:top_k]
+
+class _Scored:
+    """
+    Every matching document's score, in the order bm25_score inserts them:
+    the tie-break order of every engine.
+    """
+
+    def __init__(self, scores: np.ndarray, key_at: Callable[[int], object],
+                 position_of: Callable[[object], Optional[int]]):
+        self.scores = scores
+        self.key_at = key_at
+        self.position_of = position_of
+
+    @classmethod
+    def from_dict(cls, scores: Dict) -> "_Scored":
+        keys = list(scores)
+        at = {doc_id: i for i, doc_id in enumerate(keys)}
+        values = np.fromiter(scores.values(), dtype=np.float64, count=len(keys))
+        return cls(values, keys.__getitem__, at.get)
+
+    @classmethod
+    def from_arrays(cls, arrays: ArrayIndex, q_terms: List[str]) -> "_Scored":
+        dense, order = arrays.score(q_terms)
+
+        def position_of(doc_id) -> Optional[int]:
+            num = arrays.doc_num(doc_id)
+            hit = np.flatnonzero(order == num) if num is not None else ()
+            return int(hit[0]) if len(hit) else None
+
+        return cls(dense[order], lambda i: arrays.doc_keys[order[i]], position_of)
+
+def _best(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Positions of the k best scores (among mask), ties to the earlier position."""
+    idx = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+    if k <= 0:
+        return idx[:0]
+    if len(idx) > k:
+        # Everything tied with the k-th best is kept for the stable sort.
+        s = scores[idx]
+        kth = np.partition(s, len(idx) - k)[len(idx) - k]
+        idx = idx[s >= kth]
+    return idx[np.argsort(-scores[idx], kind="stable")][:k]
+
+def _rank_after(
+    query: str,
+    payload: Dict,
+    k: int,
+    after: Tuple[float, object],
+    use_stemming: bool,
+    engine: str,
+    stats: Optional[TopKStats],
+    field_weights: Optional[Dict[str, float]],
+    proximity_weight: float,
+    fuzzy: bool = True,
+) -> List[Tuple[object, float]]:
+    """
+    The k (doc id, score) ranked after the cursor `after` in the order of
+    _rank(). Every match is scored (except by maxscore, see
+    _maxscore_after), but only results past the cursor are selected, with a
+    partial sort bounded by k. The proximity-reranked head (the top
+    PROXIMITY_WINDOW by BM25) always ranks before the rest.
+    """
+    cursor_score, cursor_id = after
+    with stage("preprocess"):
+        q_terms = preprocess(query, use_stemming=use_stemming)
+    positions = None
+    if _uses_fields(query, engine):
+        with stage("score"):
+            scored = _Scored.from_dict(bm25f_scores(query, payload, field_weights, stats=stats))
+    else:
+        field = stemmed_payload(payload) if use_stemming else payload
+        index = field.get("index", {})
+        positions = _query_positions(payload)
+        phrases = positions is not None and bool(parse_phrases(query))
+        expansions = _expansions(query, payload, index, use_stemming) if fuzzy and not phrases else {}
+        if phrases or expansions:
+            matched = None
+            if phrases:
+                with stage("phrase"):
+                    matched = _phrase_matches(positions, query)
+            terms = q_terms + list(expansions)
+            with stage("score"):
+                scores = bm25_score(
+                    terms, index=index, doc_lengths=field.get("doc_lengths", {}), idf=field.get("idf", {}),
+                    avgdl=field.get("avgdl"), candidates=matched, term_weights=expansions,
+                )
+            _count_scanned(stats, index, terms, len(scores))
+            scored = _Scored.from_dict(scores)
+        elif engine == "maxscore":
+            return _maxscore_after(query, payload, array_index_for(field), q_terms, k, after, positions, stats,
+                                   proximity_weight)
+        elif engine == "dict":
+            with stage("score"):
+                scores = bm25_score(
+                    q_terms, index=index, doc_lengths=field.get("doc_lengths", {}), idf=field.get("idf", {}),
+                    avgdl=field.get("avgdl"),
+                )
+            _count_scanned(stats, index, q_terms, len(scores))
+            scored = _Scored.from_dict(scores)
+        else:
+            arrays = array_index_for(field)
+            with stage("score"):
+                scored = _Scored.from_arrays(arrays, q_terms)
+            if stats is not None:
+                scanned = sum(len(p[0]) for p in map(arrays.postings, q_terms) if p is not None)
+                stats.postings_total += scanned
+                stats.postings_evaluated += scanned
+                stats.docs_scored += len(scored.scores)
+
+    scores = scored.scores
+    rest = np.ones(len(scores), dtype=bool)
+    head: List[Tuple[object, float]] = []
+    if positions is not None and proximity_weight > 0 and len(q_terms) > 1:
+        with stage("rerank"):
+            top = _best(scores, PROXIMITY_WINDOW)
+            rest[top] = False
+            head = proximity_rerank(
+                [(scored.key_at(i), float(scores[i])) for i in top],
+                preprocess(query), positions, payload.get("idf", {}), proximity_weight,
+            )
+
+    at = next((i for i, (doc_id, _) in enumerate(head) if doc_id == cursor_id), None)
+    if at is not None:
+        head = head[at + 1:]
+    else:
+        pos = scored.position_of(cursor_id)
+        if pos is not None:
+            # Past the head: continue after the cursor's (score, position).
+            head = []
+            s = scores[pos]
+            rest &= (scores < s) | ((scores == s) & (np.arange(len(scores)) > pos))
+        else:
+            # The cursor's document no longer matches: continue below its score.
+            head = [h for h in head if h[1] < cursor_score]
+            rest &= scores < cursor_score
+
+    with stage("sort"):
+        ranked = head[:k]
+        ranked += [(scored.key_at(i), float(scores[i])) for i in _best(scores, k - len(ranked), rest)]
+    return ranked
+
+def _maxscore_after(
+    query: str,
+    payload: Dict,
+    arrays: ArrayIndex,
+    q_terms: List[str],
+    k: int,
+    after: Tuple[float, object],
+    positions: Optional[QueryPositions],
+    stats: Optional[TopKStats],
+    proximity_weight: float,
+) -> List[Tuple[object, float]]:
+    """_rank_after() for the maxscore engine, which keeps its pruning past the cursor."""
+    cursor_score, cursor_id = after
+    head: List[Tuple[object, float]] = []
+    if positions is not None and proximity_weight > 0 and len(q_terms) > 1:
+        with stage("rerank"):
+            head = proximity_rerank(
+                maxscore_top_k(arrays, q_terms, PROXIMITY_WINDOW, stats=stats),
+                preprocess(query), positions, payload.get("idf", {}), proximity_weight,
+            )
+    window = {doc_id for doc_id, _ in head}
+    at = next((i for i, (doc_id, _) in enumerate(head) if doc_id == cursor_id), None)
+    with stage("score"):
+        if at is not None:
+            head = head[at + 1:]
+            rest = [r for r in maxscore_top_k(arrays, q_terms, len(window) + k, stats=stats) if r[0] not in window]
+        else:
+            found, rest = _maxscore_below(arrays, q_terms, k, after, window, stats)
+            head = [] if found else [h for h in head if h[1] < cursor_score]
+    return (head + rest)[:k]
+
+def _maxscore_below(
+    arrays: ArrayIndex,
+    q_terms: List[str],
+    k: int,
+    after: Tuple[float, object],
+    skip: set,
+    stats: Optional[TopKStats],
+) -> Tuple[bool, List[Tuple[object, float]]]:
+    """
+    (whether the cursor's document still matches, the k results after it
+    outside skip). Only documents scoring at most the cursor's score are
+    ranked; the depth doubles while ties with the cursor fill it.
+    """
+    cursor_score, cursor_id = after
+    depth = k + len(skip) + 1
+    while True:
+        ranked = maxscore_top_k(arrays, q_terms, depth, stats=stats, ceiling=cursor_score)
+        at = next((i for i, (doc_id, _) in enumerate(ranked) if doc_id == cursor_id), None)
+        rest = ranked[at + 1:] if at is not None else [r for r in ranked if r[1] < cursor_score]
+        rest = [r for r in rest if r[0] not in skip]
+        if len(rest) >= k or len(ranked) < depth:
+            return at is not None, rest[:k]
+        depth *= 2
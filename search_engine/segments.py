@@ -0,0 +1,551 @@
+"""
+Segmented index.
+
+The index lives in a directory of immutable segments, each a binary index
+(seg_NNNNNN.bin + .fields) written once and never modified, its documents
+in stable id order so an id is found by binary search in the mmap.
+manifest.json lists the live segments in age order with their tombstones
+(ids deleted or superseded by a newer segment), so its size follows the
+number of segments and deletions, not the corpus. Every batch of changes
+writes one new small segment and atomically replaces the manifest; a tiered
+merge policy then folds small segments into larger ones (maybe_merge(),
+which the crawler runs once a batch is written).
+
+Readers open the segments named by one manifest and keep them, so they never
+wait for a writer: a merge builds its output next to the old segments and
+publishes it with a single manifest swap. Queries see the segments through
+payload-shaped views that merge postings (and text fields, the stemmed
+field and positions) across segments, skip tombstoned documents and compute
+idf/avgdl from the collection-wide statistics.
+"""
+import argparse
+import math
+import os
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from .binindex import BinaryIndex, fields_path_for, write_binary_index
+from .fields import STEMMED, TEXT_FIELDS
+from .incremental import StableIdReader
+from .indexer import build_indexes
+from .positions import FIELD_STARTS, POSITIONS, build_positions
+from .storage import load_json, save_json
+
+MANIFEST = "manifest.json"
+# Largest merge (in live documents) maybe_merge() runs right after a batch;
+# bigger ones are left to an explicit `python -m search_engine.segments --merge`.
+BATCH_MERGE_DOCS = 20000
+
+def manifest_path_for(directory: str) -> str:
+    return str(Path(directory) / MANIFEST)
+
+def _segment_path(directory: Path, name: str) -> Path:
+    return directory / f"{name}.bin"
+
+@dataclass(frozen=True)
+class TieredMergePolicy:
+    """
+    Segments are grouped into tiers by live document count: tier 0 holds
+    segments up to floor_docs, tier n those up to floor_docs * segments_per_tier**n.
+    When a tier holds segments_per_tier segments they are merged into one
+    segment of the next tier. A segment whose tombstones exceed
+    max_deleted_ratio is rewritten on its own to reclaim the space.
+    """
+    segments_per_tier: int = 4
+    floor_docs: int = 500
+    max_deleted_ratio: float = 0.3
+
+    def tier(self, live_docs: int) -> int:
+        if live_docs <= self.floor_docs:
+            return 0
+        return int(math.log(live_docs / self.floor_docs, self.segments_per_tier)) + 1
+
+    def find_merge(self, segments: List[Dict], max_docs: Optional[int] = None) -> Optional[List[str]]:
+        """Names of the segments to merge next, skipping merges of more than max_docs live documents."""
+        live = lambda e: e["n_docs"] - len(e["deleted"])
+        fits = lambda group: max_docs is None or sum(live(e) for e in group) <= max_docs
+        tiers: Dict[int, List[Dict]] = {}
+        for entry in segments:
+            tiers.setdefault(self.tier(live(entry)), []).append(entry)
+        for tier in sorted(tiers):
+            members = tiers[tier]
+            if len(members) >= self.segments_per_tier:
+                members = sorted(members, key=live)[: self.segments_per_tier]
+                if fits(members):
+                    return [e["name"] for e in members]
+        for entry in segments:
+            if entry["n_docs"] and len(entry["deleted"]) / entry["n_docs"] > self.max_deleted_ratio and fits([entry]):
+                return [entry["name"]]
+        return None
+
+def _main_index(payload: Mapping) -> Mapping:
+    return payload["index"]
+
+class _Segment:
+    __slots__ = ("name", "reader", "deleted")
+
+    def __init__(self, name: str, reader: StableIdReader, deleted: Set[str]):
+        self.name = name
+        self.reader = reader
+        self.deleted = deleted
+
+class SegmentedIndex(Mapping):
+    """A point-in-time view of the segments listed by one manifest."""
+
+    def __init__(self, directory: str, manifest: Dict):
+        self.directory = Path(directory)
+        self.generation: int = manifest.get("generation", 0)
+        self.segments: List[_Segment] = []
+        total_length = 0
+        n_docs = 0
+        try:
+            for entry in manifest.get("segments", []):
+                bidx = BinaryIndex(str(_segment_path(self.directory, entry["name"])))
+                self.segments.append(_Segment(entry["name"], StableIdReader(bidx), set(entry["deleted"])))
+                total_length += bidx.total_length - sum(self.segments[-1].reader.length(d) for d in entry["deleted"])
+                n_docs += bidx.n_docs - len(entry["deleted"])
+        except BaseException:
+            # Opening a later segment failed (e.g. a merge removed it): release the earlier ones.
+            self.close()
+            raise
+        self.n_docs = n_docs
+        self.total_length = total_length
+        self._df: Dict[str, int] = {}
+        self._stemmed_df: Dict[str, int] = {}
+        avgdl = total_length / float(n_docs) if n_docs else 0.0
+        self._views = {
+            "docs": _SegmentDocs(self),
+            "index": _SegmentPostings(self, _main_index, self._df),
+            "doc_lengths": _SegmentLengths(self),
+            "idf": _SegmentIdf(self, _main_index, self._df),
+            "avgdl": avgdl,
+        }
+        payloads = [seg.reader.payload for seg in self.segments]
+        if all("fields" in p for p in payloads):
+            self._views["fields"] = {
+                name: {
+                    "index": _SegmentPostings(self, lambda p, name=name: p["fields"][name]["index"], {}),
+                    "doc_lengths": _SegmentLengths(self, lambda p, name=name: p["fields"][name]["doc_lengths"]),
+                    "avgdl": self._field_total(name) / float(n_docs) if n_docs else 0.0,
+                }
+                for name in TEXT_FIELDS
+            }
+        if all(STEMMED in p for p in payloads):
+            stemmed = {"index": _SegmentPostings(self, lambda p: p[STEMMED]["index"], self._stemmed_df)}
+            stemmed["idf"] = _SegmentIdf(self, lambda p: p[STEMMED]["index"], self._stemmed_df)
+            self._views[STEMMED] = {**stemmed, "doc_lengths": self._views["doc_lengths"], "avgdl": avgdl}
+        if payloads and all(POSITIONS in p for p in payloads):
+            self._views[POSITIONS] = _SegmentPositions(self)
+        if payloads and all(FIELD_STARTS in p for p in payloads):
+            self._views[FIELD_STARTS] = _SegmentLengths(self, lambda p: p[FIELD_STARTS])
+
+    def __getitem__(self, key: str):
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def _field_total(self, name: str) -> int:
+        total = 0
+        for seg in self.segments:
+            bidx = seg.reader.payload
+            lengths = bidx["fields"][name]["doc_lengths"]
+            total += bidx.toc["fields"][name]["total_length"]
+            total -= sum(lengths[bidx.doc_number(d)] for d in seg.deleted if bidx.doc_number(d) is not None)
+        return total
+
+    def locate(self, doc_id: str) -> Optional[_Segment]:
+        for seg in reversed(self.segments):
+            if doc_id not in seg.deleted and seg.reader.has(doc_id):
+                return seg
+        return None
+
+    def postings(self, term: str, section: Callable[[Mapping], Mapping] = _main_index) -> Dict[str, int]:
+        """term's postings in section (the main index by default) of every segment, merged."""
+        merged: Dict[str, int] = {}
+        for seg in self.segments:
+            raw = section(seg.reader.payload).get(term)
+            if not raw:
+                continue
+            stable_id = seg.reader.payload.stable_id
+            for num, tf in raw.items():
+                doc_id = stable_id(num)
+                if doc_id not in seg.deleted:
+                    merged[doc_id] = tf
+        return merged
+
+    def df(self, term: str, section: Callable[[Mapping], Mapping] = _main_index, memo: Optional[Dict[str, int]] = None) -> int:
+        """Live document frequency of term in section; memo (one per section) defaults to the main index's."""
+        memo = self._df if memo is None else memo
+        df = memo.get(term)
+        if df is None:
+            df = memo[term] = len(self.postings(term, section))
+        return df
+
+    def close(self) -> None:
+        for seg in self.segments:
+            seg.reader.payload.close()
+
+class _SegmentDocs(Mapping):
+    def __init__(self, owner: SegmentedIndex):
+        self._owner = owner
+
+    def __getitem__(self, doc_id: str) -> Dict:
+        seg = self._owner.locate(doc_id)
+        if seg is None:
+            raise KeyError(doc_id)
+        return seg.reader.doc(doc_id)
+
+    def __iter__(self) -> Iterator[str]:
+        for seg in self._owner.segments:
+            for doc_id in seg.reader.doc_ids():
+                if doc_id not in seg.deleted:
+                    yield doc_id
+
+    def __len__(self) -> int:
+        return self._owner.n_docs
+
+class _SegmentLengths(_SegmentDocs):
+    def __init__(self, owner: SegmentedIndex, section: Callable[[Mapping], Mapping] = lambda p: p["doc_lengths"]):
+        super().__init__(owner)
+        self._section = section
+
+    def __getitem__(self, doc_id: str) -> int:
+        seg = self._owner.locate(doc_id)
+        if seg is None:
+            raise KeyError(doc_id)
+        bidx = seg.reader.payload
+        return self._section(bidx)[bidx.doc_number(doc_id)]
+
+class _SegmentPostings(Mapping):
+    def __init__(self, owner: SegmentedIndex, section: Callable[[Mapping], Mapping], memo: Dict[str, int]):
+        self._owner = owner
+        self._section = section
+        self._memo = memo
+
+    def __getitem__(self, term: str) -> Dict[str, int]:
+        postings = self._owner.postings(term, self._section)
+        if not postings:
+            raise KeyError(term)
+        return postings
+
+    def __iter__(self) -> Iterator[str]:
+        seen: Set[str] = set()
+        for seg in self._owner.segments:
+            for term in self._section(seg.reader.payload):
+                if term not in seen:
+                    seen.add(term)
+                    if self._owner.df(term, self._section, self._memo):
+                        yield term
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+class _SegmentIdf(_SegmentPostings):
+    def __getitem__(self, term: str) -> float:
+        owner = self._owner
+        df = owner.df(term, self._section, self._memo)
+        if not df:
+            raise KeyError(term)
+        return math.log(1 + (owner.n_docs - df + 0.5) / (df + 0.5))
+
+class _SegmentTermPositions(Mapping):
+    """One term's {doc id: gaps}; each document's gaps are decoded only when looked up."""
+
+    def __init__(self, owner: SegmentedIndex, term: str):
+        self._owner = owner
+        self._per_segment = [(seg, seg.reader.payload[POSITIONS].get(term) or {}) for seg in owner.segments]
+        self._len: Optional[int] = None
+
+    def __getitem__(self, doc_id: str) -> List[int]:
+        seg = self._owner.locate(doc_id)
+        if seg is not None:
+            for candidate, raw in self._per_segment:
+                if candidate is seg:
+                    try:
+                        return raw[seg.reader.payload.doc_number(doc_id)]
+                    except KeyError:
+                        break
+        raise KeyError(doc_id)
+
+    def __iter__(self) -> Iterator[str]:
+        for seg, raw in self._per_segment:
+            for num in raw:
+                doc_id = seg.reader.payload.stable_id(num)
+                if doc_id not in seg.deleted:
+                    yield doc_id
+
+    def __len__(self) -> int:
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+class _SegmentPositions(Mapping):
+    def __init__(self, owner: SegmentedIndex):
+        self._owner = owner
+
+    def __getitem__(self, term: str) -> _SegmentTermPositions:
+        positions = _SegmentTermPositions(self._owner, term)
+        if not any(raw for _, raw in positions._per_segment):
+            raise KeyError(term)
+        return positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._owner["index"])
+
+    def __len__(self) -> int:
+        return len(self._owner["index"])
+
+def open_segments(directory: str, attempts: int = 3) -> SegmentedIndex:
+    manifest_path = manifest_path_for(directory)
+    for attempt in range(attempts):
+        manifest = load_json(manifest_path)
+        try:
+            return SegmentedIndex(directory, manifest)
+        except FileNotFoundError:
+            # A merge swapped the manifest and removed a segment in between.
+            if attempt == attempts - 1:
+                raise
+    raise AssertionError("unreachable")
+
+def _merge_live(target: Dict[str, Dict], source: Mapping, deleted: Set[str]) -> None:
+    for term, postings in source.items():
+        live = {d: v for d, v in postings.items() if d not in deleted}
+        if live:
+            target.setdefault(term, {}).update(live)
+
+class SegmentStore:
+    """
+    Writer side of a segment directory. One writer process at a time; within
+    that process add_batch/delete and merges may run on different threads.
+    """
+
+    def __init__(self, directory: str, policy: Optional[TieredMergePolicy] = None, positions: bool = False):
+        self.directory = Path(directory)
+        self.manifest_path = manifest_path_for(directory)
+        self.policy = policy or TieredMergePolicy()
+        # Store term positions in the segments written from now on.
+        self.positions = positions
+        self._lock = threading.Lock()
+        self._next_segment = 1
+        self._pending: Set[str] = set()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def read_manifest(self) -> Dict:
+        manifest = load_json(self.manifest_path)
+        manifest.setdefault("generation", 0)
+        manifest.setdefault("next_segment", 1)
+        manifest.setdefault("segments", [])
+        return manifest
+
+    def _publish(self, manifest: Dict) -> None:
+        manifest["generation"] += 1
+        manifest["next_segment"] = max(manifest["next_segment"], self._next_segment)
+        save_json(self.manifest_path, manifest)
+
+    def _reserve_name(self, manifest: Dict) -> str:
+        n = max(manifest["next_segment"], self._next_segment)
+        self._next_segment = n + 1
+        name = f"seg_{n:06d}"
+        self._pending.add(name)
+        return name
+
+    def _write_segment(
+        self,
+        name: str,
+        docs: Dict[str, Dict],
+        index: Dict[str, Dict[str, int]],
+        doc_lengths: Dict[str, int],
+        fields: Dict[str, Dict],
+        positions: Optional[Dict[str, Dict[str, List[int]]]],
+    ) -> Dict:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Stable id order lets BinaryIndex.doc_number() binary search the ids.
+        docs = dict(sorted(docs.items()))
+        write_binary_index(str(_segment_path(self.directory, name)), docs, index, doc_lengths, fields, positions)
+        return {
+            "name": name,
+            "n_docs": len(docs),
+            "total_length": sum(doc_lengths.values()),
+            "deleted": [],
+        }
+
+    def _index_segment(self, name: str, docs: Dict[str, Dict]) -> Dict:
+        index, doc_lengths, fields = build_indexes(docs)
+        positions = build_positions(docs) if self.positions else None
+        return self._write_segment(name, docs, index, doc_lengths, fields, positions)
+
+    def _remove_files(self, names: Iterable[str]) -> None:
+        for name in names:
+            path = _segment_path(self.directory, name)
+            for p in (str(path), fields_path_for(str(path))):
+                try:
+                    os.remove(p)
+                except OSError:
+                    # Missing, or still mapped by a reader on Windows;
+                    # collect_garbage() retries later.
+                    pass
+
+    def _tombstone(self, manifest: Dict, doc_ids: Set[str]) -> None:
+        """Tombstone doc_ids in the segments holding them, looked up by id in each segment."""
+        for entry in manifest["segments"]:
+            # Older manifests listed every id of every segment.
+            entry.pop("doc_ids", None)
+            deleted = set(entry["deleted"])
+            bidx = BinaryIndex(str(_segment_path(self.directory, entry["name"])))
+            try:
+                hits = {doc_id for doc_id in doc_ids - deleted if bidx.doc_number(doc_id) is not None}
+            finally:
+                bidx.close()
+            if hits:
+                entry["deleted"] = sorted(deleted | hits)
+
+    def add_batch(self, upserts: Iterable[Dict] = (), deletes: Iterable[str] = ()) -> Optional[str]:
+        """
+        Write the upserted documents as a new segment and tombstone their
+        previous versions and the deleted ids in older segments.
+        """
+        docs = {d["id"]: d for d in upserts}
+        removed = set(deletes) | set(docs)
+        if not removed:
+            return None
+        with self._lock:
+            manifest = self.read_manifest()
+            self._tombstone(manifest, removed)
+            name = None
+            if docs:
+                name = self._reserve_name(manifest)
+                manifest["segments"].append(self._index_segment(name, docs))
+            self._publish(manifest)
+            self._pending.discard(name)
+        return name
+
+    def delete(self, doc_ids: Iterable[str]) -> None:
+        self.add_batch(deletes=doc_ids)
+
+    def replace_all(self, docs: Dict[str, Dict]) -> str:
+        """Replace every segment with a single one holding `docs` (full rebuild)."""
+        with self._lock:
+            manifest = self.read_manifest()
+            old = [e["name"] for e in manifest["segments"]]
+            name = self._reserve_name(manifest)
+            manifest["segments"] = [self._index_segment(name, docs)]
+            self._publish(manifest)
+            self._pending.discard(name)
+        self._remove_files(old)
+        return name
+
+    def merge_once(self, max_docs: Optional[int] = None) -> Optional[str]:
+        with self._lock:
+            manifest = self.read_manifest()
+            names = self.policy.find_merge(manifest["segments"], max_docs)
+            if not names:
+                return None
+            seen_deleted = {e["name"]: set(e["deleted"]) for e in manifest["segments"] if e["name"] in names}
+            name = self._reserve_name(manifest)
+
+        # Build the merged segment without holding the lock; sources are immutable.
+        docs: Dict[str, Dict] = {}
+        index: Dict[str, Dict[str, int]] = {}
+        doc_lengths: Dict[str, int] = {}
+        fields: Dict[str, Dict] = {field: {"index": {}, "doc_lengths": {}} for field in TEXT_FIELDS}
+        positions: Optional[Dict[str, Dict[str, List[int]]]] = {} if self.positions else None
+        order = [e["name"] for e in manifest["segments"] if e["name"] in names]
+        for source in order:
+            bidx = BinaryIndex(str(_segment_path(self.directory, source)))
+            try:
+                payload = bidx.to_payload()
+            finally:
+                bidx.close()
+            deleted = seen_deleted[source]
+            for doc_id, d in payload["docs"].items():
+                if doc_id not in deleted:
+                    docs[doc_id] = d
+                    doc_lengths[doc_id] = payload["doc_lengths"][doc_id]
+            _merge_live(index, payload["index"], deleted)
+            for field in TEXT_FIELDS:
+                _merge_live(fields[field]["index"], payload["fields"][field]["index"], deleted)
+                fields[field]["doc_lengths"].update(
+                    (d, n) for d, n in payload["fields"][field]["doc_lengths"].items() if d not in deleted
+                )
+            if positions is not None:
+                # Sources written without positions get them from their documents.
+                source_positions = payload.get(POSITIONS)
+                if source_positions is None:
+                    source_positions = build_positions(payload["docs"])
+                _merge_live(positions, source_positions, deleted)
+        entry = self._write_segment(name, docs, index, doc_lengths, fields, positions)
+
+        with self._lock:
+            self._pending.discard(name)
+            manifest = self.read_manifest()
+            current = {e["name"]: e for e in manifest["segments"]}
+            if any(n not in current for n in names):
+                self._remove_files([name])
+                return None
+            # Tombstones written to the sources while we were merging.
+            late: Set[str] = set()
+            for source in names:
+                late |= set(current[source]["deleted"]) - seen_deleted[source]
+            entry["deleted"] = sorted(late & set(docs))
+            position = min(i for i, e in enumerate(manifest["segments"]) if e["name"] in names)
+            kept = [e for e in manifest["segments"] if e["name"] not in names]
+            kept.insert(position, entry)
+            manifest["segments"] = kept
+            self._publish(manifest)
+        self._remove_files(names)
+        return name
+
+    def maybe_merge(self, max_docs: Optional[int] = None) -> List[str]:
+        """
+        Run merges until the policy finds nothing left to merge. A merge
+        rewrites every live document of its inputs and runs on the caller's
+        thread, so after a batch pass max_docs (BATCH_MERGE_DOCS): each merge
+        then rewrites at most max_docs documents, and as a batch adds one
+        segment it cascades through at most one merge per tier. Larger merges
+        wait for a run without the bound (segments --merge).
+        """
+        merged = []
+        while True:
+            name = self.merge_once(max_docs)
+            if name is None:
+                return merged
+            merged.append(name)
+
+    def collect_garbage(self) -> None:
+        """Remove segment files that no manifest refers to any more."""
+        with self._lock:
+            live = {e["name"] for e in self.read_manifest()["segments"]} | self._pending
+            stale = {p.stem for p in self.directory.glob("seg_*.bin") if p.stem not in live}
+            self._remove_files(stale)
+
+def main():
+    from .config import SEGMENTS_DIR
+
+    ap = argparse.ArgumentParser(description="Inspect and merge a segmented index")
+    ap.add_argument("--dir", default=SEGMENTS_DIR)
+    ap.add_argument("--merge", action="store_true", help="Run the tiered merge policy until it is satisfied")
+    args = ap.parse_args()
+
+    store = SegmentStore(args.dir)
+    if args.merge:
+        start = time.perf_counter()
+        merged = store.maybe_merge()
+        store.collect_garbage()
+        print(f"Merges: {len(merged)} ({time.perf_counter() - start:.2f}s)")
+    manifest = store.read_manifest()
+    print(f"Generation: {manifest['generation']}")
+    for entry in manifest["segments"]:
+        print(f"  {entry['name']}: {entry['n_docs']} docs, {len(entry['deleted'])} deleted")
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,69 @@
 import json
+import os
 from pathlib import Path
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, Iterator, List, Mapping
 
-def append_jsonl(path: str, records: Iterable[Dict]) -> None:
+from .binindex import BinaryIndex, is_binary_index
+
+def write_jsonl(path: str, records: Iterable[Dict]) -> None:
     p = Path(path)
     p.parent.mkdir(parents=True, exist_ok=True)
     with p.open("w", encoding="utf-8") as f:
         for r in records:
             f.write(json.dumps(r, ensure_ascii=False) + "\n")
 
-def load_jsonl(path: str) -> List[Dict]:
+def iter_jsonl(path: str) -> Iterator[Dict]:
     p = Path(path)
     if not p.exists():
-        return []
-    out = []
+        return
     with p.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            out.append(json.loads(line))
-    return out
+            yield json.loads(line)
+
+def load_jsonl(path: str) -> List[Dict]:
+    return list(iter_jsonl(path))
 
 def save_json(path: str, obj: Dict) -> None:
     p = Path(path)
     p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Write to a sibling file and rename so readers never see a partial index.
+    tmp = p.with_name(p.name + ".tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, p)
 
 def load_json(path: str) -> Dict:
     p = Path(path)
     if not p.exists():
         return {}
     return json.loads(p.read_text(encoding="utf-8"))
+
+def load_index(path: str) -> Mapping:
+    """
+    Load a JSON or binary index, detected from the file contents, or a
+    segment directory (see segments.py). Pending incremental changes (see
+    incremental.py) are overlaid when present.
+    """
+    from .incremental import delta_path_for, IncrementalIndex
+
+    if os.path.isdir(path):
+        from .segments import open_segments
+        return open_segments(path)
+    if os.path.exists(delta_path_for(path)):
+        inc = IncrementalIndex(path)
+        if inc.has_changes():
+            return inc.payload()
+        return inc.base.payload
+    if is_binary_index(path):
+        return BinaryIndex(path)
+    return load_json(path)
+
+def index_watch_paths(path: str) -> List[str]:
+    """Files besides `path` whose changes mean the loaded index is stale."""
+    if os.path.isdir(path):
+        from .segments import manifest_path_for
+        return [manifest_path_for(path)]
+    from .incremental import delta_path_for
+    return [delta_path_for(path)]
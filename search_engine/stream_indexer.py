@@ -0,0 +1,275 @@
+"""
+Bounded-memory index build.
+
+Publications are read one at a time. Their postings (main, stemmed and
+text fields) are buffered per term as packed (doc number, record number,
+tf) triples; when the buffer reaches the memory budget it is written to disk as a run sorted by term. At the end
+the runs are k-way merged term by term straight into a binary index, so
+only one term's postings are materialised at a time.
+
+Besides the buffer, memory holds per-document state: the stable id lookup
+used for de-duplication, doc lengths and stored-field offsets while reading,
+and every document's title and browse key while the writer builds the
+browse and title sections at the end. That state (roughly _DOC_BYTES plus
+the id and twice the title per document) is counted against the budget, so
+the buffer shrinks as the corpus grows; it keeps at least a quarter of the
+budget, beyond which a very large corpus exceeds --memory-mb. Fuzzy entries
+are spooled to disk by the writer.
+Duplicate publication URLs behave as in build_documents: the document keeps
+its first position and the last record wins.
+"""
+import heapq
+import json
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from itertools import groupby, islice
+from operator import itemgetter
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .binindex import BinaryIndexWriter
+from .fields import STEMMED, TEXT_FIELDS
+from .indexer import combined_counts, doc_field_counts, publication_document
+from .preprocess import simple_stem
+
+# Term key length, packed triples byte length.
+_RUN_HEAD = struct.Struct("<II")
+# Rough per-term cost of a buffer entry (dict slot, str, array header).
+_TERM_OVERHEAD = 160
+_POSTING_BYTES = 12
+# Rough per-document cost of the id lookup, length and offset tables, and the
+# title and browse key tuple held while the writer finishes.
+_DOC_BYTES = 400
+# Runs merged at once; more than this are first merged in passes.
+MAX_FAN_IN = 64
+# Buffer/run key prefixes: main field terms sort before stemmed-field terms,
+# then the text fields in TEXT_FIELDS order.
+_MAIN = "\x00"
+_STEMMED = "\x01"
+_TEXT_PREFIXES = {name: chr(2 + i) for i, name in enumerate(TEXT_FIELDS)}
+_PREFIX_FIELDS = {_STEMMED: STEMMED, **{prefix: name for name, prefix in _TEXT_PREFIXES.items()}}
+
+@dataclass
+class StreamBuildStats:
+    records: int = 0
+    docs: int = 0
+    terms: int = 0
+    postings: int = 0
+    runs: int = 0
+    seconds: float = 0.0
+    peak_rss_mb: Optional[float] = None
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _le_run_bytes(data: array) -> bytes:
+    if sys.byteorder != "little":
+        data = array("I", data)
+        data.byteswap()
+    return data.tobytes()
+
+def _write_run(buffer: Dict[str, array], path: Path) -> None:
+    with path.open("wb") as f:
+        for key, term in sorted((t.encode("utf-8"), t) for t in buffer):
+            raw = _le_run_bytes(buffer[term])
+            f.write(_RUN_HEAD.pack(len(key), len(raw)))
+            f.write(key)
+            f.write(raw)
+
+def _read_run(path: Path, run_no: int) -> Iterator[Tuple[bytes, int, array]]:
+    with path.open("rb") as f:
+        while True:
+            head = f.read(_RUN_HEAD.size)
+            if not head:
+                return
+            klen, dlen = _RUN_HEAD.unpack(head)
+            key = f.read(klen)
+            data = array("I")
+            data.frombytes(f.read(dlen))
+            if sys.byteorder != "little":
+                data.byteswap()
+            yield key, run_no, data
+
+def _merged_terms(runs: List[Path]) -> Iterator[Tuple[bytes, List[array]]]:
+    merged = heapq.merge(*(_read_run(path, i) for i, path in enumerate(runs)))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        yield key, [data for _, _, data in group]
+
+def _reduce_runs(runs: List[Path], work_dir: Path) -> List[Path]:
+    """Merge runs in groups of MAX_FAN_IN until at most MAX_FAN_IN remain."""
+    level = 0
+    while len(runs) > MAX_FAN_IN:
+        level += 1
+        reduced = []
+        for i in range(0, len(runs), MAX_FAN_IN):
+            group = runs[i:i + MAX_FAN_IN]
+            out = work_dir / f"run_{level}_{len(reduced):05d}.part"
+            with out.open("wb") as f:
+                for key, parts in _merged_terms(group):
+                    raw = b"".join(_le_run_bytes(part) for part in parts)
+                    f.write(_RUN_HEAD.pack(len(key), len(raw)))
+                    f.write(key)
+                    f.write(raw)
+            for path in group:
+                path.unlink()
+            reduced.append(out)
+        runs = reduced
+    return runs
+
+def _analyze_batch(publications: List[Dict]) -> List[Tuple[Dict, List[Tuple[str, Dict[str, int], int]]]]:
+    out = []
+    for p in publications:
+        d = publication_document(p)
+        if d is not None:
+            out.append((d, doc_field_counts(d)))
+    return out
+
+def _analyzed_documents(
+    publications: Iterable[Dict], workers: int, batch_size: int = 512
+) -> Iterator[Tuple[Dict, List[Tuple[str, Dict[str, int], int]]]]:
+    """(document, per-field term counts) in input order, tokenized on `workers` processes."""
+    if workers <= 1:
+        for p in publications:
+            yield from _analyze_batch([p])
+        return
+    it = iter(publications)
+    pending: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Keep a bounded number of batches in flight so input is not read ahead unboundedly.
+            while len(pending) < 2 * workers:
+                batch = list(islice(it, batch_size))
+                if not batch:
+                    break
+                pending.append(pool.submit(_analyze_batch, batch))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+def build_index_streaming(
+    publications: Iterable[Dict],
+    index_path: str,
+    memory_mb: float = 256,
+    tmp_dir: Optional[str] = None,
+    workers: int = 1,
+) -> StreamBuildStats:
+    """Build a binary index at index_path from an iterable of publications."""
+    start = time.perf_counter()
+    stats = StreamBuildStats()
+    budget = int(memory_mb * 1024 * 1024)
+
+    with tempfile.TemporaryDirectory(prefix="index-build-", dir=tmp_dir) as work:
+        work_dir = Path(work)
+        records = (work_dir / "documents.part").open("w+b")
+        record_offsets = array("Q", [0])
+        doc_numbers: Dict[str, int] = {}
+        doc_ids: List[str] = []
+        latest = array("I")  # doc number -> record number of its current version
+        lengths = array("I")
+        field_lengths = {name: array("I") for name in TEXT_FIELDS}
+        buffer: Dict[str, array] = {}
+        used = 0
+        resident = 0
+        runs: List[Path] = []
+
+        for d, field_counts in _analyzed_documents(publications, workers):
+            tf, length = combined_counts(field_counts)
+            record_no = stats.records
+            stats.records += 1
+            data = json.dumps(d, ensure_ascii=False).encode("utf-8")
+            records.write(data)
+            record_offsets.append(record_offsets[-1] + len(data))
+
+            num = doc_numbers.get(d["id"])
+            if num is None:
+                num = doc_numbers[d["id"]] = len(doc_ids)
+                doc_ids.append(d["id"])
+                latest.append(record_no)
+                lengths.append(0)
+                for arr in field_lengths.values():
+                    arr.append(0)
+                resident += _DOC_BYTES + len(d["id"]) + 2 * len(d.get("title") or "")
+            else:
+                latest[num] = record_no
+            lengths[num] = length
+            for name, _, field_length in field_counts:
+                field_lengths[name][num] = field_length
+
+            stemmed: Dict[str, int] = {}
+            for term, freq in tf.items():
+                stem = simple_stem(term)
+                stemmed[stem] = stemmed.get(stem, 0) + freq
+            keyed = [(_MAIN, tf), (_STEMMED, stemmed)]
+            keyed += [(_TEXT_PREFIXES[name], counts) for name, counts, _ in field_counts]
+            for prefix, counts in keyed:
+                for term, freq in counts.items():
+                    key = prefix + term
+                    postings = buffer.get(key)
+                    if postings is None:
+                        postings = buffer[key] = array("I")
+                        used += _TERM_OVERHEAD + len(key)
+                    postings.extend((num, record_no, freq))
+                    used += _POSTING_BYTES
+            if used >= max(budget - resident, budget // 4):
+                runs.append(work_dir / f"run_{len(runs):05d}.part")
+                _write_run(buffer, runs[-1])
+                buffer = {}
+                used = 0
+        if buffer:
+            runs.append(work_dir / f"run_{len(runs):05d}.part")
+            _write_run(buffer, runs[-1])
+            buffer = {}
+        stats.runs = len(runs)
+        stats.docs = len(doc_ids)
+        runs = _reduce_runs(runs, work_dir)
+
+        writer = BinaryIndexWriter(index_path, work)
+        try:
+            records.flush()
+            for num, doc_id in enumerate(doc_ids):
+                record_no = latest[num]
+                records.seek(record_offsets[record_no])
+                fields = records.read(record_offsets[record_no + 1] - record_offsets[record_no])
+                writer.add_document(doc_id, fields, lengths[num], tuple(field_lengths[name][num] for name in TEXT_FIELDS))
+            records.close()
+
+            for key, parts in _merged_terms(runs):
+                plist: List[Tuple[int, int]] = []
+                for data in parts:
+                    for num, record_no, freq in zip(data[0::3], data[1::3], data[2::3]):
+                        # Postings of superseded duplicate records are dropped here.
+                        if latest[num] == record_no:
+                            plist.append((num, freq))
+                if not plist:
+                    continue
+                plist.sort()
+                prefix, term = key[:1].decode("ascii"), key[1:].decode("utf-8")
+                if prefix != _MAIN:
+                    writer.add_term(term, plist, field=_PREFIX_FIELDS[prefix])
+                    continue
+                writer.add_term(term, plist)
+                stats.terms += 1
+                stats.postings += len(plist)
+            writer.finish()
+        finally:
+            writer.close()
+            records.close()
+
+    stats.seconds = round(time.perf_counter() - start, 3)
+    stats.peak_rss_mb = peak_rss_mb()
+    return stats
@@ -0,0 +1,162 @@
+"""
+Search box suggestions: prefix completions of index terms and titles.
+
+Two completion tables are built with the index (payload["suggest"] =
+{"terms": {"texts", "weights"}, "titles": {"texts", "weights"}}): the index
+terms weighted by document frequency, and the document titles weighted by
+the number of documents carrying them. Each table is sorted by
+suggest_key() (lowercased, whitespace collapsed), so the entries starting
+with a prefix are one contiguous range found by binary search, and the top k
+of that range is a partial sort of its weights. In a binary index the term
+table is the term dictionary itself (weights are the stored document
+frequencies) and titles are read straight from the mmap. Indexes stored
+without the tables get them derived once per payload.
+"""
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .fields import per_payload
+
+SUGGEST = "suggest"
+DEFAULT_TOP = 8
+# Longer inputs are not something anyone is still typing.
+MAX_PREFIX = 200
+# Sorts after every character a prefix can be followed by.
+_PAST_PREFIX = "\U0010ffff"
+
+def suggest_key(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def build_titles(titles: Iterable[str]) -> Tuple[List[str], List[int]]:
+    """(titles, counts): one entry per distinct suggest_key(), sorted by it."""
+    counts: Dict[str, List] = {}
+    for title in titles:
+        key = suggest_key(title or "")
+        if not key:
+            continue
+        entry = counts.get(key)
+        if entry is None:
+            # The first spelling seen is the one suggested.
+            counts[key] = [" ".join(title.split()), 1]
+        else:
+            entry[1] += 1
+    keys = sorted(counts)
+    return [counts[k][0] for k in keys], [counts[k][1] for k in keys]
+
+def build_suggest(index: Mapping, docs: Mapping) -> Dict:
+    """Stored (JSON) form of the completion tables."""
+    terms = sorted(index)
+    titles, counts = build_titles(d.get("title") or "" for d in docs.values())
+    return {
+        "terms": {"texts": terms, "weights": [len(index[t]) for t in terms]},
+        "titles": {"texts": titles, "weights": counts},
+    }
+
+class Completions:
+    """texts sorted by suggest_key(), with a parallel array of weights."""
+
+    def __init__(self, texts: Sequence[str], weights: np.ndarray):
+        self.texts = texts
+        self.weights = weights
+
+    @classmethod
+    def from_stored(cls, stored: Mapping) -> "Completions":
+        return cls(stored["texts"], np.asarray(stored["weights"], dtype=np.uint32))
+
+    def as_stored(self) -> Dict:
+        return {"texts": list(self.texts), "weights": self.weights.tolist()}
+
+    def span(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect_left(self.texts, prefix, key=suggest_key)
+        return lo, bisect_left(self.texts, prefix + _PAST_PREFIX, lo, key=suggest_key)
+
+    def entry(self, key: str) -> Tuple[Optional[str], int]:
+        """(text, weight) of the entry whose suggest_key() is key, or (None, 0)."""
+        lo = bisect_left(self.texts, key, key=suggest_key)
+        if lo < len(self.texts) and suggest_key(self.texts[lo]) == key:
+            return self.texts[lo], int(self.weights[lo])
+        return None, 0
+
+    def top(self, prefix: str, k: int) -> List[Tuple[str, int]]:
+        """(text, weight) of the k heaviest entries starting with prefix; ties in sorted order."""
+        lo, hi = self.span(prefix)
+        if hi <= lo or k <= 0:
+            return []
+        weights = self.weights[lo:hi]
+        picked = np.arange(len(weights))
+        if len(weights) > k:
+            kth = np.partition(weights, len(weights) - k)[len(weights) - k]
+            above = np.flatnonzero(weights > kth)
+            picked = np.concatenate((above, np.flatnonzero(weights == kth)[:k - len(above)]))
+        picked = picked[np.lexsort((picked, -weights[picked].astype(np.int64)))]
+        return [(self.texts[lo + i], int(weights[i])) for i in picked.tolist()]
+
+class ChangedCompletions:
+    """
+    Completions with the entries of some keys replaced: changed maps
+    suggest_key() -> (text, weight), weight 0 dropping the entry. top() asks
+    the base table for k more entries than there are changed keys under the
+    prefix, which always covers the k heaviest unchanged ones.
+    """
+
+    def __init__(self, base: Completions, changed: Dict[str, Tuple[Optional[str], int]]):
+        self.base = base
+        self.changed = changed
+        self._keys = sorted(changed)
+
+    def top(self, prefix: str, k: int) -> List[Tuple[str, int]]:
+        if k <= 0:
+            return []
+        lo = bisect_left(self._keys, prefix)
+        touched = self._keys[lo:bisect_left(self._keys, prefix + _PAST_PREFIX, lo)]
+        found = {suggest_key(t): (t, w) for t, w in self.base.top(prefix, k + len(touched))}
+        for key in touched:
+            found[key] = self.changed[key]
+        ranked = sorted((-w, key, t) for key, (t, w) in found.items() if w > 0)
+        return [(t, -w) for w, _, t in ranked[:k]]
+
+class Suggester:
+    """Completion tables of one index."""
+
+    def __init__(self, terms: Completions, titles: Completions):
+        self.terms = terms
+        self.titles = titles
+
+    @classmethod
+    def from_stored(cls, stored: Mapping) -> "Suggester":
+        return cls(Completions.from_stored(stored["terms"]), Completions.from_stored(stored["titles"]))
+
+    def as_stored(self) -> Dict:
+        return {"terms": self.terms.as_stored(), "titles": self.titles.as_stored()}
+
+    def complete(self, text: str, k: int = DEFAULT_TOP) -> Dict[str, List[Dict]]:
+        """
+        {"terms", "titles"}: up to k completions of text's last word (with the
+        words before it kept), and up to k titles starting with text. A
+        trailing space ends the last word, so only titles are completed.
+        """
+        key = suggest_key(text)
+        if not key or len(key) > MAX_PREFIX:
+            return {"terms": [], "titles": []}
+        head, _, last = key.rpartition(" ")
+        ended = text[-1:].isspace()
+        terms = [] if ended else self.terms.top(last, k)
+        return {
+            "terms": [{"text": f"{head} {t}" if head else t, "weight": w} for t, w in terms],
+            "titles": [{"text": t, "weight": w} for t, w in self.titles.top(key + " " if ended else key, k)],
+        }
+
+def suggest_for(payload: Mapping) -> Suggester:
+    """payload's stored completion tables, or ones built once per payload."""
+    stored = payload.get(SUGGEST)
+    if isinstance(stored, Suggester):
+        return stored
+    return per_payload(SUGGEST, payload, lambda p: Suggester.from_stored(
+        stored if stored is not None else build_suggest(p.get("index", {}), p.get("docs", {}))
+    ))
+
+def suggest(payload: Mapping, text: str, k: int = DEFAULT_TOP) -> Dict[str, List[Dict]]:
+    return suggest_for(payload).complete(text, k)
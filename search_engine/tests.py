@@ -0,0 +1,895 @@
+import os
+import random
+import string
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from unittest import mock
+
+import requests
+
+from . import crawler
+from .array_index import ArrayIndex, BinaryArrayIndex, array_index_for
+from .binindex import BinaryIndex, fields_path_for, write_binary_index
+from .browse import browse_page
+from .config import PUBLICATIONS_JSONL, CrawlConfig
+from .fetch_cache import FetchCache
+from .fields import STEMMED, TEXT_FIELDS, stemmed_payload, text_fields
+from .fuzzy import FUZZY, LONG_TERM, build_fuzzy, expand_terms, fuzzy_eligible, fuzzy_index_for
+from .incremental import IncrementalIndex, OverlayPayload, StableIdReader, delta_path_for, diff_publications
+from .index_cache import IndexHolder
+from .indexer import build_documents, build_indexes, build_indexes_parallel, save_index
+from .indexer import doc_field_texts
+from .positions import build_positions, positioned_terms
+from .preprocess import tokenize
+from .positions import FIELD_STARTS, PROXIMITY_WINDOW, field_spans
+from .search import search, search_page
+from .segments import SegmentedIndex, SegmentStore, TieredMergePolicy
+from .storage import load_index, load_json, load_jsonl, save_json
+from .stream_indexer import build_index_streaming
+from .suggest import DEFAULT_TOP, MAX_PREFIX, suggest, suggest_for, suggest_key
+from .topk import TopKStats
+
+def _publications():
+    return load_jsonl(PUBLICATIONS_JSONL)
+
+def _build(
+    directory: str, publications=None, json_name: str = "index.json", bin_name: str = "index.bin", positions: bool = False
+):
+    """Write a JSON and a binary index of publications into directory; returns their paths."""
+    docs = build_documents(publications if publications is not None else _publications())
+    index, doc_lengths, fields = build_indexes(docs)
+    doc_positions = build_positions(docs) if positions else None
+    json_path = os.path.join(directory, json_name)
+    bin_path = os.path.join(directory, bin_name)
+    save_index(json_path, docs, index, doc_lengths, fields, doc_positions)
+    write_binary_index(bin_path, docs, index, doc_lengths, fields, doc_positions)
+    return json_path, bin_path
+
+def _publication(slug: str, title: str, abstract: str = "", authors=("Jane Smith",), year: str = "2024") -> Dict:
+    return {
+        "publication_url": f"https://example.org/en/publications/{slug}/",
+        "title": title,
+        "abstract": abstract,
+        "authors": list(authors),
+        "year": year,
+    }
+
+def _urls(results):
+    return sorted(r["publication_url"].rstrip("/").rsplit("/", 1)[-1] for r in results)
+
+QUERIES = [
+    "neural network", "machine learning", "covid", "optimisation algorithm", "graph networks model",
+    "england", "data", "physics informed", "learning learning", "zzzz",
+]
+
+class _IndexTestCase(unittest.TestCase):
+    """A JSON and a binary index of the bundled publications, built once per class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.dir = cls._tmp.name
+        cls.json_path, cls.bin_path = _build(cls.dir)
+        cls.json = load_json(cls.json_path)
+        cls.binary = BinaryIndex(cls.bin_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.binary.close()
+        cls._tmp.cleanup()
+
+def _ranking(results):
+    return [(r["publication_url"], r["score"]) for r in results]
+
+class EngineEquivalenceTests(_IndexTestCase):
+    def test_engines_and_formats_rank_identically(self):
+        for use_stemming in (False, True):
+            for q in QUERIES:
+                expected = _ranking(search(q, self.json, top_k=20, use_stemming=use_stemming, engine="dict"))
+                for payload in (self.json, self.binary):
+                    for engine in ("dict", "numpy", "maxscore"):
+                        with self.subTest(q=q, stem=use_stemming, engine=engine, binary=payload is self.binary):
+                            got = search(q, payload, top_k=20, use_stemming=use_stemming, engine=engine)
+                            self.assertEqual(_ranking(got), expected)
+
+    def test_binary_arrays_decode_only_queried_terms(self):
+        arrays = array_index_for(BinaryIndex(self.bin_path))
+        self.assertIsInstance(arrays, BinaryArrayIndex)
+        search("neural network", arrays._field, top_k=5, engine="maxscore")
+        self.assertEqual(len(arrays._postings), 2)
+
+    def test_binary_max_scores_match_computed_bounds(self):
+        arrays = array_index_for(self.binary)
+        json_arrays = array_index_for(self.json)
+        for term in ("neural", "network", "covid"):
+            slot, json_slot = arrays.slot_of(term), json_arrays.slot_of(term)
+            self.assertAlmostEqual(arrays.max_score_at(slot), json_arrays.max_score_at(json_slot))
+            self.assertAlmostEqual(arrays.max_score_at(slot, 1.5, 0.5), json_arrays.max_score_at(json_slot, 1.5, 0.5))
+
+    def test_binary_max_scores_cover_every_term(self):
+        arrays = array_index_for(self.binary)
+        json_arrays = array_index_for(self.json)
+        for k1, b in ((1.2, 0.75), (1.5, 0.5)):
+            maxes, json_maxes = arrays.max_scores(k1, b), json_arrays.max_scores(k1, b)
+            self.assertEqual(len(maxes), len(json_maxes))
+            for term in list(self.json["index"])[::50]:
+                with self.subTest(term=term, k1=k1, b=b):
+                    self.assertAlmostEqual(maxes[arrays.slot_of(term)], json_maxes[json_arrays.slot_of(term)])
+                    self.assertAlmostEqual(arrays.max_score_at(arrays.slot_of(term), k1, b),
+                                           json_maxes[json_arrays.slot_of(term)])
+
+    def test_building_arrays_does_not_block_cached_payloads(self):
+        cached = array_index_for(self.json)
+        building, release = threading.Event(), threading.Event()
+        real_from_payload = ArrayIndex.from_payload.__func__
+
+        def slow_from_payload(cls, payload):
+            building.set()
+            release.wait(5)
+            return real_from_payload(cls, payload)
+
+        other = dict(self.json)
+        with mock.patch.object(ArrayIndex, "from_payload", classmethod(slow_from_payload)):
+            thread = threading.Thread(target=array_index_for, args=(other,))
+            thread.start()
+            self.assertTrue(building.wait(5))
+            start = time.perf_counter()
+            self.assertIs(array_index_for(self.json), cached)
+            self.assertLess(time.perf_counter() - start, 1.0)
+            release.set()
+            thread.join()
+
+def _changed_publications(publications):
+    """publications with ten removed, one retitled and the rest kept."""
+    changed = [dict(p) for p in publications[10:]]
+    changed[0]["title"] = "Neural network learning for covid data"
+    return changed
+
+class BinaryIndexBuildTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.addCleanup(self._tmp.cleanup)
+        self.docs = build_documents(_publications())
+
+    def _write(self, name, built, docs=None):
+        path = os.path.join(self.dir, name)
+        write_binary_index(path, docs or self.docs, *built)
+        return Path(path).read_bytes(), Path(fields_path_for(path)).read_bytes()
+
+    def test_parallel_build_is_byte_identical(self):
+        serial = self._write("serial.bin", build_indexes(self.docs))
+        self.assertEqual(self._write("parallel.bin", build_indexes_parallel(self.docs, 2)), serial)
+
+    def test_stream_build_matches_in_memory_build(self):
+        built = self._write("memory.bin", build_indexes(self.docs))
+        path = os.path.join(self.dir, "stream.bin")
+        # A tiny budget spills several runs.
+        stats = build_index_streaming(_publications(), path, memory_mb=0.05, tmp_dir=self.dir)
+        self.assertGreater(stats.runs, 1)
+        self.assertEqual((Path(path).read_bytes(), Path(fields_path_for(path)).read_bytes()), built)
+
+    def test_build_id_follows_content(self):
+        first = self._write("a.bin", build_indexes(self.docs))
+        docs = dict(list(self.docs.items())[1:])
+        other = self._write("b.bin", build_indexes(docs), docs)
+        ids = []
+        for name in ("a.bin", "b.bin"):
+            bidx = BinaryIndex(os.path.join(self.dir, name))
+            ids.append(bidx.toc["build_id"])
+            bidx.close()
+        self.assertNotEqual(ids[0], ids[1])
+        self.assertNotEqual(first, other)
+
+class StemmedFieldTests(unittest.TestCase):
+    PUBLICATIONS = [
+        _publication("optimization", "Convex optimization"),
+        _publication("optimizations", "Compiler optimizations"),
+        _publication("optimisation", "Portfolio optimisation"),
+        _publication("optimising", "Optimising schedules"),
+        _publication("optimised", "Optimised networks", "An optimises step."),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        json_path, bin_path = _build(cls._tmp.name, cls.PUBLICATIONS)
+        cls.payloads = {"json": load_json(json_path), "binary": BinaryIndex(bin_path)}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.payloads["binary"].close()
+        cls._tmp.cleanup()
+
+    def _matches(self, q: str, use_stemming: bool) -> Dict[str, List[str]]:
+        return {
+            name: _urls(search(q, payload, top_k=10, use_stemming=use_stemming, engine=engine))
+            for name, payload in self.payloads.items()
+            for engine in ("dict", "maxscore")
+        }
+
+    def test_stemmed_field_is_stored(self):
+        for name, payload in self.payloads.items():
+            with self.subTest(payload=name):
+                index = stemmed_payload(payload)["index"]
+                self.assertEqual(sorted(index["optimis"].values()), [1, 2])
+                self.assertEqual(sorted(index["optimization"].values()), [1, 1])
+                self.assertNotIn("optimise", index)
+
+    def test_suffixes_are_stripped_but_spellings_are_not_merged(self):
+        # simple_stem strips inflections; British and American spellings stay apart.
+        cases = [
+            ("optimization", False, ["optimization"]),
+            ("optimization", True, ["optimization", "optimizations"]),
+            ("optimizations", True, ["optimization", "optimizations"]),
+            ("optimisation", True, ["optimisation"]),
+            # No stem matches; fuzzy expansion reaches the nearest terms.
+            ("optimise", True, ["optimised", "optimising"]),
+            ("optimised", False, ["optimised"]),
+            ("optimises", True, ["optimised", "optimising"]),
+        ]
+        for q, use_stemming, expected in cases:
+            with self.subTest(q=q, stem=use_stemming):
+                for name, urls in self._matches(q, use_stemming).items():
+                    self.assertEqual(urls, expected, name)
+
+def _osa(a: str, b: str) -> int:
+    """Unbounded optimal string alignment distance, the textbook DP."""
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[-1][-1]
+
+class FuzzyTests(_IndexTestCase):
+    def test_json_index_does_not_store_the_deletion_index(self):
+        self.assertNotIn(FUZZY, self.json)
+        self.assertIn("fuzzy_keys", self.binary.toc["sections"])
+        self.assertNotIn(FUZZY, self.binary.to_payload())
+
+    def test_json_deletion_index_is_built_once_per_payload(self):
+        payload = dict(self.json)
+        with mock.patch("search_engine.fuzzy.build_fuzzy", wraps=build_fuzzy) as build:
+            first = fuzzy_index_for(payload)
+            for q in ("nueral netwrok", "machne lerning", "nueral"):
+                search(q, payload)
+            self.assertIs(fuzzy_index_for(payload), first)
+        build.assert_called_once()
+
+    def test_json_deletion_index_first_query_cost(self):
+        # The JSON index stores no deletion index; the first fuzzy query builds it.
+        rng = random.Random(0)
+        words = ("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12))) for _ in range(10000))
+        vocabulary = set(words)
+        payload = {"index": {term: {} for term in vocabulary}}
+        start = time.perf_counter()
+        fuzzy = fuzzy_index_for(payload)
+        self.assertLess(time.perf_counter() - start, 5.0)
+        term = next(t for t in sorted(vocabulary) if len(t) >= LONG_TERM)
+        self.assertIn((term, 1), fuzzy.lookup(term[:-1] + ("a" if term[-1] != "a" else "b")))
+
+    def test_lookup_matches_brute_force(self):
+        vocabulary = [t for t in self.json["index"] if fuzzy_eligible(t)]
+        misspelled = []
+        for term in vocabulary[::150]:
+            misspelled += [term[1:], term[:2] + "e" + term[2:], term[:-1] + "x", term[1] + term[0] + term[2:]]
+        for payload in (self.json, self.binary):
+            fuzzy = fuzzy_index_for(payload)
+            for q in misspelled:
+                if not fuzzy_eligible(q):
+                    continue
+                limit = 2 if len(q) >= LONG_TERM else 1
+                distances = {v: _osa(q, v) for v in vocabulary if abs(len(v) - len(q)) <= limit}
+                nearest = min((d for d in distances.values() if d <= limit), default=None)
+                expected = {(v, d) for v, d in distances.items() if d == nearest}
+                with self.subTest(q=q, binary=payload is self.binary):
+                    self.assertEqual(set(fuzzy.lookup(q)), expected)
+
+    def test_misspelled_query_finds_the_corrected_results(self):
+        for payload in (self.json, self.binary):
+            corrected = {r["publication_url"] for r in search("neural network", payload, top_k=50)}
+            misspelled = search("nueral netwrok", payload, top_k=50)
+            self.assertEqual({r["publication_url"] for r in misspelled}, corrected)
+            self.assertEqual(search("nueral netwrok", payload, fuzzy=False), [])
+
+    def test_known_terms_are_not_expanded(self):
+        self.assertEqual(expand_terms(["neural", "network"], self.json, self.json["index"]), {})
+        weights = expand_terms(["neural", "netwrok"], self.json, self.json["index"])
+        self.assertEqual(weights, {"network": 0.5})
+
+class SuggestTests(_IndexTestCase):
+    PREFIXES = ["n", "ne", "neural", "neural netw", "Neural   NETW", "a", "a ", "an ", "a hybrid", "covid", "zzzz"]
+
+    def _expected(self, text: str, k: int):
+        """Top k completions by a scan of the stored terms and titles, heaviest first."""
+        key = suggest_key(text)
+        head, _, last = key.rpartition(" ")
+        ended = text.endswith(" ")
+        if ended:
+            key += " "
+        terms = [] if ended else [
+            (f"{head} {t}" if head else t, len(postings))
+            for t, postings in self.json["index"].items() if t.startswith(last)
+        ]
+        titles: Dict[str, int] = {}
+        for d in self.json["docs"].values():
+            title = suggest_key(d.get("title") or "")
+            if title and title.startswith(key):
+                titles[title] = titles.get(title, 0) + 1
+        ranked = lambda entries: sorted(entries, key=lambda e: (-e[1], e[0]))[:k]
+        return ranked(terms), ranked(titles.items())
+
+    def test_complete_matches_brute_force(self):
+        for payload in (self.json, self.binary):
+            suggester = suggest_for(payload)
+            for text in self.PREFIXES:
+                for k in (1, 3, DEFAULT_TOP):
+                    got = suggester.complete(text, k)
+                    with self.subTest(text=text, k=k, binary=payload is self.binary):
+                        terms, titles = self._expected(text, k)
+                        self.assertEqual([(t["text"], t["weight"]) for t in got["terms"]], terms)
+                        self.assertEqual([(suggest_key(t["text"]), t["weight"]) for t in got["titles"]], titles)
+
+    def test_trailing_space_completes_titles_only(self):
+        got = suggest(self.json, "a ")
+        self.assertEqual(got["terms"], [])
+        self.assertTrue(got["titles"])
+
+    def test_empty_and_overlong_input(self):
+        for text in ("", "   ", "n" * (MAX_PREFIX + 1)):
+            self.assertEqual(suggest(self.binary, text), {"terms": [], "titles": []})
+
+    def test_built_once_per_payload(self):
+        self.assertIs(suggest_for(self.json), suggest_for(self.json))
+
+class IncrementalTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.addCleanup(self._tmp.cleanup)
+        self.old = _publications()[:60]
+        self.new = _changed_publications(self.old) + _publications()[60:]
+        self.json_path, self.bin_path = _build(self.dir, self.old)
+        rebuilt = os.path.join(self.dir, "rebuilt")
+        os.mkdir(rebuilt)
+        self.expected = load_json(_build(rebuilt, self.new)[0])
+
+    def _apply(self, index_path):
+        inc = IncrementalIndex(index_path)
+        inc.apply(*diff_publications(self.old, self.new))
+        inc.commit()
+        return inc
+
+    def _assert_matches_rebuild(self, payload):
+        self.assertEqual(len(payload["docs"]), len(self.expected["docs"]))
+        for q in QUERIES:
+            with self.subTest(q=q):
+                self.assertEqual(_ranking(search(q, payload, top_k=20)), _ranking(search(q, self.expected, top_k=20)))
+
+    def test_overlay_scores_match_full_rebuild(self):
+        for index_path in (self.json_path, self.bin_path):
+            with self.subTest(base=index_path):
+                self._apply(index_path)
+                payload = load_index(index_path)
+                self.assertIsInstance(payload, OverlayPayload)
+                self._assert_matches_rebuild(payload)
+                payload.close()
+
+    def test_overlay_sections_match_full_rebuild(self):
+        base_dir, rebuilt_dir = os.path.join(self.dir, "positions"), os.path.join(self.dir, "positions-rebuilt")
+        os.mkdir(base_dir)
+        os.mkdir(rebuilt_dir)
+        paths = _build(base_dir, self.old, positions=True)
+        expected = load_json(_build(rebuilt_dir, self.new, positions=True)[0])
+        queries = ['"neural network"', '"machine learning" data', 'title:"neural network"', "optimisation", "nueral netwrk"]
+        for index_path in paths:
+            self._apply(index_path)
+            payload = load_index(index_path)
+            self.assertIsInstance(payload, OverlayPayload)
+            # Stored sections are merged, not rebuilt from the documents.
+            self.assertIs(text_fields(payload)["title"]["index"], payload["fields"]["title"]["index"])
+            self.assertIs(stemmed_payload(payload), payload[STEMMED])
+            self.assertIsInstance(array_index_for(payload), BinaryArrayIndex)
+            for q in queries:
+                for use_stemming in (False, True):
+                    for engine in ("dict", "numpy", "maxscore"):
+                        with self.subTest(base=index_path, q=q, stem=use_stemming, engine=engine):
+                            got = search(q, payload, top_k=20, use_stemming=use_stemming, engine=engine)
+                            want = search(q, expected, top_k=20, use_stemming=use_stemming, engine=engine)
+                            self.assertEqual(_ranking(got), _ranking(want))
+                with self.subTest(base=index_path, q=q, fields=True):
+                    got = search(q, payload, top_k=20, field_weights={"title": 3.0, "abstract": 1.0})
+                    want = search(q, expected, top_k=20, field_weights={"title": 3.0, "abstract": 1.0})
+                    self.assertEqual(_ranking(got), _ranking(want))
+            for text in ("ne", "neural n", "a", "covid"):
+                with self.subTest(base=index_path, suggest=text):
+                    self.assertEqual(suggest(payload, text), suggest(expected, text))
+            for year in (None, "2024", "2021"):
+                for page in (1, 2, 3):
+                    with self.subTest(base=index_path, year=year, page=page):
+                        got = browse_page(payload, page, per_page=7, year=year)
+                        want = browse_page(expected, page, per_page=7, year=year)
+                        self.assertEqual(got["years"], want["years"])
+                        self.assertEqual(
+                            [r["publication_url"] for r in got["results"]], [r["publication_url"] for r in want["results"]]
+                        )
+            payload.close()
+
+    def test_compact_folds_delta_into_new_base(self):
+        inc = self._apply(self.bin_path)
+        inc.compact(json_path=self.json_path, bin_path=self.bin_path)
+        inc.base.payload.close()
+        self.assertFalse(os.path.exists(delta_path_for(self.bin_path)))
+        for index_path in (self.json_path, self.bin_path):
+            payload = load_index(index_path)
+            self.assertNotIsInstance(payload, OverlayPayload)
+            self._assert_matches_rebuild(payload)
+
+    def test_delta_of_an_older_base_is_ignored(self):
+        self._apply(self.json_path)
+        time.sleep(0.01)
+        _build(self.dir, self.old)
+        self.assertFalse(IncrementalIndex(self.json_path).has_changes())
+
+class SegmentTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.addCleanup(self._tmp.cleanup)
+        self.docs = build_documents(_publications())
+        self.store = SegmentStore(
+            os.path.join(self.dir, "segments"), TieredMergePolicy(segments_per_tier=3, floor_docs=20), positions=True
+        )
+
+    def _ingest(self):
+        """
+        Add the documents in batches of 15, each batch also retitling two
+        documents and deleting one from the batch before; returns the live docs.
+        """
+        ids = list(self.docs)
+        live: Dict[str, Dict] = {}
+        for i in range(0, len(ids), 15):
+            batch = [self.docs[d] for d in ids[i:i + 15]]
+            retitled = [{**live[d], "title": live[d]["title"] + " revised zebra"} for d in ids[i - 5:i - 3]] if i else []
+            deleted = [ids[i - 1]] if i else []
+            live.update((d["id"], d) for d in batch + retitled)
+            for d in deleted:
+                live.pop(d)
+            self.store.add_batch(batch + retitled, deleted)
+        return live
+
+    def _assert_matches(self, live):
+        rebuilt = os.path.join(self.dir, "rebuilt")
+        os.makedirs(rebuilt, exist_ok=True)
+        index, doc_lengths, fields = build_indexes(live)
+        save_index(os.path.join(rebuilt, "index.json"), live, index, doc_lengths, fields, build_positions(live))
+        expected = load_json(os.path.join(rebuilt, "index.json"))
+        payload = load_index(str(self.store.directory))
+        queries = QUERIES + ["zebra revised", '"neural network"', 'title:"neural network"', "optimisation"]
+        try:
+            self.assertEqual(len(payload["docs"]), len(live))
+            for q in queries:
+                for engine, options in (("dict", {}), ("maxscore", {}), ("dict", {"use_stemming": True}),
+                                        ("dict", {"field_weights": {"title": 3.0, "abstract": 1.0}})):
+                    with self.subTest(q=q, engine=engine, **options):
+                        # Equal scores may come out in another order than in a single index.
+                        got = _ranking(search(q, payload, top_k=100, engine=engine, **options))
+                        want = _ranking(search(q, expected, top_k=100, engine=engine, **options))
+                        self.assertEqual(sorted(got), sorted(want))
+                        self.assertEqual([s for _, s in got], [s for _, s in want])
+        finally:
+            payload.close()
+
+    def _segment_ids(self, name: str) -> Set[str]:
+        bidx = BinaryIndex(str(self.store.directory / f"{name}.bin"))
+        try:
+            return set(StableIdReader(bidx).doc_ids())
+        finally:
+            bidx.close()
+
+    def test_tombstones_follow_segment_ids(self):
+        live = self._ingest()
+        segments = self.store.read_manifest()["segments"]
+        self.assertEqual(len(segments), 5)
+        holders = []
+        for entry in segments:
+            self.assertNotIn("doc_ids", entry)
+            ids = self._segment_ids(entry["name"])
+            self.assertLessEqual(set(entry["deleted"]), ids)
+            holders.append(ids - set(entry["deleted"]))
+        self.assertEqual(set().union(*holders), set(live))
+        self.assertEqual(sum(len(h) for h in holders), len(live))
+        self._assert_matches(live)
+
+    def test_merge_matches_single_index(self):
+        live = self._ingest()
+        before = {e["name"] for e in self.store.read_manifest()["segments"]}
+        merged = self.store.maybe_merge()
+        self.store.collect_garbage()
+        after = self.store.read_manifest()["segments"]
+        self.assertTrue(merged)
+        self.assertLess(len(after), len(before))
+        for name in before - {e["name"] for e in after}:
+            self.assertFalse((self.store.directory / f"{name}.bin").exists())
+        self._assert_matches(live)
+
+    def test_merge_size_is_bounded_at_batch_time(self):
+        self._ingest()
+        self.assertEqual(self.store.maybe_merge(max_docs=10), [])
+        merged = self.store.maybe_merge(max_docs=50)
+        self.assertTrue(merged)
+        for entry in self.store.read_manifest()["segments"]:
+            if entry["name"] in merged:
+                self.assertLessEqual(entry["n_docs"], 50)
+
+    def test_manifest_with_doc_ids_is_slimmed(self):
+        live = self._ingest()
+        manifest = self.store.read_manifest()
+        for entry in manifest["segments"]:
+            entry["doc_ids"] = sorted(self._segment_ids(entry["name"]))
+        save_json(self.store.manifest_path, manifest)
+        victim = next(iter(live))
+        self.store.delete([victim])
+        live.pop(victim)
+        self.assertFalse(any("doc_ids" in e for e in self.store.read_manifest()["segments"]))
+        self._assert_matches(live)
+
+    def test_failed_open_closes_opened_segments(self):
+        self._ingest()
+        manifest = self.store.read_manifest()
+        manifest["segments"].append({"name": "seg_999999", "n_docs": 1, "deleted": []})
+        opened: List[BinaryIndex] = []
+
+        def tracking(path):
+            opened.append(BinaryIndex(path))
+            return opened[-1]
+
+        with mock.patch("search_engine.segments.BinaryIndex", side_effect=tracking):
+            with self.assertRaises(FileNotFoundError):
+                SegmentedIndex(str(self.store.directory), manifest)
+        self.assertEqual(len(opened), 5)
+        self.assertTrue(all(bidx._mm.closed and bidx._fmm.closed for bidx in opened))
+
+def _has_phrase(d: Dict, phrase) -> bool:
+    """Brute force: phrase's indexed terms at their offsets within one field of d."""
+    for _, text in doc_field_texts(d):
+        tokens = tokenize(text)
+        for start in range(len(tokens)):
+            if all(start + offset < len(tokens) and tokens[start + offset] == term for term, offset in phrase):
+                return True
+    return False
+
+class PhraseTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        json_path, bin_path = _build(cls._tmp.name, positions=True)
+        cls.json = load_json(json_path)
+        cls.binary = BinaryIndex(bin_path)
+        titles = [tokenize(d["title"]) for d in cls.json["docs"].values()]
+        # Title openings (with any stopwords inside) plus phrases that span fields or never occur.
+        cls.phrases = [" ".join(t[:3]) for t in titles[:15] if len(t) >= 3]
+        cls.phrases += ["neural networks", "machine learning", "social networks", "networks neural", "zzzz networks"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.binary.close()
+        cls._tmp.cleanup()
+
+    def test_phrase_results_match_brute_force(self):
+        docs = self.json["docs"]
+        for text in self.phrases:
+            phrase = positioned_terms(text)
+            if len(phrase) < 2:
+                continue
+            expected = sorted(d["publication_url"] for d in docs.values() if _has_phrase(d, phrase))
+            for payload in (self.json, self.binary):
+                with self.subTest(phrase=text, binary=payload is self.binary):
+                    results = search(f'"{text}"', payload, top_k=100)
+                    self.assertEqual(sorted(r["publication_url"] for r in results), expected)
+
+    def test_phrase_ranks_its_matches_by_bm25(self):
+        # Same scores as the unquoted query, restricted to the phrase matches.
+        for payload in (self.json, self.binary):
+            phrased = _ranking(search('"neural networks"', payload, top_k=100, proximity_weight=0))
+            plain = dict(_ranking(search("neural networks", payload, top_k=100, proximity_weight=0)))
+            self.assertTrue(phrased)
+            self.assertEqual(phrased, sorted(phrased, key=lambda r: -r[1]))
+            for url, score in phrased:
+                self.assertEqual(score, plain[url])
+
+    def test_proximity_rerank_keeps_the_matching_documents(self):
+        for q in ("neural networks", "machine learning model"):
+            plain = search(q, self.binary, top_k=100, proximity_weight=0)
+            reranked = search(q, self.binary, top_k=100)
+            self.assertEqual(sorted(r["publication_url"] for r in reranked), sorted(r["publication_url"] for r in plain))
+
+def _widened_publications(copies: int = 4):
+    """Each bundled publication `copies` times, under new URLs with shortened abstracts, so scores differ."""
+    out = []
+    for p in _publications():
+        words = (p.get("abstract") or "").split()
+        for i in range(copies):
+            out.append({**p, "publication_url": f"{p['publication_url'].rstrip('/')}-{i}/",
+                        "abstract": " ".join(words[:max(10, len(words) - 15 * i)])})
+    return out
+
+class CursorPagingTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        json_path, bin_path = _build(cls._tmp.name, _widened_publications(), positions=True)
+        cls.json = load_json(json_path)
+        cls.binary = BinaryIndex(bin_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.binary.close()
+        cls._tmp.cleanup()
+
+    def _paged(self, q, payload, page_size, **kwargs):
+        results, cursor = [], None
+        while True:
+            page = search_page(q, payload, page_size=page_size, cursor=cursor, **kwargs)
+            results += page.results
+            cursor = page.next_cursor
+            if cursor is None:
+                return results
+
+    def test_pages_follow_a_deep_search_past_the_proximity_window(self):
+        for q in ("data analysis model based", "neural network", "covid", '"machine learning"'):
+            for payload in (self.json, self.binary):
+                for engine in ("dict", "numpy", "maxscore"):
+                    with self.subTest(q=q, engine=engine, binary=payload is self.binary):
+                        full = search(q, payload, top_k=1000, engine=engine)
+                        if q == "data analysis model based":
+                            self.assertGreater(len(full), PROXIMITY_WINDOW + 20)
+                        for page_size in (7, 25):
+                            self.assertEqual(_ranking(self._paged(q, payload, page_size, engine=engine)), _ranking(full))
+
+    def test_deep_top_k_keeps_the_reranked_head(self):
+        q = "data analysis model based"
+        for engine in ("dict", "numpy", "maxscore"):
+            deep = _ranking(search(q, self.binary, top_k=1000, engine=engine))
+            for top_k in (1, 10, PROXIMITY_WINDOW, PROXIMITY_WINDOW + 50):
+                with self.subTest(engine=engine, top_k=top_k):
+                    self.assertEqual(_ranking(search(q, self.binary, top_k=top_k, engine=engine)), deep[:top_k])
+
+    def test_maxscore_prunes_below_the_proximity_margin(self):
+        # Scoring the whole window would score every match of this query.
+        q = "neural network"
+        shallow, full = TopKStats(), TopKStats()
+        search(q, self.binary, top_k=10, engine="maxscore", stats=shallow)
+        search(q, self.binary, top_k=PROXIMITY_WINDOW, engine="maxscore", stats=full, proximity_weight=0)
+        self.assertLess(shallow.docs_scored, full.docs_scored)
+        self.assertGreater(shallow.postings_skipped, 0)
+
+    def test_offset_pages_match_cursor_pages(self):
+        q = "data analysis model based"
+        full = _ranking(search(q, self.json, top_k=1000))
+        for offset in (0, 95, PROXIMITY_WINDOW, 150):
+            page = search_page(q, self.json, page_size=20, offset=offset)
+            self.assertEqual(_ranking(page.results), full[offset:offset + 20])
+
+class FieldPhraseTests(unittest.TestCase):
+    PUBLICATIONS = [
+        _publication("adjacent", "Neural networks for graphs", "We study graphs."),
+        _publication("apart", "Networks of neural cells", "Cells in the brain."),
+        _publication("abstract-only", "Graph methods", "Deep neural networks are used here."),
+        _publication("across-fields", "Training neural", "Networks converge slowly."),
+    ]
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _payloads(self, positions):
+        json_path, bin_path = _build(self._tmp.name, self.PUBLICATIONS, positions=positions)
+        binary = BinaryIndex(bin_path)
+        self.addCleanup(binary.close)
+        return load_json(json_path), binary
+
+    def test_quoted_clause_value_is_a_phrase_within_its_field(self):
+        for payload in self._payloads(positions=True):
+            with self.subTest(binary=isinstance(payload, BinaryIndex)):
+                self.assertEqual(_urls(search('title:"neural networks"', payload)), ["adjacent"])
+                self.assertEqual(_urls(search('abstract:"neural networks"', payload)), ["abstract-only"])
+                self.assertEqual(_urls(search("title:neural title:networks", payload)), ["adjacent", "apart"])
+                self.assertEqual(_urls(search('author:smith "neural networks"', payload)), ["abstract-only", "adjacent"])
+
+    def test_field_phrase_reads_field_starts_from_the_index(self):
+        json_payload, binary = self._payloads(positions=True)
+        for num, d in enumerate(json_payload["docs"].values()):
+            spans = field_spans(d)
+            expected = [spans[name][0] for name in TEXT_FIELDS]
+            self.assertEqual(json_payload[FIELD_STARTS][d["id"]], expected)
+            self.assertEqual(list(binary[FIELD_STARTS][num]), expected)
+        with mock.patch("search_engine.bm25f.field_spans", side_effect=AssertionError("re-tokenized")):
+            for payload in (json_payload, binary):
+                self.assertEqual(_urls(search('title:"neural networks"', payload)), ["adjacent"])
+        # Indexes written before field starts were stored fall back to the documents.
+        del json_payload[FIELD_STARTS]
+        self.assertEqual(_urls(search('title:"neural networks"', json_payload)), ["adjacent"])
+
+    def test_quoted_clause_value_without_positions_is_a_bag_of_words(self):
+        for payload in self._payloads(positions=False):
+            with self.subTest(binary=isinstance(payload, BinaryIndex)):
+                self.assertEqual(_urls(search('title:"neural networks"', payload)), ["adjacent", "apart"])
+
+class IndexHolderTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.addCleanup(self._tmp.cleanup)
+
+    def test_index_created_after_start_is_picked_up(self):
+        bin_path = os.path.join(self.dir, "index.bin")
+        json_path = os.path.join(self.dir, "index.json")
+        resolve = lambda: bin_path if os.path.exists(bin_path) else json_path
+        holder = IndexHolder(resolve, loader=load_index, check_interval=0)
+        self.assertEqual(holder.get().payload, {})
+
+        _build(self.dir)
+        snap = holder.get()
+        self.assertIsInstance(snap.payload, BinaryIndex)
+        self.assertEqual(snap.path, bin_path)
+
+    def test_replaced_binary_index_is_closed_after_release(self):
+        _, bin_path = _build(self.dir)
+        holder = IndexHolder(bin_path, loader=load_index, check_interval=0, close_replaced=True)
+        with holder.use() as old:
+            time.sleep(0.01)
+            _build(self.dir)
+            os.utime(bin_path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+            new = holder.acquire()
+            self.assertGreater(new.generation, old.generation)
+            # Still in use: the old mmap stays readable.
+            self.assertFalse(old.payload._mm.closed)
+            self.assertTrue(old.payload["docs"][0])
+        self.assertTrue(old.payload._mm.closed)
+        self.assertFalse(new.payload._mm.closed)
+        holder.release(new)
+
+    def test_unused_snapshot_is_closed_on_reload(self):
+        _, bin_path = _build(self.dir)
+        holder = IndexHolder(bin_path, loader=load_index, check_interval=0, close_replaced=True)
+        first = holder.get()
+        holder.reload()
+        self.assertTrue(first.payload._mm.closed)
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+_SEED = "https://portal.example.org/en/organisations/ics-research-centre-for-computational-science-and-mathematical-mo"
+
+class _FakeSite:
+    """Pages by URL with ETags; answers conditional GETs and records every request."""
+
+    def __init__(self, clock: _FakeClock, crawl_delay: int = 5):
+        self.clock = clock
+        self.robots = f"User-agent: *\nCrawl-delay: {crawl_delay}\n"
+        self.pages: Dict[str, Tuple[str, str]] = {}
+        self.requests: List[Tuple[float, str, int]] = []
+        links = "".join(f'<a href="/en/publications/paper-{i}">Paper number {i}</a>' for i in range(3))
+        self.set(_SEED, f"<html><body>{links}</body></html>")
+        for i in range(3):
+            self.set(f"https://portal.example.org/en/publications/paper-{i}",
+                     f"<html><body><h1>Paper number {i}</h1><p>Published 2024</p></body></html>")
+
+    def set(self, url: str, html: str, etag: Optional[str] = None) -> None:
+        self.pages[url] = (html, etag or f'"{len(self.requests)}-{hash(html)}"')
+
+    def get(self, url: str, timeout=None, headers=None) -> requests.Response:
+        r = requests.Response()
+        r.url = url
+        if url.endswith("/robots.txt"):
+            r.status_code, r._content = 200, self.robots.encode()
+            return r
+        html, etag = self.pages[url]
+        r.status_code = 304 if (headers or {}).get("If-None-Match") == etag else 200
+        r._content = b"" if r.status_code == 304 else html.encode()
+        r.headers["ETag"] = etag
+        self.requests.append((self.clock(), url, r.status_code))
+        return r
+
+class _FakeSession:
+    def __init__(self, site: _FakeSite):
+        self.site = site
+        self.headers: Dict[str, str] = {}
+
+    def get(self, url, timeout=None, headers=None):
+        return self.site.get(url, timeout=timeout, headers=headers)
+
+class CrawlerTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.cache_path = os.path.join(self._tmp.name, "fetch_cache.json")
+        self.clock = _FakeClock()
+        self.site = _FakeSite(self.clock)
+
+    def _crawl(self, concurrent: bool = False):
+        with mock.patch.object(crawler.requests, "Session", lambda: _FakeSession(self.site)):
+            c = crawler.PoliteCrawler(_SEED, CrawlConfig(delay_seconds=1.0), cache=FetchCache(self.cache_path))
+            c.limiter = crawler.HostRateLimiter(c.delay_seconds, clock=self.clock, sleep=self.clock.sleep)
+            start = len(self.site.requests)
+            pubs = c.crawl_concurrent(2) if concurrent else c.crawl_bfs()
+        return pubs, c.cache.stats, self.site.requests[start:]
+
+    def assertSpaced(self, requests_made, delay):
+        starts = [t for t, _, _ in requests_made]
+        self.assertTrue(all(b - a >= delay for a, b in zip(starts, starts[1:])), starts)
+
+    def test_limiter_spaces_request_starts_per_host(self):
+        limiter = crawler.HostRateLimiter(2.0, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(limiter.reserve("https://a.example/1"), 0)
+        self.assertEqual(limiter.reserve("https://a.example/2"), 2.0)
+        self.assertEqual(limiter.reserve("https://a.example/3"), 4.0)
+        self.assertEqual(limiter.reserve("https://b.example/1"), 0)
+        # Time spent on the response counts towards the interval.
+        self.clock.now += 10
+        self.assertEqual(limiter.reserve("https://a.example/4"), 0)
+        self.clock.now += 0.5
+        self.assertEqual(limiter.reserve("https://a.example/5"), 1.5)
+
+    def test_limiter_burst(self):
+        limiter = crawler.HostRateLimiter(1.0, burst=3, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual([limiter.reserve("https://a.example/") for _ in range(5)], [0, 0, 0, 1.0, 2.0])
+
+    def test_robots_crawl_delay_spaces_every_fetch(self):
+        for concurrent in (False, True):
+            with self.subTest(concurrent=concurrent):
+                pubs, stats, made = self._crawl(concurrent)
+                self.assertEqual(sorted(p["title"] for p in pubs), [f"Paper number {i}" for i in range(3)])
+                self.assertEqual(len(made), 4)
+                self.assertSpaced(made, 5)
+
+    def test_revalidation_reuses_the_cached_parse(self):
+        first, stats, _ = self._crawl()
+        self.assertEqual((stats.fetched, stats.parsed, stats.not_modified), (4, 4, 0))
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        again, stats, made = self._crawl()
+        self.assertEqual([code for _, _, code in made], [304] * 4)
+        self.assertEqual((stats.fetched, stats.parsed, stats.not_modified), (0, 0, 4))
+        self.assertEqual(again, first)
+        # 304s use up the crawl delay like any other request.
+        self.assertSpaced(made, 5)
+
+    def test_changed_and_unchanged_bodies(self):
+        self._crawl()
+        paper = "https://portal.example.org/en/publications/paper-1"
+        self.site.set(paper, "<html><body><h1>Paper number 1, revised</h1><p>2025</p></body></html>")
+        html, _ = self.site.pages[paper.replace("1", "2")]
+        self.site.set(paper.replace("1", "2"), html, etag='"new-etag"')
+        pubs, stats, _ = self._crawl()
+        self.assertEqual((stats.fetched, stats.parsed, stats.unchanged, stats.not_modified), (2, 1, 1, 2))
+        self.assertIn("Paper number 1, revised", [p["title"] for p in pubs])
+
+    def test_cache_is_saved_while_crawling(self):
+        saves = []
+        real_save = FetchCache.save
+
+        def save(cache):
+            saves.append(len(cache))
+            real_save(cache)
+
+        with mock.patch.object(crawler, "CACHE_SAVE_EVERY", 2), mock.patch.object(FetchCache, "save", save):
+            self._crawl()
+        self.assertEqual(saves, [2, 4, 4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import heapq
+import math
+from bisect import bisect_left
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .array_index import ArrayIndex, DEFAULT_B, DEFAULT_K1
+
+# Relative slack on upper-bound comparisons: bounds are summed in a different
+# order than real scores, so they can be off by a few ulps.
+_EPS = 1e-9
+
+@dataclass
+class TopKStats:
+    postings_total: int = 0
+    postings_evaluated: int = 0
+    postings_skipped: int = 0
+    docs_scored: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+class _TermList:
+    __slots__ = ("term", "first_qi", "mult", "ids", "tfs", "pos", "idf", "ub", "cur")
+
+    def __init__(self, term, first_qi, mult, ids, tfs, pos, idf, ub):
+        self.term = term
+        self.first_qi = first_qi
+        self.mult = mult
+        self.ids = ids
+        self.tfs = tfs
+        self.pos = pos
+        self.idf = idf
+        self.ub = ub
+        self.cur = 0
+
+def _below(bound: float, theta: float) -> bool:
+    return bound < theta - _EPS * max(1.0, abs(theta))
+
+def maxscore_top_k(
+    arrays: ArrayIndex,
+    query_terms: List[str],
+    k: int,
+    k1: float = DEFAULT_K1,
+    b: float = DEFAULT_B,
+    stats: Optional[TopKStats] = None,
+    ceiling: Optional[float] = None,
+    floor_rank: int = 0,
+    margin: float = 0.0,
+) -> List[Tuple[object, float]]:
+    """
+    Document-at-a-time MaxScore retrieval over the ArrayIndex postings.
+
+    Returns exactly what exhaustive BM25 scoring followed by a stable sort
+    returns (same documents, scores and tie order), while skipping postings
+    of low-impact terms that cannot lift a document into the current top k.
+
+    With a ceiling only documents scoring at most ceiling are ranked (the
+    page after a cursor). With floor_rank, documents scoring more than margin
+    below the floor_rank-th best are dropped as well, and pruned like any
+    document below the top k.
+    """
+    stats = stats if stats is not None else TopKStats()
+    total_before, evaluated_before = stats.postings_total, stats.postings_evaluated
+    if k <= 0 or not arrays.n_docs or arrays.avgdl <= 0:
+        return []
+    norm = arrays.norms_list(k1, b)
+
+    lists: Dict[str, _TermList] = {}
+    for qi, term in enumerate(query_terms):
+        if term in lists:
+            lists[term].mult += 1
+            continue
+        slot = arrays.slot_of(term)
+        if slot is None:
+            continue
+        ids, tfs = arrays.postings_at(slot)
+        n = len(ids)
+        if not n:
+            continue
+        pos = np.arange(n)
+        if n > 1 and np.any(ids[1:] < ids[:-1]):
+            pos = np.argsort(ids, kind="stable")
+            ids, tfs = ids[pos], tfs[pos]
+        lists[term] = _TermList(
+            term, qi, 1, ids.tolist(), tfs.tolist(), pos, arrays.idf_at(slot), arrays.max_score_at(slot, k1, b)
+        )
+        stats.postings_total += n
+    if not lists:
+        return []
+
+    # Low-impact lists first; prefix[i] bounds a document that only occurs in
+    # ordered[0..i].
+    ordered = sorted(lists.values(), key=lambda t: t.ub * t.mult)
+    prefix: List[float] = []
+    acc = 0.0
+    for t in ordered:
+        acc += t.ub * t.mult
+        prefix.append(acc)
+
+    heap: List[Tuple[float, int, int, int]] = []
+    best: List[float] = []
+    theta = floor = -math.inf
+    first_essential = 0
+
+    while True:
+        doc = None
+        for t in ordered[first_essential:]:
+            if t.cur < len(t.ids):
+                d = t.ids[t.cur]
+                if doc is None or d < doc:
+                    doc = d
+        if doc is None:
+            break
+
+        contrib: Dict[str, float] = {}
+        partial = 0.0
+        for t in ordered[first_essential:]:
+            if t.cur < len(t.ids) and t.ids[t.cur] == doc:
+                tf = t.tfs[t.cur]
+                denom = tf + norm[doc]
+                s = t.idf * (tf * (k1 + 1)) / (denom if denom else 1.0)
+                contrib[t.term] = s
+                partial += s * t.mult
+                t.cur += 1
+                stats.postings_evaluated += 1
+
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if _below(partial + prefix[i], theta):
+                pruned = True
+                break
+            t = ordered[i]
+            if t.cur < len(t.ids) and t.ids[t.cur] < doc:
+                t.cur = bisect_left(t.ids, doc, t.cur)
+            if t.cur < len(t.ids) and t.ids[t.cur] == doc:
+                tf = t.tfs[t.cur]
+                denom = tf + norm[doc]
+                s = t.idf * (tf * (k1 + 1)) / (denom if denom else 1.0)
+                contrib[t.term] = s
+                partial += s * t.mult
+                t.cur += 1
+                stats.postings_evaluated += 1
+        if pruned:
+            continue
+
+        # Exact score, accumulated in query order like bm25_score.
+        score = 0.0
+        for term in query_terms:
+            s = contrib.get(term)
+            if s is not None:
+                score = score + s
+        stats.docs_scored += 1
+        if ceiling is not None and score > ceiling:
+            continue
+        if floor_rank:
+            if len(best) < floor_rank:
+                heapq.heappush(best, score)
+            elif score > best[0]:
+                heapq.heapreplace(best, score)
+            if len(best) == floor_rank:
+                floor = best[0] - margin
+        first = min((lists[term] for term in contrib), key=lambda t: t.first_qi)
+        entry = (score, -first.first_qi, -int(first.pos[first.cur - 1]), doc)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, entry)
+        elif not floor_rank:
+            continue
+
+        theta = max(heap[0][0] if len(heap) == k else -math.inf, floor)
+        while first_essential < len(ordered) and _below(prefix[first_essential], theta):
+            first_essential += 1
+
+    stats.postings_skipped += (stats.postings_total - total_before) - (stats.postings_evaluated - evaluated_before)
+    ranked = sorted(heap, key=lambda e: (-e[0], -e[1], -e[2]))
+    if floor_rank:
+        ranked = [e for e in ranked if not _below(e[0], floor)]
+    return [(arrays.doc_keys[e[3]], e[0]) for e in ranked]